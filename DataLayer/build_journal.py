@@ -0,0 +1,83 @@
+import json
+import os
+
+
+class BuildJournal:
+    """
+    Append-only checkpoint journal of a vector store build, stored in the date directory.
+
+    Every step of a build is recorded as one JSON line, and a line is only written once the step it records
+    has been committed to disk, so an interrupted build can be resumed from the last committed batch.
+
+    Records:
+        start: the build mode ('full' or 'incremental'), the source path, the files to ingest and,
+            for incremental builds, the previous date directory and the changed and deleted files.
+        copied: the previous vector store was copied (incremental builds).
+        stale_deleted: the chunks of the changed and deleted files were deleted (incremental builds).
+        batch: a batch of files was parsed, chunked, embedded and written, with the IDs of its chunks.
+        complete: the build finished.
+        update: an in-place update of the complete vector store (watch mode) started, with the changed and
+            deleted files.
+        updated: the in-place update was committed (chunks manifest and files details saved).
+
+    Attributes:
+        path (str): The path of the journal file.
+    """
+    def __init__(self, date_path):
+        self.path = fr"{date_path}\build_journal.jsonl"
+
+    def exists(self):
+        """
+        :return: Whether the journal file exists.
+        """
+        return os.path.exists(self.path)
+
+    def record(self, event, **data):
+        """
+        Append a record to the journal and sync it to disk.
+
+        :param event: the name of the recorded step
+        :param data: the data of the step
+        """
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"event": event, **data}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self):
+        """
+        Read the journal records. A torn last line (from a crash while writing) is ignored.
+
+        :return: list of records
+        """
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def get_state(self):
+        """
+        Summarize the journal into the state of the build.
+
+        :return: dict with the start record ('start'), the recorded events ('events'), the files already
+            written ('done_files'), the IDs of their chunks per file ('chunks_manifest') and the record of an
+            interrupted in-place update ('pending_update', or None).
+        """
+        state = {"start": None, "events": set(), "done_files": set(), "chunks_manifest": {}, "pending_update": None}
+        for record in self.read():
+            event = record["event"]
+            state["events"].add(event)
+            if event == "start":
+                state["start"] = record
+            elif event == "batch":
+                state["done_files"].update(record["files"])
+                state["chunks_manifest"].update(record["chunks"])
+            elif event == "update":
+                state["pending_update"] = record
+            elif event == "updated":
+                state["pending_update"] = None
+        return state
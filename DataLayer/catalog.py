@@ -0,0 +1,244 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from DataLayer.data_module import load_dict, is_date_dir_complete
+from config import settings
+
+
+class Catalog:
+    """
+    SQLite catalog of the versions, their date snapshots, file manifests and conversations.
+
+    The catalog answers the listings of the menu with indexed queries, instead of walking the version,
+    date and conversation directories and opening their metadata files. Versions and conversations update it
+    transactionally when they are created or changed.
+    Data directories created before the catalog existed are imported the first time the catalog is opened.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        with self._conn:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value TEXT);"
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "date_path TEXT PRIMARY KEY, version TEXT NOT NULL, source_path TEXT, embedding_model TEXT, "
+                "created_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS snapshots_version ON snapshots (version, created_at);"
+                "CREATE TABLE IF NOT EXISTS files ("
+                "date_path TEXT NOT NULL REFERENCES snapshots (date_path) ON DELETE CASCADE, "
+                "path TEXT NOT NULL, details TEXT, PRIMARY KEY (date_path, path));"
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "conv_id TEXT PRIMARY KEY, version TEXT NOT NULL, date_path TEXT NOT NULL, description TEXT, "
+                "num_messages INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated_at);"
+                "CREATE INDEX IF NOT EXISTS conversations_version ON conversations (version, updated_at);"
+            )
+
+    def is_imported(self):
+        """
+        :return: Whether the data directory was already imported into the catalog.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM catalog_meta WHERE key = 'imported'").fetchone()
+        return row is not None
+
+    def import_data_dir(self, data_dir):
+        """
+        Import the completed date directories and the conversations of a data directory into the catalog.
+
+        :param data_dir: the data directory
+        """
+        if os.path.exists(data_dir):
+            for version_name in os.listdir(data_dir):
+                if not version_name.startswith("v_"):
+                    continue
+                version_path = fr"{data_dir}\{version_name}"
+                for date in os.listdir(version_path):
+                    date_path = fr"{version_path}\{date}"
+                    if is_date_dir_complete(date_path):
+                        self._import_date_dir(version_name[2:], date, date_path)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO catalog_meta (key, value) VALUES ('imported', ?)",
+                               (str(time.time()),))
+
+    def _import_date_dir(self, version_num, date, date_path):
+        vector_store_meta = load_dict(fr"{date_path}\vector_store_meta")
+        files_details_path = fr"{date_path}\files_details"
+        files_details = load_dict(files_details_path) if os.path.exists(f"{files_details_path}.json") else {}
+        created_at = datetime.strptime(date, '%H-%M_%d-%m-%Y').timestamp()
+        self.add_snapshot(version_num, date_path, vector_store_meta["source_path"],
+                          vector_store_meta.get("embedding_model"), files_details, created_at=created_at)
+
+        convs_path = fr"{date_path}\convs"
+        if not os.path.exists(convs_path):
+            return
+        for conv_dir_name in os.listdir(convs_path):
+            conv_dir = fr"{convs_path}\{conv_dir_name}"
+            if not os.path.exists(fr"{conv_dir}\conv_meta.json"):
+                continue
+            conv_meta = load_dict(fr"{conv_dir}\conv_meta")
+            updated_at = os.path.getmtime(fr"{conv_dir}\conv_meta.json")
+            self.add_conversation(conv_meta["id"], version_num, date_path, conv_meta["description"],
+                                  created_at=updated_at)
+
+    def add_snapshot(self, version_num, date_path, source_path, embedding_model, files_details, created_at=None):
+        """
+        Record a completed date snapshot of a version, with its file manifest.
+
+        :param version_num: the version of the snapshot
+        :param date_path: the date directory of the snapshot
+        :param source_path: the source path of the vector store
+        :param embedding_model: the name of the embedding model of the vector store
+        :param files_details: dictionary of the source files and their details
+        :param created_at: creation timestamp. Defaults to now.
+        """
+        created_at = time.time() if created_at is None else created_at
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM snapshots WHERE date_path = ?", (date_path,))
+            self._conn.execute(
+                "INSERT INTO snapshots (date_path, version, source_path, embedding_model, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (date_path, version_num, source_path, embedding_model, created_at))
+            self._conn.executemany(
+                "INSERT INTO files (date_path, path, details) VALUES (?, ?, ?)",
+                ((date_path, path, json.dumps(details)) for path, details in files_details.items()))
+
+    def update_files(self, date_path, changed_files, deleted_files):
+        """
+        Update the file manifest of a date snapshot that was updated in place.
+
+        :param date_path: the date directory of the snapshot
+        :param changed_files: dictionary of the added or modified files and their details
+        :param deleted_files: list of the deleted files
+        """
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM files WHERE date_path = ? AND path = ?",
+                                   ((date_path, path) for path in deleted_files))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (date_path, path, details) VALUES (?, ?, ?)",
+                ((date_path, path, json.dumps(details)) for path, details in changed_files.items()))
+
+    def add_conversation(self, conv_id, version_num, date_path, description, created_at=None):
+        """
+        Record a new conversation.
+
+        :param conv_id: the conversation ID
+        :param version_num: the version of the conversation
+        :param date_path: the date directory of the conversation
+        :param description: the description of the conversation
+        :param created_at: creation timestamp. Defaults to now.
+        """
+        created_at = time.time() if created_at is None else created_at
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations "
+                "(conv_id, version, date_path, description, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (conv_id, version_num, date_path, description, created_at, created_at))
+
+    def update_conversation(self, conv_id, description=None, num_messages=None):
+        """
+        Update a conversation's description and/or number of messages, and mark it as updated now.
+
+        :param conv_id: the conversation ID
+        :param description: the new description. If None, the description is not changed.
+        :param num_messages: the new number of messages. If None, the number of messages is not changed.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE conversations SET description = COALESCE(?, description), "
+                "num_messages = COALESCE(?, num_messages), updated_at = ? WHERE conv_id = ?",
+                (description, num_messages, time.time(), conv_id))
+
+    def get_conversation(self, conv_id):
+        """
+        Return a conversation's version and date directory.
+
+        :param conv_id: the conversation ID
+        :return: dictionary with the keys conv_id, version, date_path, description and num_messages,
+            or None if the conversation is not in the catalog
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT conv_id, version, date_path, description, num_messages FROM conversations WHERE conv_id = ?",
+                (conv_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("conv_id", "version", "date_path", "description", "num_messages"), row))
+
+    def list_versions(self, limit=None, offset=0):
+        """
+        Return the versions with the source path of their latest snapshot, ordered by version.
+
+        :param limit: maximal number of versions to return. If None, all the versions are returned.
+        :param offset: number of versions to skip
+        :return: list of dictionaries with the keys version and source_path
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, source_path FROM snapshots AS s WHERE created_at = "
+                "(SELECT MAX(created_at) FROM snapshots WHERE version = s.version) "
+                "GROUP BY version ORDER BY version LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)).fetchall()
+        return [{"version": version, "source_path": source_path} for version, source_path in rows]
+
+    def list_conversations(self, version_num=None, limit=None, offset=0):
+        """
+        Return the conversations, most recently updated first.
+
+        :param version_num: the version of the conversations. If None, the conversations of all versions are returned.
+        :param limit: maximal number of conversations to return. If None, all the conversations are returned.
+        :param offset: number of conversations to skip
+        :return: list of dictionaries with the keys version, source_path, conv_id and description
+        """
+        query = ("SELECT c.version, s.source_path, c.conv_id, c.description FROM conversations AS c "
+                 "LEFT JOIN snapshots AS s ON s.date_path = c.date_path ")
+        params = []
+        if version_num is not None:
+            query += "WHERE c.version = ? "
+            params.append(version_num)
+        query += "ORDER BY c.updated_at DESC LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [{"version": version, "source_path": source_path, "conv_id": conv_id, "description": description}
+                for version, source_path, conv_id, description in rows]
+
+    def close(self):
+        """
+        Close the underlying database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Return the process-wide catalog, stored under DATA_DIR.
+    The data directory is imported into the catalog the first time it is opened.
+
+    :return: Catalog
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            os.makedirs(settings.DATA_DIR, exist_ok=True)
+            catalog = Catalog(fr"{settings.DATA_DIR}\catalog.sqlite")
+            if not catalog.is_imported():
+                catalog.import_data_dir(settings.DATA_DIR)
+            _catalog = catalog
+    return _catalog
@@ -0,0 +1,221 @@
+import json
+import os
+
+
+class ConversationLog:
+    """
+    Append-only JSONL log of a conversation's messages, stored in the conversation directory.
+
+    Every turn appends its new messages (one serialized message per line) instead of rewriting the whole history.
+    Appends are flushed immediately and fsynced in batches of fsync_every appends. The last messages can be
+    read from the end of the file without parsing the whole history.
+    The number of messages is kept in an index file with the log size it was counted at, so opening a log only
+    counts the lines appended after the index was last written (e.g. before a crash) instead of rescanning it.
+    A conversation stored in the legacy memory.json format is migrated to the log the first time it is opened.
+
+    Attributes:
+        path (str): The path of the log file.
+        fsync_every (int): Number of appends between two fsyncs.
+    """
+    def __init__(self, conv_dir, fsync_every=8):
+        self.path = fr"{conv_dir}\memory.jsonl"
+        self.legacy_path = fr"{conv_dir}\memory.json"
+        self.index_path = fr"{conv_dir}\memory_index.json"
+        self.fsync_every = max(1, fsync_every)
+
+        self._unsynced = 0
+        self._num_messages = None
+        self._size = 0
+        self._needs_compaction = False
+        if not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+            self._migrate_legacy()
+        self._repair_torn_tail()
+
+    def _migrate_legacy(self):
+        with open(self.legacy_path, "r") as f:
+            messages = json.load(f)
+        self._rewrite(messages)
+        os.remove(self.legacy_path)
+
+    def _repair_torn_tail(self):
+        """
+        Truncate a partial last line left by a crash while appending, so the next append starts on a new line.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            block_size = 64 * 1024
+            position = size
+            while position > 0:
+                start = max(0, position - block_size)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    return
+                position = start
+            f.truncate(0)
+
+    def append(self, messages):
+        """
+        Append serialized messages to the log.
+
+        :param messages: list of serialized messages (see messages_to_dict)
+        """
+        if not messages:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(message) + "\n" for message in messages))
+            f.flush()
+            self._unsynced += 1
+            if self._num_messages is not None:
+                self._num_messages += len(messages)
+                self._size = f.tell()
+            if self._unsynced >= self.fsync_every:
+                os.fsync(f.fileno())
+                self._unsynced = 0
+                self._save_index()
+
+    def sync(self):
+        """
+        Fsync the appends that were not synced yet.
+        """
+        if self._unsynced and os.path.exists(self.path):
+            with open(self.path, "a", encoding="utf-8") as f:
+                os.fsync(f.fileno())
+            self._unsynced = 0
+            self._save_index()
+
+    def count(self):
+        """
+        Count the messages of the log without parsing them.
+        The count is read from the index; only the lines appended after the index was written are counted.
+
+        :return: number of messages
+        """
+        if self._num_messages is None:
+            self._num_messages, self._size = self._load_index()
+        return self._num_messages
+
+    def _load_index(self):
+        """
+        :return: tuple of (number of messages, size of the log)
+        """
+        if not os.path.exists(self.path):
+            return 0, 0
+        size = os.path.getsize(self.path)
+        num_messages, start = 0, 0
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+                if index["size"] <= size:
+                    num_messages, start = index["num_messages"], index["size"]
+            except (ValueError, KeyError):
+                pass
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                num_messages += block.count(b"\n")
+        if start != size:
+            self._write_index(num_messages, size)
+        return num_messages, size
+
+    def _save_index(self):
+        if self._num_messages is not None:
+            self._write_index(self._num_messages, self._size)
+
+    def _write_index(self, num_messages, size):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"num_messages": num_messages, "size": size}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _parse_lines(self, lines):
+        messages = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line))
+            except ValueError:
+                self._needs_compaction = True
+        return messages
+
+    def read_all(self):
+        """
+        Read all the messages of the log. Corrupt lines are skipped.
+
+        :return: list of serialized messages
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return self._parse_lines(f)
+
+    def read_tail(self, num_messages):
+        """
+        Read the last messages of the log, reading the file backwards from its end.
+
+        :param num_messages: number of messages to read
+        :return: list of serialized messages, oldest first
+        """
+        if num_messages <= 0 or not os.path.exists(self.path):
+            return []
+        block_size = 64 * 1024
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            while position > 0 and data.count(b"\n") <= num_messages:
+                start = max(0, position - block_size)
+                f.seek(start)
+                data = f.read(position - start) + data
+                position = start
+        lines = data.decode("utf-8", errors="replace").splitlines()
+        if position > 0:
+            lines = lines[1:]  # the first line may be partial
+        return self._parse_lines(lines)[-num_messages:]
+
+    def maybe_compact(self):
+        """
+        Compact the log if corrupt lines were found while reading it.
+        Messages are never updated or deleted, so a log without corrupt lines is already compact.
+
+        :return: True if the log was compacted
+        """
+        if not self._needs_compaction:
+            return False
+        self.compact()
+        return True
+
+    def compact(self):
+        """
+        Rewrite the log in canonical form (one valid message per line), dropping corrupt lines.
+        The log is replaced atomically.
+        """
+        self._rewrite(self.read_all())
+        self._needs_compaction = False
+
+    def _rewrite(self, messages):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(message) + "\n" for message in messages))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        # The index of the old log must not be applied to the new one
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        os.replace(tmp_path, self.path)
+        self._unsynced = 0
+        self._num_messages, self._size = len(messages), size
+        self._write_index(len(messages), size)
@@ -3,6 +3,7 @@ import json
 import os
 import time
 
+from DataLayer.file_scanner import scan_files
 from config import settings
 
 
@@ -47,10 +48,23 @@ def delete_date_dir(date_path):
         os.rmdir(date_path)
 
 
+def is_date_dir_complete(date_path):
+    """
+    Check whether the vector store of a date directory was fully built.
+    The vector store metadata is the last file written by a build, so a date directory without it
+    holds an interrupted (or running) build.
+
+    :param date_path: the path of the date directory
+    :return: True if the build of the date directory completed
+    """
+    return os.path.exists(fr"{date_path}\vector_store_meta.json")
+
+
 def get_prev_date_dir(version_path):
     """
     Scan the ROOT_PATH directory for the latest date directory.
     The directory name is the date in the format '%H-%M_%d-%m-%Y'.
+    Date directories of interrupted builds are skipped.
     If no directory is found in the root directory, return None.
 
     :param version_path: the version of the experiment.
@@ -61,6 +75,8 @@ def get_prev_date_dir(version_path):
     if not os.path.exists(version_path):
         return None
     for dir_name in os.listdir(version_path):
+        if not is_date_dir_complete(os.path.join(version_path, dir_name)):
+            continue
         dir_time = datetime.strptime(dir_name, '%H-%M_%d-%m-%Y')
         if latest_time is None or dir_time > latest_time:
             latest_time = dir_time
@@ -68,6 +84,24 @@ def get_prev_date_dir(version_path):
     return latest_dir_path
 
 
+def get_interrupted_date_dirs(version_path):
+    """
+    Return the date directories of a version whose build was interrupted and can be resumed,
+    i.e. directories with a build journal that never completed, sorted from oldest to latest.
+
+    :param version_path: the version of the experiment.
+    :return: list of date directory paths.
+    """
+    if not os.path.exists(version_path):
+        return []
+    interrupted = []
+    for dir_name in os.listdir(version_path):
+        date_path = os.path.join(version_path, dir_name)
+        if not is_date_dir_complete(date_path) and os.path.exists(fr"{date_path}\build_journal.jsonl"):
+            interrupted.append((datetime.strptime(dir_name, '%H-%M_%d-%m-%Y'), date_path))
+    return [date_path for _, date_path in sorted(interrupted)]
+
+
 def get_prev_files_details(prev_data_path, new_source_path):
     """
     Load the previous files details from disk. If the prev_data_path is None, return None.
@@ -89,20 +123,17 @@ def get_prev_files_details(prev_data_path, new_source_path):
         raise Exception("Different sources paths, please create a new version", e)
 
 
-def list_files(root_dir, save_path=None):
+def list_files(root_dir, save_path=None, num_workers=settings.SCAN_WORKERS):
     """
-    Create a list of all files in the given root directory.
-    Returns a dictionary of file paths and their last modified time.
+    Create a list of all files in the given root directory, scanning its directories in parallel.
+    Returns a dictionary of file paths and their details: size, modification time (mtime_ns), inode and content hash.
+    The content hash is None until it is computed by diff_files.
     :param root_dir: The root directory to create a list of files from.
-    :return: A list of file paths.
+    :param save_path: path to save the files details to. Defaults to None (not saved).
+    :param num_workers: number of directories scanned concurrently. Defaults to settings.SCAN_WORKERS.
+    :return: A dictionary of file paths and their details.
     """
-    files = {}
-    for dir_path, dir_names, file_names in os.walk(root_dir):
-        for filename in file_names:
-            file_path = os.path.join(dir_path, filename)
-            # last modified time
-            file_mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-            files[os.path.join(dir_path, filename)] = file_mod_time.isoformat()
+    files = scan_files(root_dir, num_workers=num_workers)
 
     if save_path is not None:
         save_dict(files, save_path)
@@ -129,27 +160,6 @@ def load_dict(path):
         return json.load(f)
 
 
-def get_changed_files(curr_files_details, prev_files_details=None):
-    """
-    Returns a list of files that have been modified since the last run.
-
-    :param curr_files_details: dictionary of file paths and their last modified time.
-    :param prev_files_details: dictionary of file paths and their last modified time. Defaults to None.
-    :return: a list of file paths.
-    """
-    if prev_files_details is None:
-        return list(curr_files_details.keys())
-    changed_files = []
-    for curr_file_path, curr_file_mod_time in curr_files_details.items():
-        if curr_file_path in prev_files_details:
-            prev_file_mod_time = prev_files_details[curr_file_path]
-            if datetime.fromisoformat(curr_file_mod_time) > datetime.fromisoformat(prev_file_mod_time):
-                changed_files.append(curr_file_path)
-        else:
-            changed_files.append(curr_file_path)
-    return changed_files
-
-
 def init_convs(ver_path: str) -> str:
     """
     Initialize a directory for storing conversation files.
@@ -1,7 +1,12 @@
+import queue
+import threading
+
 from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter, TokenTextSplitter
 # from langchain.document_loaders import CSVLoader
 from langchain_community.document_loaders import CSVLoader
-from DataLayer.docling_utils import DOCLING_FILE_TYPES, docling_load
+from DataLayer.docling_utils import DOCLING_FILE_TYPES, iter_docling_load
+from DataLayer.parse_cache import file_content_hash, parse_cache_key, get_parse_cache
+from config import settings
 
 
 def create_text_splitter(splitter_type: str = None, **kwargs):
@@ -30,10 +35,32 @@ def create_text_splitter(splitter_type: str = None, **kwargs):
         raise ValueError(f"Invalid splitter type: {splitter_type}")
 
 
-def load_csv(csv_file_path):
+CSV_LOADER_CONFIG = {"loader": "csv"}
+
+
+def load_csv(csv_file_path, parse_cache=None):
     """
     Load a CSV file and return a list of documents by row (dicts containing page_content and metadata).
-    
+    If a parse cache is given, it is consulted before parsing and updated after parsing.
+
+    :param csv_file_path: The path to the CSV file. Can contain non-ASCII characters.
+    :param parse_cache: ParseCache to consult before parsing. If None, no cache is used.
+    :return: A list of documents (dicts containing page_content and metadata).
+    """
+    if parse_cache is None:
+        return _load_csv(csv_file_path)
+    key = parse_cache_key(file_content_hash(csv_file_path), CSV_LOADER_CONFIG)
+    docs = parse_cache.get(key, csv_file_path)
+    if docs is None:
+        docs = _load_csv(csv_file_path)
+        parse_cache.put(key, docs)
+    return docs
+
+
+def _load_csv(csv_file_path):
+    """
+    Parse a CSV file into a list of documents by row, trying several encodings.
+
     :param csv_file_path: The path to the CSV file. Can contain non-ASCII characters.
     :return: A list of documents (dicts containing page_content and metadata).
     """
@@ -86,28 +113,118 @@ def filter_by_extension(files_paths, extensions=None):
     return [file_path for file_path in files_paths if any(file_path.endswith(ext) for ext in extensions)]
 
 
-def load_docs_chunks(files_paths, docling_files_types=DOCLING_FILE_TYPES, verbose=False):
+def iter_docs_chunks(files_paths, docling_files_types=DOCLING_FILE_TYPES, verbose=False,
+                     num_workers=settings.DOCLING_WORKERS):
     """
-    Load chunks from a given list of file paths using both docling and CSV loaders.
+    Load chunks from a given list of file paths using both docling and CSV loaders, yielding the chunks of
+    each file as soon as it is loaded.
     If a file path has an extension in `docling_files_types`, it is loaded using the docling loader.
     .csv files are loaded using CSV loader.
 
     :param files_paths: list of file paths.
     :param docling_files_types: list of file extensions to load using docling. Default to DOCLING_FILE_TYPES.
     :param verbose: boolean indicating whether to print which files are loaded using which loader.s Defaults to False.
-    :return: list of documents chunks.
+    :param num_workers: number of processes converting docling files in parallel. Defaults to settings.DOCLING_WORKERS.
+    :return: generator of (file path, list of the file's documents chunks).
     """
+    files_paths = list(files_paths)
+    parse_cache = get_parse_cache()
     filtered_files_docling = filter_by_extension(files_paths, extensions=docling_files_types)
-    docling_docs = docling_load(file_paths=filtered_files_docling, text_splitter=create_text_splitter())
     if verbose:
-        print("loaded using Docling: ", filtered_files_docling)
+        print("loading using Docling: ", filtered_files_docling)
+    yield from iter_docling_load(file_paths=filtered_files_docling, text_splitter=create_text_splitter(),
+                                 num_workers=num_workers, parse_cache=parse_cache)
     csv_files = filter_by_extension(files_paths, extensions=[".csv"])
-    csv_docs = []
     for csv_file in csv_files:
         try:
-            csv_docs += load_csv(csv_file)
+            yield csv_file, load_csv(csv_file, parse_cache=parse_cache)
         except Exception as e:
             print(f"Failed to load CSV file {csv_file}. Error: {str(e)}")
-    # csv_docs = [load_csv(csv_file) for csv_file in csv_files] #TODO: Handle errors
-    # csv_docs = [doc for sublist in csv_docs for doc in sublist]
-    return [*docling_docs, *csv_docs]
+
+
+def load_docs_chunks(files_paths, docling_files_types=DOCLING_FILE_TYPES, verbose=False,
+                     num_workers=settings.DOCLING_WORKERS):
+    """
+    Load chunks from a given list of file paths using both docling and CSV loaders.
+    If a file path has an extension in `docling_files_types`, it is loaded using the docling loader.
+    .csv files are loaded using CSV loader.
+
+    :param files_paths: list of file paths.
+    :param docling_files_types: list of file extensions to load using docling. Default to DOCLING_FILE_TYPES.
+    :param verbose: boolean indicating whether to print which files are loaded using which loader.s Defaults to False.
+    :param num_workers: number of processes converting docling files in parallel. Defaults to settings.DOCLING_WORKERS.
+    :return: list of documents chunks.
+    """
+    return [doc for _, file_docs in iter_docs_chunks(files_paths, docling_files_types=docling_files_types,
+                                                      verbose=verbose, num_workers=num_workers)
+            for doc in file_docs]
+
+
+def iter_chunk_batches(files_docs, batch_size=settings.INGEST_BATCH_SIZE):
+    """
+    Group the chunks of consecutive files into batches of about batch_size chunks.
+    The chunks of a file are never split between batches, so a batch always holds whole files
+    (a single file with more than batch_size chunks forms a batch of its own).
+
+    :param files_docs: iterable of (file path, list of the file's documents chunks).
+    :param batch_size: the number of chunks after which a batch is emitted. Defaults to settings.INGEST_BATCH_SIZE.
+    :return: generator of (list of file paths, list of documents chunks).
+    """
+    batch_files, batch_docs = [], []
+    for file_path, file_docs in files_docs:
+        if batch_docs and len(batch_docs) + len(file_docs) > batch_size:
+            yield batch_files, batch_docs
+            batch_files, batch_docs = [], []
+        batch_files.append(file_path)
+        batch_docs.extend(file_docs)
+    if batch_files:
+        yield batch_files, batch_docs
+
+
+_PREFETCH_DONE = object()
+
+
+def prefetch(iterable, max_prefetch=settings.INGEST_PREFETCH_BATCHES):
+    """
+    Consume an iterable in a background thread, keeping at most max_prefetch items ahead of the consumer.
+    Used to overlap loading and chunking of the next batches with embedding and writing the current one,
+    while keeping the number of in-flight batches (and so the memory) bounded.
+    Exceptions raised by the iterable are re-raised in the consumer.
+
+    :param iterable: the iterable to consume.
+    :param max_prefetch: maximal number of items waiting for the consumer. Defaults to settings.INGEST_PREFETCH_BATCHES.
+    :return: generator of the iterable's items, in order.
+    """
+    items = queue.Queue(maxsize=max(1, max_prefetch))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_PREFETCH_DONE, None))
+        except BaseException as e:
+            put((_PREFETCH_DONE, e))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _PREFETCH_DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
@@ -1,10 +1,19 @@
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from importlib.metadata import version, PackageNotFoundError
+
 from docling.chunking import HybridChunker
+from docling.document_converter import DocumentConverter
 from docling_core.transforms.chunker.tokenizer.openai import OpenAITokenizer
 from langchain_docling import DoclingLoader
 from langchain_docling.loader import ExportType
 import tiktoken
 from tqdm import tqdm
 
+from DataLayer.parse_cache import file_content_hash, parse_cache_key
+
 DOCLING_FILE_TYPES = ["pdf", ".docx", ".pptx"]
 
 
@@ -39,51 +48,224 @@ def process_docling_metadata(documents):
     return documents
 
 
-def docling_load(file_paths, export_type=ExportType.DOC_CHUNKS, model_name="gpt-3.5-turbo",
-                 text_splitter=None, process_metadata=True):  # , chunker_strategy=None,):
+def create_chunker(model_name="gpt-3.5-turbo"):
     """
-    Loads chunks from a given file path using docling.
-    if no model_name is provided, no chunker will be used.
+    Create the hybrid chunker used for semantic chunking.
+    If no model_name is provided, no chunker is created.
+
+    :param model_name: The name of the model to use for tokenizing for chunking.
+    :return: HybridChunker or None
+    """
+    if model_name is None:
+        print("No Chunker will be used")
+        return None
+    tokenizer = OpenAITokenizer(
+        tokenizer=tiktoken.encoding_for_model(model_name),
+        max_tokens=128 * 1024,  # context window length required for OpenAI tokenizers
+    )
+    return HybridChunker(
+        tokenizer=tokenizer)  # , strategy=chunker_strategy) #https://docling-project.github.io/docling/examples/hybrid_chunking/#configuring-tokenization
+
+
+# Per-process converter and chunker, created once and reused for every file the process loads
+_worker_state = {}
+
+
+def _init_worker(export_type, model_name):
+    """
+    Initialize the converter and chunker of the current process.
+    Used as the initializer of the worker processes, and lazily by the serial mode.
+
+    :param export_type: one of DOC_ITEMS, DOC_CHUNKS, DOC_TEXT, DOC_METADATA, DOC_ALL
+    :param model_name: The name of the model to use for tokenizing for chunking. If None, no chunking is used.
+    """
+    _worker_state["config"] = (export_type, model_name)
+    _worker_state["export_type"] = export_type
+    _worker_state["converter"] = DocumentConverter()
+    _worker_state["chunker"] = create_chunker(model_name)
+
+
+def _load_file(file_path):
+    """
+    Convert and chunk a single file using the converter and chunker of the current process.
+    Errors are returned instead of raised, so one bad file doesn't abort the batch.
+
+    :param file_path: Path to the file to load
+    :return: tuple of (file_path, list of documents, error message or None)
+    """
+    try:
+        loader = DoclingLoader(
+            file_path=[file_path],
+            converter=_worker_state["converter"],
+            export_type=_worker_state["export_type"],
+            chunker=_worker_state["chunker"]
+        )
+        return file_path, loader.load(), None
+    except Exception as e:
+        return file_path, [], f"{type(e).__name__}: {e}"
+
+
+def _iter_serial(file_paths, export_type, model_name):
+    """
+    Load the files one after another in the current process.
+
+    :return: generator of (file_path, list of documents, error message or None)
+    """
+    if _worker_state.get("config") != (export_type, model_name):
+        _init_worker(export_type, model_name)
+    for file_path in file_paths:
+        yield _load_file(file_path)
+
+
+def _iter_parallel(file_paths, export_type, model_name, num_workers, max_crashes=1):
+    """
+    Load the files in a pool of worker processes, yielding the results in completion order.
+    At most num_workers files are submitted at a time, so a crashed worker only implicates the files that were
+    being converted. If a worker process crashes (e.g. a segfault while parsing a corrupt PDF), the pool is
+    restarted and the files that were in flight are retried one at a time in a single-worker pool, isolating the
+    file that causes the crash. A file that crashes its worker alone max_crashes times is reported as failed.
+
+    :return: generator of (file_path, list of documents, error message or None)
+    """
+    queue = deque(file_paths)
+    suspects = deque()  # files in flight during a crash, retried one at a time
+    crashes = {}
+    while queue or suspects:
+        isolate = bool(suspects)
+        source, max_in_flight = (suspects, 1) if isolate else (queue, num_workers)
+        with ProcessPoolExecutor(max_workers=max_in_flight, initializer=_init_worker,
+                                 initargs=(export_type, model_name)) as executor:
+            in_flight = {}
+            crashed = []
+            while (source or in_flight) and not crashed:
+                while source and len(in_flight) < max_in_flight:
+                    file_path = source.popleft()
+                    in_flight[executor.submit(_load_file, file_path)] = file_path
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        crashed.append(file_path)
+                        continue
+                    yield result
+            crashed.extend(in_flight.values())
+        if not crashed:
+            continue
+        if not isolate:
+            suspects.extend(crashed)
+            continue
+        for file_path in crashed:
+            crashes[file_path] = crashes.get(file_path, 0) + 1
+            if crashes[file_path] >= max_crashes:
+                yield file_path, [], "Worker process crashed"
+            else:
+                suspects.append(file_path)
+
+
+def docling_loader_config(export_type, model_name):
+    """
+    Describe the converter and chunker configuration, used as part of the parse cache key.
+
+    :param export_type: one of DOC_ITEMS, DOC_CHUNKS, DOC_TEXT, DOC_METADATA, DOC_ALL
+    :param model_name: The name of the model used for tokenizing for chunking.
+    :return: dict describing the configuration
+    """
+    try:
+        docling_version = version("docling")
+    except PackageNotFoundError:
+        docling_version = "unknown"
+    return {
+        "loader": "docling",
+        "docling_version": docling_version,
+        "export_type": str(export_type),
+        "chunker": "HybridChunker" if model_name is not None else None,
+        "tokenizer_model": model_name,
+    }
+
+
+def iter_docling_load(file_paths, export_type=ExportType.DOC_CHUNKS, model_name="gpt-3.5-turbo",
+                      text_splitter=None, process_metadata=True, num_workers=1, parse_cache=None):
+    """
+    Loads chunks from the given file paths using docling, yielding the chunks of each file as soon as it is loaded.
+    With num_workers > 1 the files are converted in a pool of worker processes, each holding its own converter
+    and chunker, and the results are yielded in completion order.
+    If a parse cache is given, files whose content was already converted with the same configuration are
+    yielded from the cache first, without conversion.
+    Files that fail to load are reported and skipped.
 
     :param file_paths: list of Paths to the files to load
     :param export_type: one of DOC_ITEMS, DOC_CHUNKS, DOC_TEXT, DOC_METADATA, DOC_ALL
     :param model_name: The name of the model to use for tokenizing for chunking. If None, no chunking is used.
     :param text_splitter: The text splitter to use for splitting the text after semantic chunking. If None, no splitting is used.
     :param process_metadata: Whether to process the metadata or not. If False, the original metadata is returned
+    :param num_workers: Number of worker processes. 1 loads the files serially in the current process.
+    :param parse_cache: ParseCache to consult before converting files. If None, no cache is used.
+    :return: generator of (file_path, list of documents)
     """
-    if model_name is not None:
-        tokenizer = OpenAITokenizer(
-            tokenizer=tiktoken.encoding_for_model(model_name),
-            max_tokens=128 * 1024,  # context window length required for OpenAI tokenizers
-        )
+    file_paths = list(file_paths)
+    cached, cache_keys = [], {}
+    if parse_cache is not None:
+        loader_config = docling_loader_config(export_type, model_name)
+        to_convert = []
+        for file_path in file_paths:
+            try:
+                key = parse_cache_key(file_content_hash(file_path), loader_config)
+            except OSError as e:
+                # Unreadable or removed since it was listed - reported with the files that failed to load
+                cached.append((file_path, None, e))
+                continue
+            docs = parse_cache.get(key, file_path)
+            if docs is None:
+                cache_keys[file_path] = key
+                to_convert.append(file_path)
+            else:
+                cached.append((file_path, docs, None))
+    else:
+        to_convert = file_paths
 
-        chunker = HybridChunker(
-            tokenizer=tokenizer)  # , strategy=chunker_strategy) #https://docling-project.github.io/docling/examples/hybrid_chunking/#configuring-tokenization
+    if num_workers > 1 and len(to_convert) > 1:
+        converted = _iter_parallel(to_convert, export_type, model_name, min(num_workers, len(to_convert)))
     else:
-        print("No Chunker will be used")
-        chunker = None
-
-    # loader = DoclingLoader(  # https://python.langchain.com/docs/integrations/document_loaders/docling/
-    #     file_path=file_paths,
-    #     export_type=export_type,
-    #     chunker=chunker,
-    # )
-    # docs = loader.load()
-    docs = []
-    for file_path in tqdm(file_paths, desc="Loading documents"):
-        loader = DoclingLoader(
-            file_path=[file_path],
-            export_type=export_type,
-            chunker=chunker
-        )
-        docs.extend(loader.load())
+        converted = _iter_serial(to_convert, export_type, model_name)
+    results = itertools.chain(cached, converted)
+
+    for file_path, docs, error in tqdm(results, total=len(file_paths), desc="Loading documents"):
+        if error is not None:
+            print(f"Failed to load {file_path}. Error: {error}")
+            continue
+        if file_path in cache_keys:
+            parse_cache.put(cache_keys[file_path], docs)
+        # Note: Use both chunker and splitter for splitting with overlaps of the semantically chunked paragraphs, which can be long.
+        if text_splitter is not None:
+            docs = text_splitter.split_documents(docs)
+
+        if process_metadata:
+            docs = process_docling_metadata(docs)
+        yield file_path, docs
 
-    # Note: Use both chunker and splitter for splitting with overlaps of the semantically chunked paragraphs, which can be long.
-    if text_splitter is not None:
-        docs = text_splitter.split_documents(docs)
 
-    if process_metadata:
-        docs = process_docling_metadata(docs)
+def docling_load(file_paths, export_type=ExportType.DOC_CHUNKS, model_name="gpt-3.5-turbo",
+                 text_splitter=None, process_metadata=True, num_workers=1,
+                 parse_cache=None):  # , chunker_strategy=None,):
+    """
+    Loads chunks from a given file path using docling.
+    if no model_name is provided, no chunker will be used.
+
+    :param file_paths: list of Paths to the files to load
+    :param export_type: one of DOC_ITEMS, DOC_CHUNKS, DOC_TEXT, DOC_METADATA, DOC_ALL
+    :param model_name: The name of the model to use for tokenizing for chunking. If None, no chunking is used.
+    :param text_splitter: The text splitter to use for splitting the text after semantic chunking. If None, no splitting is used.
+    :param process_metadata: Whether to process the metadata or not. If False, the original metadata is returned
+    :param num_workers: Number of worker processes used for converting the files. Defaults to 1 (serial).
+    :param parse_cache: ParseCache to consult before converting files. If None, no cache is used.
+    """
+    docs = []
+    for _, file_docs in iter_docling_load(file_paths, export_type=export_type, model_name=model_name,
+                                          text_splitter=text_splitter, process_metadata=process_metadata,
+                                          num_workers=num_workers, parse_cache=parse_cache):
+        docs.extend(file_docs)
     return docs
     # TODO: Markdown
 
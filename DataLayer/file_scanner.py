@@ -0,0 +1,191 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+from DataLayer.parse_cache import file_content_hash
+
+
+def _scan_dir(dir_path):
+    """
+    Scan one directory with os.scandir.
+
+    :param dir_path: the directory to scan
+    :return: tuple of (dictionary of the files' paths and details, list of subdirectory paths)
+    """
+    files, sub_dirs = {}, []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = {
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "inode": entry.inode(),
+                        "hash": None,
+                    }
+    except OSError as e:
+        print(f"Failed to scan {dir_path}. Error: {str(e)}")
+    return files, sub_dirs
+
+
+def stat_file(file_path):
+    """
+    Return the details of a single file, in the format of scan_files.
+
+    :param file_path: path of the file
+    :return: dictionary with size, mtime_ns, inode and hash, or None if the file does not exist
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    if not os.path.isfile(file_path):
+        return None
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino, "hash": None}
+
+
+def scan_files(root_dir, num_workers=8):
+    """
+    Walk a directory tree in parallel, one os.scandir call per directory, and collect the size, modification time
+    and inode of every file. The stat information comes with the directory entries, so no file is opened.
+    Content hashes are not computed here: they are computed lazily by diff_files, only for files whose size or
+    modification time changed.
+
+    :param root_dir: the root directory to scan
+    :param num_workers: number of directories scanned concurrently
+    :return: dictionary of file paths and their details (size, mtime_ns, inode and hash)
+    """
+    files = {}
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        pending = {executor.submit(_scan_dir, root_dir)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dir_files, sub_dirs = future.result()
+                files.update(dir_files)
+                pending.update(executor.submit(_scan_dir, sub_dir) for sub_dir in sub_dirs)
+    return files
+
+
+def normalize_file_details(details):
+    """
+    Convert the details of a file saved by an older version (the ISO modification time only) to the current format.
+
+    :param details: the saved details of a file
+    :return: dictionary with size, mtime_ns, inode and hash (None when unknown)
+    """
+    if isinstance(details, dict):
+        return details
+    mtime_ns = int(datetime.fromisoformat(details).timestamp() * 1_000_000) * 1000
+    return {"size": None, "mtime_ns": mtime_ns, "inode": None, "hash": None}
+
+
+def _hash_files(files_details, file_paths, num_workers):
+    """
+    Compute the missing content hashes of the given files in parallel, and store them in the files' details.
+    Files that can no longer be read keep a None hash.
+
+    :param files_details: dictionary of file paths and their details
+    :param file_paths: the files to hash
+    :param num_workers: number of files hashed concurrently
+    """
+    file_paths = [path for path in file_paths if files_details[path]["hash"] is None]
+    if not file_paths:
+        return
+
+    def hash_file(path):
+        try:
+            return file_content_hash(path)
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        for path, content_hash in zip(file_paths, executor.map(hash_file, file_paths)):
+            files_details[path]["hash"] = content_hash
+
+
+def diff_files(curr_files_details, prev_files_details=None, num_workers=8):
+    """
+    Compare the current files of a source path to the files of the previous scan.
+
+    A file whose size and modification time did not change is unchanged, and its previous hash is carried forward.
+    Otherwise its content is hashed, and it is modified only if the hash differs from the previous one (or the
+    previous one is unknown). An added file that matches a deleted one by inode, or by size and hash, is renamed.
+    Files saved by an older version (modification time only) are modified if they are newer than before.
+
+    The hashes computed are stored in curr_files_details, so save it after the diff.
+
+    :param curr_files_details: dictionary of file paths and their details, as returned by scan_files
+    :param prev_files_details: dictionary of file paths and their details of the previous scan. Defaults to None.
+    :param num_workers: number of files hashed concurrently
+    :return: dictionary with the lists of 'added', 'modified' and 'deleted' file paths,
+        and the list of 'renamed' (previous path, current path) pairs
+    """
+    if prev_files_details is None:
+        return {"added": list(curr_files_details), "modified": [], "deleted": [], "renamed": []}
+    prev_files_details = {path: normalize_file_details(details) for path, details in prev_files_details.items()}
+
+    added, to_hash, modified_by_time = [], [], []
+    for path, curr in curr_files_details.items():
+        prev = prev_files_details.get(path)
+        if prev is None:
+            added.append(path)
+        elif prev["size"] is None:  # saved by an older version
+            if curr["mtime_ns"] > prev["mtime_ns"]:
+                modified_by_time.append(path)
+        elif curr["size"] == prev["size"] and curr["mtime_ns"] == prev["mtime_ns"]:
+            curr["hash"] = prev["hash"]
+        else:
+            to_hash.append(path)
+    deleted = [path for path in prev_files_details if path not in curr_files_details]
+
+    # Renames: match added files to deleted files by inode (a rename keeps the size and modification time),
+    # then by size and content hash
+    renamed = []
+    renamed_by_inode = {}
+    if added and deleted:
+        deleted_by_inode = {prev_files_details[path]["inode"]: path for path in deleted
+                            if prev_files_details[path]["inode"]}
+        for path in added:
+            curr = curr_files_details[path]
+            prev_path = deleted_by_inode.get(curr["inode"]) if curr["inode"] else None
+            if prev_path is None:
+                continue
+            prev = prev_files_details[prev_path]
+            # Otherwise the file was edited after it was moved, or the inode was reused by a different file
+            if (prev["size"], prev["mtime_ns"]) == (curr["size"], curr["mtime_ns"]):
+                renamed_by_inode[path] = prev_path
+        deleted_sizes = {prev_files_details[path]["size"] for path in deleted if prev_files_details[path]["hash"]}
+        to_hash += [path for path in added if path not in renamed_by_inode
+                    and curr_files_details[path]["size"] in deleted_sizes]
+    _hash_files(curr_files_details, to_hash, num_workers)
+
+    if added and deleted:
+        deleted_by_hash = {(prev_files_details[path]["size"], prev_files_details[path]["hash"]): path
+                           for path in deleted if prev_files_details[path]["hash"]}
+        renamed_from, renamed_to = set(), set()
+        for path in added:
+            curr = curr_files_details[path]
+            prev_path = renamed_by_inode.get(path)
+            if prev_path is None and curr["hash"] is not None:
+                prev_path = deleted_by_hash.get((curr["size"], curr["hash"]))
+            if prev_path is None or prev_path in renamed_from:
+                continue
+            renamed.append((prev_path, path))
+            renamed_from.add(prev_path)
+            renamed_to.add(path)
+            if curr["hash"] is None:
+                curr["hash"] = prev_files_details[prev_path]["hash"]
+        added = [path for path in added if path not in renamed_to]
+        deleted = [path for path in deleted if path not in renamed_from]
+
+    modified = modified_by_time + [
+        path for path in to_hash
+        if path in prev_files_details
+        and (curr_files_details[path]["hash"] is None
+             or curr_files_details[path]["hash"] != prev_files_details[path]["hash"])
+    ]
+    return {"added": added, "modified": modified, "deleted": deleted, "renamed": renamed}
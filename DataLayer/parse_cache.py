@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+from langchain.docstore.document import Document
+
+from config import settings
+
+
+def file_content_hash(file_path, block_size=1024 * 1024):
+    """
+    Compute the SHA-256 hash of a file's bytes.
+
+    :param file_path: path of the file
+    :param block_size: number of bytes read at a time
+    :return: hex digest of the file's content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_cache_key(content_hash, loader_config):
+    """
+    Build the cache key of a parsed file from its content hash and the configuration of the loader that parsed it,
+    so changing the converter or chunker configuration never returns stale chunks.
+
+    :param content_hash: hex digest of the file's content
+    :param loader_config: JSON-serializable dictionary describing the loader configuration
+    :return: hex digest key
+    """
+    config = json.dumps(loader_config, sort_keys=True, default=str)
+    return hashlib.sha256(f"{content_hash}\x00{config}".encode("utf-8")).hexdigest()
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed documents, keyed by file content hash and loader configuration.
+
+    Each entry is a gzip-compressed JSON list of the documents (page_content and metadata) a loader produced
+    for a file, before splitting and metadata processing. The 'source' metadata of cached documents is replaced
+    with the path the file is loaded from, so copies and renames of a file hit the cache too.
+    When the entries exceed max_bytes, the least recently used ones (by modification time, refreshed on every hit)
+    are evicted.
+
+    Attributes:
+        cache_dir (str): The directory where the entries are stored.
+        max_bytes (int): The maximal total size of the entries.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._total_bytes = sum(size for _, _, size in self._iter_entries())
+
+    def _iter_entries(self):
+        """
+        :return: generator of (entry path, modification time, size) of the stored entries
+        """
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith(".json.gz"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat.st_mtime, stat.st_size
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json.gz")
+
+    def get(self, key, file_path):
+        """
+        Return the cached documents of the given key, or None if they are not cached.
+
+        :param key: cache key, see parse_cache_key
+        :param file_path: the path the file is loaded from, set as the 'source' of the documents
+        :return: list of documents or None
+        """
+        entry_path = self._entry_path(key)
+        if not os.path.exists(entry_path):
+            return None
+        try:
+            with gzip.open(entry_path, "rt", encoding="utf-8") as f:
+                serialized = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring corrupt parse cache entry {entry_path}. Error: {str(e)}")
+            return None
+        try:
+            os.utime(entry_path)  # mark as recently used
+        except OSError:
+            pass
+        docs = []
+        for item in serialized:
+            metadata = item["metadata"]
+            if "source" in metadata:
+                metadata["source"] = file_path
+            docs.append(Document(page_content=item["page_content"], metadata=metadata))
+        return docs
+
+    def put(self, key, docs):
+        """
+        Store the documents of the given key. The entry is written atomically.
+
+        :param key: cache key, see parse_cache_key
+        :param docs: list of documents
+        """
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        serialized = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+        tmp_path = f"{entry_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(serialized, f, default=str)
+            size = os.path.getsize(tmp_path)
+            replaced = os.path.getsize(entry_path) if os.path.exists(entry_path) else 0
+            os.replace(tmp_path, entry_path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Failed to write parse cache entry {entry_path}. Error: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._total_bytes += size - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Evict least recently used entries until the cache is back under 90% of max_bytes.
+        Must be called while holding the lock.
+        """
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(self._iter_entries(), key=lambda entry: entry[1])
+        self._total_bytes = sum(size for _, _, size in entries)
+        for entry_path, _, size in entries:
+            if self._total_bytes <= target:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            self._total_bytes -= size
+
+
+_parse_cache = None
+
+
+def get_parse_cache():
+    """
+    Return the parse cache stored under DATA_DIR, or None if the parse cache is disabled in the settings.
+
+    :return: ParseCache or None
+    """
+    global _parse_cache
+    if not settings.PARSE_CACHE:
+        return None
+    if _parse_cache is None:
+        _parse_cache = ParseCache(fr"{settings.DATA_DIR}\parse_cache", settings.PARSE_CACHE_MAX_MB * 1024 * 1024)
+    return _parse_cache
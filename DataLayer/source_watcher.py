@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+
+from DataLayer.file_scanner import scan_files, stat_file, normalize_file_details
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _DirtyPathsHandler(FileSystemEventHandler):
+    """
+    Watchdog event handler that reports the paths touched by filesystem events to the watcher.
+    """
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        if event.is_directory and event.event_type == "modified":
+            return  # reported for every change of a child, which has its own event
+        paths = [event.src_path, getattr(event, "dest_path", None)]
+        self.watcher.mark_dirty([path for path in paths if path], is_dir=event.is_directory)
+
+
+class SourceWatcher:
+    """
+    Watch a source directory and report its changes in debounced batches.
+
+    Changes are observed with watchdog (inotify on Linux, ReadDirectoryChangesW on Windows) when it is installed,
+    and by periodically re-scanning the directory otherwise (or when polling is forced, e.g. for network shares
+    that do not deliver change notifications).
+    A burst of changes is reported once no new change was observed for debounce_seconds (or after
+    10 * debounce_seconds of continuous changes). Only files whose size or modification time differ from the known
+    files are reported, so events that do not change a file's content are ignored.
+    The directory is scanned when watching starts, so the changes made while it was not watched are reported too.
+    When on_changes fails, the changes are reported again after a backoff (debounce_seconds, doubled after every
+    failure, up to 5 minutes); after max_retries consecutive failures they are dropped until the files change again.
+
+    Attributes:
+        source_path (str): The watched directory.
+        on_changes: Callable taking (changed_files, deleted_files), called for every batch of changes.
+        known_files (dict): The files already indexed and their details, updated after every reported batch.
+        debounce_seconds (float): Quiet period after which a burst of changes is reported.
+        poll_seconds (float): Interval between two scans when polling.
+        batch_files (int): Maximal number of changed files reported in one call of on_changes.
+        polling (bool): Whether the directory is polled instead of observed with watchdog.
+        max_retries (int): Number of times failed changes are reported again before they are dropped.
+    """
+    def __init__(self, source_path, on_changes, known_files, debounce_seconds=2.0, poll_seconds=5.0,
+                 batch_files=32, polling=False, max_retries=5):
+        self.source_path = source_path
+        self.on_changes = on_changes
+        self.known_files = {path: normalize_file_details(details) for path, details in known_files.items()}
+        self.debounce_seconds = debounce_seconds
+        self.poll_seconds = poll_seconds
+        self.batch_files = max(1, batch_files)
+        self.polling = polling or Observer is None
+        self.max_retries = max_retries
+
+        self._last_scan = dict(self.known_files)
+        self._dirty_files = set()
+        self._dirty_dirs = set()
+        self._first_dirty = None
+        self._last_dirty = None
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+
+    def mark_dirty(self, paths, is_dir=False):
+        """
+        Mark paths as possibly changed. They are checked and reported after the debounce period.
+
+        :param paths: the changed paths
+        :param is_dir: whether the paths are directories (all the files under them are checked)
+        """
+        with self._condition:
+            (self._dirty_dirs if is_dir else self._dirty_files).update(paths)
+            now = time.monotonic()
+            self._first_dirty = self._first_dirty or now
+            self._last_dirty = now
+            self._condition.notify()
+
+    def _poll(self):
+        """
+        Scan the source directory and mark the files whose size or modification time changed since the previous scan,
+        and the deleted files.
+        """
+        curr_files = scan_files(self.source_path)
+        dirty = [path for path, details in curr_files.items() if self._is_changed(path, details, self._last_scan)]
+        dirty += [path for path in self._last_scan if path not in curr_files]
+        self._last_scan = curr_files
+        if dirty:
+            self.mark_dirty(dirty)
+
+    def _is_changed(self, path, details, files=None):
+        known = (self.known_files if files is None else files).get(path)
+        return known is None or (known["size"], known["mtime_ns"]) != (details["size"], details["mtime_ns"])
+
+    def _pop_due(self):
+        """
+        Pop the dirty paths if their debounce period is over. Must be called while holding the condition.
+
+        :return: tuple of (dirty files, dirty directories), or None if no change is due
+        """
+        if self._last_dirty is None:
+            return None
+        now = time.monotonic()
+        quiet = now - self._last_dirty >= self.debounce_seconds
+        overdue = now - self._first_dirty >= 10 * self.debounce_seconds
+        if not (quiet or overdue):
+            return None
+        dirty = (self._dirty_files, self._dirty_dirs)
+        self._dirty_files, self._dirty_dirs = set(), set()
+        self._first_dirty = self._last_dirty = None
+        return dirty
+
+    def _resolve(self, dirty_files, dirty_dirs):
+        """
+        Resolve dirty paths into the changed and deleted files, compared to the known files.
+
+        :return: tuple of (dictionary of changed files and their details, list of deleted files)
+        """
+        changed, deleted = {}, set()
+        for dir_path in dirty_dirs:
+            prefix = dir_path.rstrip("\\/") + os.sep
+            if os.path.isdir(dir_path):
+                changed.update({path: details for path, details in scan_files(dir_path).items()
+                                if self._is_changed(path, details)})
+            deleted.update(path for path in self.known_files
+                           if path.startswith(prefix) and not os.path.exists(path))
+        for path in dirty_files:
+            details = stat_file(path)
+            if details is None:
+                if path in self.known_files:
+                    deleted.add(path)
+            elif self._is_changed(path, details):
+                changed[path] = details
+        return changed, sorted(deleted)
+
+    def _apply(self, dirty_files, dirty_dirs):
+        changed, deleted = self._resolve(dirty_files, dirty_dirs)
+        if not changed and not deleted:
+            return
+        print(f"Source changes: {len(changed)} changed, {len(deleted)} deleted")
+        changed_files = sorted(changed)
+        for start in range(0, max(len(changed_files), 1), self.batch_files):
+            batch = changed_files[start:start + self.batch_files]
+            batch_deleted = deleted if start == 0 else []
+            self.on_changes(batch, batch_deleted)
+            for path in batch_deleted:
+                self.known_files.pop(path, None)
+            self.known_files.update({path: changed[path] for path in batch})
+
+    def run(self):
+        """
+        Watch the source directory and report its changes until stop() is called or the process is interrupted.
+        """
+        observer = None
+        if not self.polling:
+            observer = Observer()
+            observer.schedule(_DirtyPathsHandler(self), self.source_path, recursive=True)
+            observer.start()
+        print(f"Watching {self.source_path} ({'polling' if self.polling else 'change notifications'})")
+        # The first scan compares the directory to the known files, so it reports the changes made while unwatched
+        self._poll()
+        next_poll = time.monotonic() + self.poll_seconds
+        failures = 0
+        try:
+            while not self._stop_event.is_set():
+                if self.polling and time.monotonic() >= next_poll:
+                    self._poll()
+                    next_poll = time.monotonic() + self.poll_seconds
+                with self._condition:
+                    dirty = self._pop_due()
+                    if dirty is None:
+                        self._condition.wait(timeout=min(self.debounce_seconds, self.poll_seconds) / 2)
+                        continue
+                try:
+                    self._apply(*dirty)
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    if failures > self.max_retries:
+                        print(f"Failed to apply source changes {failures} times, dropping them until the files "
+                              f"change again. Error: {str(e)}")
+                        failures = 0
+                        continue
+                    delay = min(self.debounce_seconds * 2 ** (failures - 1), 300)
+                    print(f"Failed to apply source changes, retrying in {delay:.0f} seconds. Error: {str(e)}")
+                    self._stop_event.wait(delay)
+                    self.mark_dirty(dirty[0])
+                    self.mark_dirty(dirty[1], is_dir=True)
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def stop(self):
+        """
+        Stop watching. Changes that were not reported yet are dropped.
+        """
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify()
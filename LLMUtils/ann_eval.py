@@ -0,0 +1,62 @@
+import argparse
+import time
+
+import numpy as np
+
+from LLMUtils.flat_vector_store import FlatVectorStore
+from LLMUtils.vector_store_utils import get_flat_store_kwargs
+from config import settings
+
+
+def evaluate_ann(vector_store, k=10, num_queries=200, search_params=(16, 32, 64, 128, 256)):
+    """
+    Measure the recall and the latency of the ANN index of a flat vector store against exact search.
+
+    Stored embeddings are used as queries, so no embedding API calls are needed. For every value of the ANN search
+    knob (ef_search for HNSW, nprobe for IVF-PQ), recall@k is the average fraction of the exact top k rows that the
+    ANN search returns.
+
+    :param vector_store: a FlatVectorStore with an ANN index
+    :param k: number of results per query
+    :param num_queries: number of sampled queries
+    :param search_params: values of the ANN search knob to evaluate
+    :return: list of dictionaries with the knob value, recall@k and the p50 and p95 latencies in milliseconds
+    """
+    if not vector_store.update_ann_index():
+        raise ValueError("The vector store has no trained ANN index. Set ANN_INDEX and add enough vectors")
+    queries = vector_store.sample_vectors(num_queries)
+    if len(queries) == 0:
+        raise ValueError("The vector store is empty")
+    exact_rows = [set(vector_store.search_rows(query, k, exact=True)[0].tolist()) for query in queries]
+
+    results = []
+    for search_param in search_params:
+        if not vector_store.set_ann_search_param(search_param):
+            raise ValueError("The vector store has no trained ANN index. Set ANN_INDEX and add enough vectors")
+        recalls, latencies = [], []
+        for query, expected in zip(queries, exact_rows):
+            start = time.perf_counter()
+            rows, _ = vector_store.search_rows(query, k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(expected.intersection(rows.tolist())) / max(len(expected), 1))
+        results.append({"search_param": search_param, "recall": float(np.mean(recalls)),
+                        "p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95))})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the recall and latency of the ANN index of a flat "
+                                                 "vector store (ANN_INDEX setting) against exact search.")
+    parser.add_argument("vector_store_path", help="path of the flat vector store directory")
+    parser.add_argument("--k", type=int, default=10, help="number of results per query")
+    parser.add_argument("--queries", type=int, default=200, help="number of sampled queries")
+    parser.add_argument("--params", type=int, nargs="+", default=[16, 32, 64, 128, 256],
+                        help="values of ef_search (HNSW) or nprobe (IVF-PQ) to evaluate")
+    args = parser.parse_args()
+
+    store = FlatVectorStore(args.vector_store_path, embedding_function=None, **get_flat_store_kwargs())
+    print(f"{settings.ANN_INDEX} index, {store.count()} vectors, recall@{args.k} over {args.queries} queries")
+    for result in evaluate_ann(store, k=args.k, num_queries=args.queries, search_params=args.params):
+        print(f"{result['search_param']:>6}: recall {result['recall']:.3f}, "
+              f"p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms")
+    store.close()
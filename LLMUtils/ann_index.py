@@ -0,0 +1,195 @@
+import os
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+ANN_INDEX_TYPES = ("none", "hnsw", "ivfpq")
+
+
+class HnswIndex:
+    """
+    HNSW graph index (hnswlib) over the rows of a flat vector store, for low-latency approximate search.
+
+    Labels are the row numbers of the vectors. Rows are only ever added: deleted rows are filtered out by the
+    vector store, and the index is rebuilt when the vector store is compacted.
+
+    Attributes:
+        path (str): The path of the index file.
+        M (int): Number of links per node. Higher values improve recall and cost memory.
+        ef_construction (int): Size of the candidate list while building. Higher values improve the graph quality.
+        ef_search (int): Size of the candidate list while searching - the recall/latency knob.
+    """
+    file_name = "ann_hnsw.bin"
+
+    def __init__(self, dir_path, dim, M=16, ef_construction=200, ef_search=64):
+        if hnswlib is None:
+            raise ImportError("hnswlib is required for the HNSW index. Install it with `pip install hnswlib`")
+        self.path = fr"{dir_path}\{self.file_name}"
+        self.M = M
+        self.ef_construction = ef_construction
+        self.index = hnswlib.Index(space="ip", dim=dim)
+        if os.path.exists(self.path):
+            self.index.load_index(self.path)
+        else:
+            self.index.init_index(max_elements=1024, ef_construction=ef_construction, M=M)
+        self.set_search_param(ef_search)
+
+    @property
+    def num_indexed(self):
+        return self.index.get_current_count()
+
+    @property
+    def train_size(self):
+        return 0
+
+    def is_ready(self):
+        return True
+
+    def train(self, vectors):
+        pass
+
+    def set_search_param(self, ef_search):
+        """
+        :param ef_search: size of the candidate list while searching
+        """
+        self.ef_search = ef_search
+        self.index.set_ef(ef_search)
+
+    def add(self, vectors, rows):
+        """
+        Add vectors to the index.
+
+        :param vectors: float32 unit-norm vectors of shape (n, dim)
+        :param rows: row numbers of the vectors
+        """
+        required = self.num_indexed + len(rows)
+        if required > self.index.get_max_elements():
+            self.index.resize_index(max(required, 2 * self.index.get_max_elements()))
+        self.index.add_items(vectors, rows)
+
+    def search(self, query_vector, k):
+        """
+        :param query_vector: float32 unit-norm query vector
+        :param k: number of neighbours
+        :return: array of the rows of the approximate nearest neighbours
+        """
+        k = min(k, self.num_indexed)
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+        self.index.set_ef(max(self.ef_search, k))
+        labels, _ = self.index.knn_query(query_vector, k=k)
+        return labels[0].astype(np.int64)
+
+    def save(self):
+        self.index.save_index(self.path)
+
+
+class IvfPqIndex:
+    """
+    Inverted-file index with product quantization (faiss) over the rows of a flat vector store, for corpora whose
+    vectors do not fit in RAM: each vector is stored as pq_m codes of pq_nbits bits.
+
+    The index has to be trained on a sample of the vectors, so it only serves searches once the vector store has
+    train_size vectors (the vector store searches exactly until then).
+    Labels are the row numbers of the vectors. Rows are only ever added: deleted rows are filtered out by the
+    vector store, and the index is rebuilt when the vector store is compacted.
+
+    Attributes:
+        path (str): The path of the index file.
+        nlist (int): Number of inverted lists (clusters).
+        pq_m (int): Number of sub-quantizers. Must divide the embedding dimension.
+        pq_nbits (int): Bits per sub-quantizer code.
+        nprobe (int): Number of lists visited per search - the recall/latency knob.
+    """
+    file_name = "ann_ivfpq.faiss"
+
+    def __init__(self, dir_path, dim, nlist=1024, pq_m=16, pq_nbits=8, nprobe=16):
+        if faiss is None:
+            raise ImportError("faiss is required for the IVF-PQ index. Install it with `pip install faiss-cpu`")
+        if dim % pq_m != 0:
+            raise ValueError(f"The embedding dimension {dim} is not divisible by the number of sub-quantizers {pq_m}")
+        self.path = fr"{dir_path}\{self.file_name}"
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        if os.path.exists(self.path):
+            self.index = faiss.read_index(self.path)
+        else:
+            quantizer = faiss.IndexFlatIP(dim)
+            self.index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        self.set_search_param(nprobe)
+
+    @property
+    def num_indexed(self):
+        return self.index.ntotal
+
+    @property
+    def train_size(self):
+        # faiss needs about 39 training points per centroid, for the coarse and the PQ centroids
+        return 39 * max(self.nlist, 2 ** self.pq_nbits)
+
+    def is_ready(self):
+        return self.index.is_trained
+
+    def train(self, vectors):
+        """
+        :param vectors: float32 unit-norm sample of the vectors
+        """
+        self.index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def set_search_param(self, nprobe):
+        """
+        :param nprobe: number of lists visited per search
+        """
+        self.nprobe = nprobe
+        self.index.nprobe = nprobe
+
+    def add(self, vectors, rows):
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(rows, dtype=np.int64))
+
+    def search(self, query_vector, k):
+        _, labels = self.index.search(np.asarray(query_vector, dtype=np.float32)[np.newaxis, :], k)
+        return labels[0][labels[0] >= 0]
+
+    def save(self):
+        faiss.write_index(self.index, self.path)
+
+
+def create_ann_index(index_type, dir_path, dim, params):
+    """
+    Create (or load) the ANN index of a flat vector store directory.
+
+    :param index_type: one of ANN_INDEX_TYPES
+    :param dir_path: the vector store directory
+    :param dim: the embedding dimension
+    :param params: keyword arguments of the index class (e.g. M, ef_search, nlist, nprobe)
+    :return: the ANN index, or None for "none"
+    """
+    if index_type not in ANN_INDEX_TYPES:
+        raise ValueError(f"Unknown ANN index: {index_type}. Expected one of {ANN_INDEX_TYPES}")
+    if index_type == "hnsw":
+        return HnswIndex(dir_path, dim, **params)
+    if index_type == "ivfpq":
+        return IvfPqIndex(dir_path, dim, **params)
+    return None
+
+
+def remove_ann_indexes(dir_path):
+    """
+    Delete the ANN index files of a vector store directory, e.g. after its rows were renumbered.
+
+    :param dir_path: the vector store directory
+    """
+    for index_class in (HnswIndex, IvfPqIndex):
+        path = fr"{dir_path}\{index_class.file_name}"
+        if os.path.exists(path):
+            os.remove(path)
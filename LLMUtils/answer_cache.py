@@ -0,0 +1,191 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def sources_fingerprint(docs):
+    """
+    Fingerprint the documents an answer was generated from.
+
+    :param docs: list of retrieved documents
+    :return: hex digest of the documents' sources and contents, independent of their order
+    """
+    digests = sorted(
+        hashlib.sha256(f"{doc.metadata.get('source', '')}\x00{doc.page_content}".encode("utf-8")).hexdigest()
+        for doc in docs
+    )
+    return hashlib.sha256("\n".join(digests).encode("utf-8")).hexdigest()
+
+
+def key_terms(question):
+    """
+    Extract the terms that make a question specific: numbers, identifiers with digits (e.g. "AB-1234"),
+    upper-case words (e.g. "model A") and capitalized words after the first word (names of products or entities).
+    Embeddings barely move when only such a term changes, so two questions are only considered the same if their
+    key terms are the same.
+
+    :param question: the question
+    :return: frozenset of the lowercase key terms
+    """
+    words = _WORD_PATTERN.findall(question)
+    return frozenset(word.lower() for position, word in enumerate(words)
+                     if any(char.isdigit() for char in word) or word.isupper()
+                     or (position > 0 and word[0].isupper()))
+
+
+class AnswerCache:
+    """
+    Semantic cache of answered questions, stored in a vector store's date directory.
+
+    A new question is matched to the previously answered questions with the most similar embeddings, and the cached
+    answer of the most similar one is returned if the cosine similarity is above the threshold and both questions
+    have the same key terms (see key_terms), so "warranty of model A" does not get the answer of "warranty of
+    model B". Because the cache is stored in the date directory, it is invalidated automatically when an update
+    creates a new date directory.
+    The embeddings are kept in a preallocated matrix that grows by doubling. Once the cache holds max_entries
+    answers, each new answer replaces the oldest one.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+        embedder: The embeddings used to embed the questions.
+        threshold (float): The minimal cosine similarity for a cached answer to be returned.
+        max_entries (int): The maximal number of cached answers.
+    """
+    def __init__(self, path, embedder, threshold, max_entries=10_000):
+        self.path = path
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY, question TEXT NOT NULL, answer TEXT NOT NULL, "
+            "sources_fingerprint TEXT, embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._ids = []
+        self._matrix = None
+        self._size = 0
+        self._oldest = 0
+        self._load()
+
+    def _load(self):
+        rows = self._conn.execute("SELECT id, embedding FROM answers ORDER BY id DESC LIMIT ?",
+                                  (self.max_entries,)).fetchall()[::-1]
+        if rows:
+            self._conn.execute("DELETE FROM answers WHERE id < ?", (rows[0][0],))
+            self._conn.commit()
+        self._ids = [row[0] for row in rows]
+        self._size = len(rows)
+        self._oldest = 0
+        if rows:
+            self._matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        else:
+            self._matrix = None
+
+    def _append(self, row_id, vector):
+        """
+        Store an embedding in the matrix, growing it or replacing the oldest entry. Must be called while holding
+        the lock.
+
+        :return: the ID of the replaced entry, or None
+        """
+        if self._matrix is None:
+            self._matrix = np.empty((min(64, self.max_entries), len(vector)), dtype=np.float32)
+        if self._size < self.max_entries:
+            if self._size == len(self._matrix):
+                grown = np.empty((min(2 * len(self._matrix), self.max_entries), self._matrix.shape[1]),
+                                 dtype=np.float32)
+                grown[:self._size] = self._matrix[:self._size]
+                self._matrix = grown
+            self._matrix[self._size] = vector
+            self._ids.append(row_id)
+            self._size += 1
+            return None
+        slot = self._oldest
+        replaced_id = self._ids[slot]
+        self._matrix[slot] = vector
+        self._ids[slot] = row_id
+        self._oldest = (slot + 1) % self._size
+        return replaced_id
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, question):
+        """
+        Find the cached answer of the most similar previously answered question.
+
+        :param question: the new question
+        :return: dict with question, answer, sources_fingerprint and similarity, or None if no cached question
+            is similar enough
+        """
+        if not self._size:
+            self.misses += 1
+            return None
+        vector = self._normalize(self.embedder.embed_query(question))
+        terms = key_terms(question)
+        with self._lock:
+            similarities = self._matrix[:self._size] @ vector
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            for best in candidates[np.argsort(-similarities[candidates])]:
+                cached_question, answer, fingerprint = self._conn.execute(
+                    "SELECT question, answer, sources_fingerprint FROM answers WHERE id = ?",
+                    (self._ids[best],)).fetchone()
+                if key_terms(cached_question) == terms:
+                    self.hits += 1
+                    return {"question": cached_question, "answer": answer, "sources_fingerprint": fingerprint,
+                            "similarity": float(similarities[best])}
+        self.misses += 1
+        return None
+
+    def add(self, question, answer, fingerprint=None):
+        """
+        Cache the answer of a question.
+
+        :param question: the (standalone) question
+        :param answer: the answer
+        :param fingerprint: fingerprint of the documents the answer was generated from
+        """
+        vector = self._normalize(self.embedder.embed_query(question))
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (question, answer, sources_fingerprint, embedding, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (question, answer, fingerprint, vector.tobytes(), time.time()))
+            replaced_id = self._append(cursor.lastrowid, vector)
+            if replaced_id is not None:
+                self._conn.execute("DELETE FROM answers WHERE id = ?", (replaced_id,))
+            self._conn.commit()
+
+    def clear(self):
+        """
+        Remove all the cached answers, e.g. after the vector store was updated in place.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._ids = []
+            self._matrix = None
+            self._size = 0
+            self._oldest = 0
+
+    def close(self):
+        """
+        Close the underlying database connection.
+        """
+        with self._lock:
+            self._conn.close()
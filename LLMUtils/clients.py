@@ -0,0 +1,214 @@
+import threading
+import time
+
+import httpx
+from langchain_community.llms import OpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from config import settings
+
+try:
+    import h2  # noqa: F401 - HTTP/2 support of httpx
+except ImportError:
+    h2 = None
+
+_lock = threading.Lock()
+_http_client = None
+_models = {}
+_stats = {"requests": 0, "in_flight": 0, "errors": 0, "total_seconds": 0.0}
+
+
+def _http_limits():
+    return httpx.Limits(max_connections=settings.HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=settings.HTTP_KEEPALIVE_SECONDS)
+
+
+def _http_timeout():
+    return httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+
+
+def _use_http2():
+    return settings.HTTP2 and h2 is not None
+
+
+def _finish_request(start, failed):
+    with _lock:
+        _stats["in_flight"] -= 1
+        _stats["total_seconds"] += time.perf_counter() - start
+        _stats["errors"] += failed
+
+
+class _TimedStream(httpx.SyncByteStream):
+    """
+    Response body stream finishing the request's statistics when it is closed, so the latency of a streamed
+    response covers its whole body, not only its headers.
+    """
+
+    def __init__(self, stream, start, failed):
+        self.stream = stream
+        self.start = start
+        self.failed = failed
+        self._closed = False
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.stream.close()
+        finally:
+            _finish_request(self.start, self.failed)
+
+
+class _CountingTransport(httpx.BaseTransport):
+    """
+    HTTP transport counting the requests sent through a pooled transport, for client_stats.
+    A request is in flight until its response is closed (read to the end, or its stream closed).
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def handle_request(self, request):
+        start = time.perf_counter()
+        with _lock:
+            _stats["requests"] += 1
+            _stats["in_flight"] += 1
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            _finish_request(start, True)
+            raise
+        response.stream = _TimedStream(response.stream, start, response.status_code >= 400)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+def get_http_client():
+    """
+    Return the process-wide HTTP client of the OpenAI clients.
+
+    Sharing one client shares its connection pool, so connections (and their TLS sessions) are kept alive and
+    reused by every LLM and embedding call instead of being opened per client. The pool is bounded by
+    settings.HTTP_MAX_CONNECTIONS: requests beyond it wait for a free connection. HTTP/2 is used when
+    settings.HTTP2 is True and the h2 package is installed (pip install httpx[http2]).
+    Only the synchronous calls share it: an asynchronous httpx client is bound to the event loop that first uses it,
+    so the asynchronous calls (e.g. of the embedding scheduler) keep the clients of their own event loops.
+
+    :return: httpx.Client
+    """
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            transport = httpx.HTTPTransport(limits=_http_limits(), http2=_use_http2())
+            _http_client = httpx.Client(transport=_CountingTransport(transport), timeout=_http_timeout())
+        return _http_client
+
+
+def _get_model(key, factory):
+    """
+    Return the cached model of a key, creating it with factory the first time.
+    """
+    with _lock:
+        model = _models.get(key)
+    if model is None:
+        model = factory()
+        with _lock:
+            model = _models.setdefault(key, model)
+    return model
+
+
+def get_chat_model(model_name, temperature, streaming=False):
+    """
+    Return the shared ChatOpenAI of a model, temperature and streaming mode, using the shared HTTP client.
+    Chat models hold no conversation state (callbacks are passed per call), so they are shared by all the chains.
+
+    :param model_name: the model name
+    :param temperature: the temperature
+    :param streaming: whether the model streams its tokens to the callbacks
+    :return: ChatOpenAI
+    """
+    return _get_model(("chat", model_name, temperature, streaming), lambda: ChatOpenAI(
+        model_name=model_name, temperature=temperature, streaming=streaming, api_key=settings.OPENAI_API_KEY,
+        max_retries=settings.LLM_MAX_RETRIES, http_client=get_http_client()))
+
+
+def get_completion_model(model_name, temperature):
+    """
+    Return the shared (completions API) OpenAI LLM of a model and temperature, using the shared HTTP client.
+
+    :param model_name: the model name
+    :param temperature: the temperature
+    :return: OpenAI LLM
+    """
+    return _get_model(("completion", model_name, temperature), lambda: OpenAI(
+        model=model_name, temperature=temperature, openai_api_key=settings.OPENAI_API_KEY,
+        max_retries=settings.LLM_MAX_RETRIES, http_client=get_http_client()))
+
+
+def get_openai_embeddings(model_name):
+    """
+    Return the shared OpenAIEmbeddings of a model, using the shared HTTP client.
+
+    :param model_name: the embedding model name
+    :return: OpenAIEmbeddings
+    """
+    return _get_model(("embeddings", model_name), lambda: OpenAIEmbeddings(
+        model=model_name, api_key=settings.OPENAI_API_KEY, max_retries=settings.LLM_MAX_RETRIES,
+        http_client=get_http_client()))
+
+
+def _pool_connections(client):
+    """
+    The pool is not part of the public httpx API, so its attributes may change between httpx versions.
+
+    :return: tuple of (open connections, idle connections) of a client's pool, or None if they can't be inspected
+    """
+    try:
+        transport = getattr(getattr(client, "_transport", None), "transport", None)
+        connections = getattr(getattr(transport, "_pool", None), "connections", None)
+        if connections is None:
+            return None
+        connections = list(connections)
+        return len(connections), sum(1 for connection in connections if connection.is_idle())
+    except Exception:
+        return None
+
+
+def client_stats():
+    """
+    Return statistics of the shared HTTP client: the requests sent, the requests whose response is not finished yet,
+    the failed (connection error or 4xx/5xx) requests, the mean request latency (until the response is read, so
+    streamed responses count their whole stream), and the open and idle connections of the connection pool, when
+    the installed httpx version allows inspecting it.
+
+    :return: dictionary of statistics
+    """
+    with _lock:
+        stats = dict(_stats)
+        client = _http_client
+        stats["models"] = len(_models)
+    stats["mean_seconds"] = round(stats.pop("total_seconds") / max(stats["requests"] - stats["in_flight"], 1), 3)
+    stats["http2"] = _use_http2()
+    connections = _pool_connections(client) if client is not None else None
+    if connections is not None:
+        stats["connections"], stats["idle_connections"] = connections
+    return stats
+
+
+def close_clients():
+    """
+    Close the shared HTTP client and forget the shared models.
+    """
+    global _http_client
+    with _lock:
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        _models.clear()
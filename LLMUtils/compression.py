@@ -1,8 +1,6 @@
 from langchain.retrievers import ContextualCompressionRetriever
 from langchain.retrievers.document_compressors import LLMChainExtractor
-# from langchain.llms import OpenAI as langchainLLMsOpenAI
-from langchain_community.llms import OpenAI as langchainLLMsOpenAI
-
+from LLMUtils.clients import get_completion_model
 from config import settings
 
 
@@ -18,7 +16,7 @@ def get_compression_retriever(base_retriever, model=settings.LLM_MODEL_COMPRESS,
     :param temperature: The temperature to use for the base compressor.
     :return: A ContextualCompressionRetriever that wraps the base retriever.
     """
-    llm_instruct = langchainLLMsOpenAI(model=model, temperature=temperature)
+    llm_instruct = get_completion_model(model, temperature)
     compressor = LLMChainExtractor.from_llm(llm_instruct)
 
     compression_retriever = ContextualCompressionRetriever(
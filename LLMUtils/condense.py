@@ -0,0 +1,168 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import numpy as np
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain_core.callbacks import CallbackManagerForChainRun
+
+from LLMUtils.answer_cache import key_terms
+
+CONDENSE_MODES = ("always", "auto", "speculative")
+
+# Words referring to something said earlier in the conversation
+_REFERRING_WORDS = frozenset({
+    "it", "its", "it's", "itself", "this", "that", "these", "those", "they", "them", "their", "theirs", "he", "him",
+    "his", "she", "her", "hers", "there", "above", "previous", "previously", "earlier", "former", "latter", "same",
+    "again", "also", "else", "further", "more", "another",
+})
+# Openings of follow-up questions, e.g. "and the second one?", "what about Python?"
+_FOLLOW_UP_OPENINGS = ("and", "but", "so", "or", "then", "also", "what about", "how about", "why not")
+_WORD_PATTERN = re.compile(r"[a-z']+")
+
+
+def is_standalone_question(question, min_words=4):
+    """
+    Guess with a cheap local heuristic whether a question can be understood without the chat history.
+
+    A question is considered to depend on the history if it is short, opens like a follow-up ("and ...",
+    "what about ...") or contains a word referring to something said before ("it", "those", "the same", ...).
+    The heuristic is conservative: a standalone question it misses only costs the condensing LLM call.
+
+    :param question: the question
+    :param min_words: questions with fewer words are considered follow-ups
+    :return: whether the question is standalone
+    """
+    words = _WORD_PATTERN.findall(question.lower())
+    if len(words) < min_words:
+        return False
+    opening = " ".join(words[:2])
+    if any(opening == follow_up or opening.startswith(follow_up + " ") for follow_up in _FOLLOW_UP_OPENINGS):
+        return False
+    return not _REFERRING_WORDS.intersection(words)
+
+
+def _normalize_question(question):
+    return " ".join(_WORD_PATTERN.findall(question.lower()))
+
+
+_speculative_executor = None
+_speculative_executor_lock = threading.Lock()
+
+
+def _get_speculative_executor():
+    """
+    Return the process-wide executor of the speculative retrievals, shared by all the chains.
+
+    :return: ThreadPoolExecutor
+    """
+    global _speculative_executor
+    with _speculative_executor_lock:
+        if _speculative_executor is None:
+            _speculative_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative-retrieval")
+        return _speculative_executor
+
+
+def find_query_embedder(retriever):
+    """
+    Find the query embedder of a retriever, looking through the retrievers it wraps (hybrid, compression).
+
+    :param retriever: the retriever
+    :return: the query embedder, or None if the retriever has none
+    """
+    while retriever is not None:
+        if getattr(retriever, "query_embedder", None) is not None:
+            return retriever.query_embedder
+        retriever = getattr(retriever, "dense_retriever", None) or getattr(retriever, "base_retriever", None)
+    return None
+
+
+class CondensingRetrievalChain(ConversationalRetrievalChain):
+    """
+    Conversational retrieval chain that only condenses the question with the chat history when it is needed.
+
+    ConversationalRetrievalChain makes an LLM call to rewrite every question after the first one as a standalone
+    question before retrieving the documents. Depending on condense_mode:
+        - "always": every question is condensed, as in ConversationalRetrievalChain.
+        - "auto": questions that is_standalone_question deems standalone are not condensed, so the retrieval
+          starts right away.
+        - "speculative": as "auto", and while a question is condensed, the documents of the raw question are
+          retrieved in parallel (in a shared executor, without callbacks). They are used if the condensed question
+          means the same as the raw question (see _same_question), saving the retrieval after the condensing call;
+          otherwise the condensed question is retrieved too, so this mode trades extra retrievals for latency.
+
+    Attributes:
+        condense_mode (str): One of CONDENSE_MODES.
+        question_embedder: The query embedder of the retriever (see find_query_embedder), used to compare the
+            condensed and raw questions in "speculative" mode. Its embeddings are cached, so the comparison does not
+            add embedding calls to the retrievals. If None, the questions must be equal.
+        speculative_threshold (float): Minimal cosine similarity of the condensed and raw questions for the
+            speculative documents to be used.
+    """
+    condense_mode: str = "auto"
+    question_embedder: Optional[Any] = None
+    speculative_threshold: float = 0.97
+
+    def _needs_condensing(self, question, chat_history_str):
+        if not chat_history_str:
+            return False
+        return self.condense_mode == "always" or not is_standalone_question(question)
+
+    def _same_question(self, question, new_question):
+        """
+        :return: whether the condensed question asks the same as the raw question: equal words, or the same key
+            terms (see answer_cache.key_terms) and embeddings at least speculative_threshold cosine-similar
+        """
+        if _normalize_question(new_question) == _normalize_question(question):
+            return True
+        if self.question_embedder is None or key_terms(new_question) != key_terms(question):
+            return False
+        vectors = np.asarray([self.question_embedder.embed_query(question),
+                              self.question_embedder.embed_query(new_question)], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return float(vectors[0] @ vectors[1]) >= self.speculative_threshold
+
+    def _call(self, inputs: Dict[str, Any],
+              run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        get_chat_history = self.get_chat_history or _get_chat_history
+        chat_history_str = get_chat_history(inputs["chat_history"])
+
+        if not self._needs_condensing(question, chat_history_str):
+            new_question = question
+            docs = self._get_docs(new_question, inputs, run_manager=_run_manager)
+        elif self.condense_mode == "speculative":
+            # The speculative retrieval may outlive the run, so it does not report to the run's callbacks
+            speculative_docs = _get_speculative_executor().submit(
+                self._get_docs, question, inputs, run_manager=CallbackManagerForChainRun.get_noop_manager())
+            new_question = self.question_generator.run(question=question, chat_history=chat_history_str,
+                                                       callbacks=_run_manager.get_child())
+            if self._same_question(question, new_question):
+                docs = speculative_docs.result()
+            else:
+                # A discarded speculative retrieval is not waited for
+                speculative_docs.cancel()
+                docs = self._get_docs(new_question, inputs, run_manager=_run_manager)
+        else:
+            new_question = self.question_generator.run(question=question, chat_history=chat_history_str,
+                                                       callbacks=_run_manager.get_child())
+            docs = self._get_docs(new_question, inputs, run_manager=_run_manager)
+
+        output = {}
+        if self.response_if_no_docs_found is not None and len(docs) == 0:
+            output[self.output_key] = self.response_if_no_docs_found
+        else:
+            new_inputs = inputs.copy()
+            if self.rephrase_question:
+                new_inputs["question"] = new_question
+            new_inputs["chat_history"] = chat_history_str
+            output[self.output_key] = self.combine_docs_chain.run(input_documents=docs,
+                                                                  callbacks=_run_manager.get_child(), **new_inputs)
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        if self.return_generated_question:
+            output["generated_question"] = new_question
+        return output
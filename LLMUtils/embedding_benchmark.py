@@ -0,0 +1,78 @@
+import argparse
+import random
+import time
+
+from LLMUtils.embedding_scheduler import AsyncBatchEmbeddings
+from LLMUtils.fake_embedding_server import FakeEmbeddingServer
+from config import settings
+
+
+def make_texts(num_texts, words_per_text=200, seed=0):
+    """
+    Generate distinct synthetic texts.
+
+    :param num_texts: number of texts
+    :param words_per_text: number of words per text
+    :param seed: seed of the random words
+    :return: list of texts
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    return [f"text {i}: " + " ".join(rng.choices(vocabulary, k=words_per_text)) for i in range(num_texts)]
+
+
+def benchmark_embeddings(base_url, texts, concurrencies=(1, 2, 4, 8, 16), model=settings.EMBEDDING_MODEL,
+                         api_key="fake", max_batch_inputs=settings.EMBEDDING_BATCH_MAX_INPUTS,
+                         max_batch_tokens=settings.EMBEDDING_BATCH_MAX_TOKENS):
+    """
+    Measure the throughput of the embedding scheduler for several concurrency limits.
+
+    :param base_url: base URL of the embeddings endpoint (e.g. FakeEmbeddingServer.base_url)
+    :param texts: texts to embed
+    :param concurrencies: values of max_concurrency to measure
+    :param model: the embedding model name (selects the tokenizer)
+    :param api_key: the API key sent to the endpoint
+    :param max_batch_inputs: maximal number of texts per request
+    :param max_batch_tokens: maximal number of tokens per request
+    :return: list of dictionaries with the concurrency, the seconds and the texts per second
+    """
+    results = []
+    for concurrency in concurrencies:
+        embeddings = AsyncBatchEmbeddings(model, api_key=api_key, base_url=base_url, max_concurrency=concurrency,
+                                          max_batch_inputs=max_batch_inputs, max_batch_tokens=max_batch_tokens)
+        start = time.perf_counter()
+        vectors = embeddings.embed_documents(texts)
+        seconds = time.perf_counter() - start
+        if len(vectors) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}")
+        results.append({"concurrency": concurrency, "seconds": seconds, "texts_per_second": len(texts) / seconds})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the embedding scheduler against a local fake embedding "
+                                                 "server (or another endpoint with --base-url).")
+    parser.add_argument("--texts", type=int, default=2000, help="number of texts to embed")
+    parser.add_argument("--words", type=int, default=200, help="number of words per text")
+    parser.add_argument("--batch-inputs", type=int, default=64, help="maximal number of texts per request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16],
+                        help="values of max_concurrency to measure")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per request of the fake server")
+    parser.add_argument("--rps", type=float, default=None, help="requests per second of the fake server before 429")
+    parser.add_argument("--base-url", default=None, help="embeddings endpoint to benchmark instead of the fake server")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = FakeEmbeddingServer(latency=args.latency, max_requests_per_second=args.rps).start()
+        base_url = server.base_url
+    texts = make_texts(args.texts, args.words)
+    print(f"{len(texts)} texts of {args.words} words, {args.batch_inputs} texts per request, {base_url}")
+    for result in benchmark_embeddings(base_url, texts, concurrencies=args.concurrency,
+                                       max_batch_inputs=args.batch_inputs):
+        print(f"concurrency {result['concurrency']:>3}: {result['seconds']:.2f} s, "
+              f"{result['texts_per_second']:.0f} texts/s")
+    if server is not None:
+        print(f"{server.requests} requests, {server.rate_limited} rate limited")
+        server.stop()
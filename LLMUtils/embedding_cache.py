@@ -0,0 +1,354 @@
+from array import array
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text):
+    """
+    Normalize a chunk text before hashing it, so that chunks which differ only by unicode form
+    or whitespace share the same cache entry.
+
+    :param text: text to normalize
+    :return: normalized text
+    """
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split())
+
+
+def text_key(model_name, text):
+    """
+    Build the content-addressed cache key of a text for a given embedding model.
+
+    :param model_name: name of the embedding model
+    :param text: the (un-normalized) text
+    :return: hex digest key
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, size-bounded LRU store of embeddings backed by SQLite.
+
+    Entries are keyed by (embedding model, normalized text hash) so they are shared across versions,
+    date directories and rebuilds. When the stored vectors exceed max_bytes the least recently used
+    entries are evicted.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+        max_bytes (int): The maximal total size of the stored vectors.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that were not in the cache.
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        Look up the embeddings of the given keys and mark the found entries as recently used.
+
+        :param keys: list of cache keys
+        :return: dict of key to embedding (list of floats) for the keys found in the cache
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                self._conn.commit()
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, model_name, items):
+        """
+        Store embeddings in the cache and evict least recently used entries if the cache is full.
+
+        :param model_name: name of the embedding model
+        :param items: dict of key to embedding (list of floats)
+        """
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, model_name, array("f", vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            replaced = 0
+            for start in range(0, len(rows), 500):
+                batch = [row[0] for row in rows[start:start + 500]]
+                placeholders = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({placeholders})",
+                    batch).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+            self._total_bytes += sum(len(row[2]) for row in rows) - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        Evict least recently used entries until the cache is back under 90% of max_bytes.
+        Must be called while holding the lock.
+        """
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used ASC LIMIT 1000").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            freed = 0
+            evicted = []
+            for key, size in rows:
+                evicted.append((key,))
+                freed += size
+                if self._total_bytes - freed <= target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+            self._total_bytes -= freed
+            self.evictions += len(evicted)
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        :return: dict with hits, misses, evictions, hit_rate and the stored bytes
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes": self._total_bytes,
+        }
+
+    def close(self):
+        """
+        Close the underlying database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that consults an EmbeddingCache before calling the underlying provider.
+
+    Only the texts that are missing from the cache are sent to the provider, and their embeddings
+    are written back to the cache.
+
+    Attributes:
+        underlying (Embeddings): The embedding model to call on cache misses.
+        model_name (str): The name of the embedding model, part of the cache key.
+        cache (EmbeddingCache): The persistent cache.
+    """
+    def __init__(self, underlying, model_name, cache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        """
+        Embed a list of documents, using the cache where possible.
+
+        :param texts: list of texts to embed
+        :return: list of embeddings, in the order of the texts
+        """
+        keys = [text_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new_items = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, new_items)
+            found.update(new_items)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        """
+        Embed a query text. Queries are not written to the persistent cache.
+
+        :param text: the query text
+        :return: the embedding of the query
+        """
+        return self.underlying.embed_query(text)
+
+
+_caches = {}
+
+
+def get_embedding_cache(path, max_bytes):
+    """
+    Return the process-wide EmbeddingCache of the given path, opening it on first use.
+
+    :param path: path of the SQLite database file
+    :param max_bytes: the maximal total size of the stored vectors
+    :return: the embedding cache
+    """
+    if path not in _caches:
+        _caches[path] = EmbeddingCache(path, max_bytes)
+    return _caches[path]
+
+
+def normalize_query(text):
+    """
+    Normalize a query before hashing it. In addition to the chunk normalization, queries are case-folded,
+    so questions that differ only by case share the same cache entry.
+
+    :param text: query text to normalize
+    :return: normalized query text
+    """
+    return normalize_text(text).casefold()
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU cache of query embeddings, keyed by (embedding model, normalized query hash),
+    with an optional persistent second level (an EmbeddingCache) that survives restarts.
+
+    Attributes:
+        max_size (int): The maximal number of query embeddings kept in memory.
+        persistent (EmbeddingCache): The persistent second level, or None.
+        hits (int): Number of queries answered from the cache.
+        misses (int): Number of queries that were embedded.
+    """
+    def __init__(self, max_size, persistent=None):
+        self.max_size = max_size
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_query(self, embedding_model, model_name, text):
+        """
+        Return the embedding of a query from the cache, embedding it with embedding_model on a miss.
+
+        :param embedding_model: the embedding model to call on a miss
+        :param model_name: the name of the embedding model, part of the cache key
+        :param text: the query text
+        :return: the embedding of the query
+        """
+        key = text_key(model_name, normalize_query(text))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        vector = None
+        if self.persistent is not None:
+            vector = self.persistent.get_many([key]).get(key)
+        if vector is None:
+            vector = embedding_model.embed_query(text)
+            if self.persistent is not None:
+                self.persistent.put_many(model_name, {key: vector})
+
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return vector
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        :return: dict with hits, misses, hit_rate and the number of entries in memory
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+        }
+
+
+class QueryCachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that answers embed_query from a QueryEmbeddingCache.
+    Documents are passed through to the underlying embedding model.
+
+    Attributes:
+        underlying (Embeddings): The embedding model.
+        model_name (str): The name of the embedding model, part of the cache key.
+        query_cache (QueryEmbeddingCache): The query embedding cache.
+    """
+    def __init__(self, underlying, model_name, query_cache):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.query_cache = query_cache
+
+    def embed_documents(self, texts):
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.query_cache.embed_query(self.underlying, self.model_name, text)
+
+
+_query_caches = {}
+
+
+def get_query_embedding_cache(max_size, persist_path=None, max_bytes=0):
+    """
+    Return the process-wide QueryEmbeddingCache, creating it on first use.
+
+    :param max_size: the maximal number of query embeddings kept in memory
+    :param persist_path: path of the SQLite database of the persistent second level. If None, nothing is persisted.
+    :param max_bytes: the maximal total size of the persisted query embeddings
+    :return: the query embedding cache
+    """
+    if persist_path not in _query_caches:
+        persistent = get_embedding_cache(persist_path, max_bytes) if persist_path is not None else None
+        _query_caches[persist_path] = QueryEmbeddingCache(max_size, persistent=persistent)
+    return _query_caches[persist_path]
@@ -0,0 +1,268 @@
+import asyncio
+import math
+import random
+import threading
+
+import numpy as np
+import openai
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+
+def _is_quota_error(error):
+    """
+    :return: whether an API error reports an exhausted quota or billing limit
+    """
+    if getattr(error, "code", None) == "insufficient_quota":
+        return True
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        body = body.get("error", body)
+        return isinstance(body, dict) and body.get("code") == "insufficient_quota"
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    Async concurrency limiter whose limit adapts to rate limiting (additive increase, multiplicative decrease).
+
+    The limit is halved whenever a request is rate limited and grows back by one after every
+    `limit` successful requests, up to max_limit.
+
+    Attributes:
+        max_limit (int): The maximal number of requests in flight.
+        limit (int): The current number of requests allowed in flight.
+    """
+    def __init__(self, max_limit):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = None
+
+    def _get_condition(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self, rate_limited=False):
+        condition = self._get_condition()
+        async with condition:
+            self._in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self.limit < self.max_limit and self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            condition.notify_all()
+
+
+class _EventLoopThread:
+    """
+    A daemon thread running an asyncio event loop, used to run the scheduler from synchronous code
+    (and from threads that already run another event loop) while keeping one HTTP connection pool alive.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True, name="embedding-scheduler")
+        self._thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def run_async(self, coro):
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+
+class AsyncBatchEmbeddings(Embeddings):
+    """
+    OpenAI embeddings with a concurrent, rate-limit-aware request scheduler.
+
+    Texts are packed into batches bounded by a token budget and a number of inputs, up to max_concurrency
+    batches are requested in parallel, rate-limited and transient failures are retried with backoff
+    (honoring the server's retry-after headers) while the concurrency adapts down, and the embeddings are
+    returned in the order of the texts. An exhausted quota (insufficient_quota) is not retried.
+    Texts longer than max_input_tokens are split into pieces of max_input_tokens, whose embeddings are averaged
+    (weighted by their number of tokens) and normalized, as OpenAIEmbeddings does.
+    The endpoint can be changed with base_url, e.g. to benchmark against the local fake embedding server
+    (see fake_embedding_server and embedding_benchmark).
+
+    Attributes:
+        model (str): The name of the embedding model.
+        max_concurrency (int): The maximal number of requests in flight.
+        max_batch_tokens (int): The maximal number of tokens per request.
+        max_batch_inputs (int): The maximal number of texts per request.
+        max_retries (int): The maximal number of retries per request.
+        max_input_tokens (int): Texts longer than this number of tokens are split.
+    """
+    def __init__(self, model, api_key=None, base_url=None, max_concurrency=4, max_batch_tokens=100_000,
+                 max_batch_inputs=1024, max_retries=6, max_input_tokens=8191):
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_inputs = max_batch_inputs
+        self.max_retries = max_retries
+        self.max_input_tokens = max_input_tokens
+
+        try:
+            self._encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+        self._loop_thread = None
+        self._client = None
+        self._limiter = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop_thread is None:
+                self._loop_thread = _EventLoopThread()
+        return self._loop_thread
+
+    def _get_client(self):
+        # Created inside the scheduler's event loop, which owns the client's connection pool
+        if self._client is None:
+            self._client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            self._limiter = AdaptiveLimiter(self.max_concurrency)
+        return self._client
+
+    def split_inputs(self, texts):
+        """
+        Split the texts into inputs of at most max_input_tokens tokens.
+
+        :param texts: list of texts
+        :return: list of (index of the text, input text, number of tokens) tuples, in the order of the texts
+        """
+        inputs = []
+        for index, text in enumerate(texts):
+            tokens = self._encoding.encode(text or " ", disallowed_special=())
+            if len(tokens) <= self.max_input_tokens:
+                inputs.append((index, text or " ", len(tokens)))
+                continue
+            for start in range(0, len(tokens), self.max_input_tokens):
+                piece = tokens[start:start + self.max_input_tokens]
+                inputs.append((index, self._encoding.decode(piece), len(piece)))
+        return inputs
+
+    def pack_batches(self, inputs):
+        """
+        Pack inputs into batches bounded by max_batch_tokens and max_batch_inputs.
+        Small workloads are spread over (up to) max_concurrency batches, so they are requested in parallel too.
+
+        :param inputs: list of (index of the text, input text, number of tokens) tuples (see split_inputs)
+        :return: list of batches, each a list of (index of the input, input text) tuples
+        """
+        max_inputs = min(self.max_batch_inputs, max(16, math.ceil(len(inputs) / self.max_concurrency)))
+        batches, batch, batch_tokens = [], [], 0
+        for input_index, (_, text, num_tokens) in enumerate(inputs):
+            if batch and (batch_tokens + num_tokens > self.max_batch_tokens or len(batch) >= max_inputs):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append((input_index, text))
+            batch_tokens += num_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    @staticmethod
+    def _retry_delay(error, attempt):
+        """
+        Compute how long to wait before retrying a failed request.
+        The server's retry-after headers are honored; otherwise an exponential backoff with jitter is used.
+        """
+        response = getattr(error, "response", None)
+        if response is not None:
+            headers = response.headers
+            try:
+                if "retry-after-ms" in headers:
+                    return float(headers["retry-after-ms"]) / 1000
+                if "retry-after" in headers:
+                    return float(headers["retry-after"])
+            except ValueError:
+                pass
+        return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def _embed_batch(self, batch):
+        client = self._get_client()
+        attempt = 0
+        while True:
+            await self._limiter.acquire()
+            rate_limited = False
+            try:
+                response = await client.embeddings.create(model=self.model, input=[text for _, text in batch],
+                                                          encoding_format="float")
+                return [(index, item.embedding) for (index, _), item in
+                        zip(batch, sorted(response.data, key=lambda item: item.index))]
+            except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError,
+                    openai.InternalServerError) as e:
+                rate_limited = isinstance(e, openai.RateLimitError)
+                # An exhausted quota is reported as a rate limit, but waiting does not help
+                if attempt >= self.max_retries or _is_quota_error(e):
+                    raise
+                delay = self._retry_delay(e, attempt)
+                attempt += 1
+            finally:
+                await self._limiter.release(rate_limited=rate_limited)
+            await asyncio.sleep(delay)
+
+    async def _embed(self, texts):
+        inputs = self.split_inputs(texts)
+        results = await asyncio.gather(*[self._embed_batch(batch) for batch in self.pack_batches(inputs)])
+        input_embeddings = [None] * len(inputs)
+        for batch_results in results:
+            for input_index, embedding in batch_results:
+                input_embeddings[input_index] = embedding
+        if len(inputs) == len(texts):
+            return input_embeddings
+        # Average the embeddings of the pieces of the split texts
+        pieces = [[] for _ in texts]
+        for (index, _, num_tokens), embedding in zip(inputs, input_embeddings):
+            pieces[index].append((embedding, num_tokens))
+        embeddings = []
+        for text_pieces in pieces:
+            if len(text_pieces) == 1:
+                embeddings.append(text_pieces[0][0])
+                continue
+            average = np.average([embedding for embedding, _ in text_pieces], axis=0,
+                                 weights=[num_tokens for _, num_tokens in text_pieces])
+            embeddings.append((average / np.linalg.norm(average)).tolist())
+        return embeddings
+
+    def embed_documents(self, texts):
+        """
+        Embed a list of documents.
+
+        :param texts: list of texts to embed
+        :return: list of embeddings, in the order of the texts
+        """
+        if not texts:
+            return []
+        return self._ensure_loop().run(self._embed(list(texts)))
+
+    def embed_query(self, text):
+        """
+        Embed a query text.
+
+        :param text: the query text
+        :return: the embedding of the query
+        """
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        if not texts:
+            return []
+        return await self._ensure_loop().run_async(self._embed(list(texts)))
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
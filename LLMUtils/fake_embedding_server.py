@@ -0,0 +1,162 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class FakeEmbeddingServer:
+    """
+    Local HTTP server imitating the OpenAI embeddings endpoint (POST <base_url>/embeddings), to test and benchmark
+    the embedding scheduler without API calls or costs.
+
+    Embeddings are deterministic unit vectors derived from a hash of each input. Every request takes latency
+    seconds plus latency_per_input seconds per input. Requests beyond max_requests_per_second are rejected with 429
+    and a retry-after-ms header, like a rate-limited API; with quota_exhausted, every request is rejected with an
+    insufficient_quota error.
+
+    Attributes:
+        host (str): The address to listen on.
+        port (int): The port to listen on (0 picks a free port).
+        dim (int): The dimension of the embeddings.
+        latency (float): Seconds per request.
+        latency_per_input (float): Additional seconds per input of a request.
+        max_requests_per_second (float): Rate limit of the requests, or None for no limit.
+        quota_exhausted (bool): Whether every request fails with insufficient_quota.
+        requests (int): Number of requests received.
+        rate_limited (int): Number of requests rejected with 429.
+    """
+    def __init__(self, host="127.0.0.1", port=0, dim=1536, latency=0.05, latency_per_input=0.0005,
+                 max_requests_per_second=None, quota_exhausted=False):
+        self.dim = dim
+        self.latency = latency
+        self.latency_per_input = latency_per_input
+        self.max_requests_per_second = max_requests_per_second
+        self.quota_exhausted = quota_exhausted
+        self.requests = 0
+        self.rate_limited = 0
+
+        self._lock = threading.Lock()
+        self._request_times = []
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self.host, self.port = self._httpd.server_address[:2]
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """
+        :return: the base URL to pass to the OpenAI client (EMBEDDING_BASE_URL)
+        """
+        return f"http://{self.host}:{self.port}/v1"
+
+    def embed(self, text):
+        """
+        :return: the deterministic unit embedding of a text
+        """
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+    def _is_rate_limited(self):
+        """
+        :return: whether a request received now exceeds max_requests_per_second over the last second
+        """
+        if self.max_requests_per_second is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._request_times = [t for t in self._request_times if now - t < 1.0]
+            if len(self._request_times) >= self.max_requests_per_second:
+                return True
+            self._request_times.append(now)
+            return False
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.requests += 1
+                if not self.path.rstrip("/").endswith("/embeddings"):
+                    return self._send(404, {"error": {"message": "Not found", "code": None}})
+                if server.quota_exhausted:
+                    return self._send(429, {"error": {"message": "You exceeded your current quota",
+                                                      "type": "insufficient_quota", "code": "insufficient_quota"}})
+                if server._is_rate_limited():
+                    with server._lock:
+                        server.rate_limited += 1
+                    return self._send(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                                      "code": "rate_limit_exceeded"}},
+                                      headers={"retry-after-ms": "200"})
+                request = json.loads(body or b"{}")
+                inputs = request.get("input", [])
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                time.sleep(server.latency + server.latency_per_input * len(inputs))
+                data = [{"object": "embedding", "index": index, "embedding": server.embed(str(text)).tolist()}
+                        for index, text in enumerate(inputs)]
+                num_tokens = sum(len(str(text).split()) for text in inputs)
+                self._send(200, {"object": "list", "data": data, "model": request.get("model"),
+                                 "usage": {"prompt_tokens": num_tokens, "total_tokens": num_tokens}})
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        """
+        Serve in a background thread.
+
+        :return: the server
+        """
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="fake-embeddings")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving and close the socket.
+        """
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake OpenAI embeddings locally, e.g. for "
+                                                 "EMBEDDING_BASE_URL=http://127.0.0.1:8090/v1.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8090, help="port to listen on")
+    parser.add_argument("--dim", type=int, default=1536, help="dimension of the embeddings")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    parser.add_argument("--rps", type=float, default=None, help="requests per second before answering 429")
+    args = parser.parse_args()
+
+    server = FakeEmbeddingServer(args.host, args.port, dim=args.dim, latency=args.latency,
+                                 max_requests_per_second=args.rps)
+    print(f"Fake embeddings at {server.base_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
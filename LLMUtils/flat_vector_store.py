@@ -0,0 +1,639 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from LLMUtils.ann_index import create_ann_index, remove_ann_indexes
+from LLMUtils.vector_math import normalize_rows, top_k, maximal_marginal_relevance
+
+FLAT_INDEX_FILE = "flat_index.sqlite"
+FLAT_DTYPES = ("float32", "float16")
+
+
+class _ReadWriteLock:
+    """
+    Lock held by any number of readers or by one writer. Waiting writers go first, so readers can't starve them.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class FlatVectorStore(VectorStore):
+    """
+    Vector store keeping the embeddings in one contiguous memory-mapped array, searched exactly with NumPy.
+
+    The directory holds the unit-norm embeddings as a raw float32/float16 array (vectors.bin), one tombstone byte per
+    row (deleted.bin), and a SQLite table mapping rows to chunk IDs, texts and metadata (flat_index.sqlite).
+    Opening the store maps the arrays without reading them, so it takes constant time regardless of the size.
+    A query is one matrix-vector product over the mapped array and an argpartition top-k; only the texts of the
+    returned rows are read from SQLite.
+    Adding a chunk appends a row, and deleting or replacing one marks its row deleted. The arrays are compacted
+    once more than compact_ratio of the rows are deleted, into the arrays of a new generation (vectors.<n>.bin and
+    deleted.<n>.bin), so searches still reading the previous arrays are not disturbed (on Windows, a mapped file
+    can't be replaced).
+    The number of committed rows is stored with the chunks in the same transaction, so opening the store after an
+    interrupted write truncates the arrays back to the committed rows (see _recover).
+
+    For large corpora, an approximate nearest-neighbour index (see ann_index) can serve the searches instead of the
+    full matrix-vector product: it returns refine_factor * k candidate rows, which are re-scored exactly.
+    The ANN index is trained and updated with the rows added to the store in a background thread (see
+    start_ann_update), started when the store is opened and when rows are added; searches score the rows it misses
+    exactly. It is saved once it has save_every unsaved rows, and by persist.
+
+    Attributes:
+        persist_directory (str): The directory of the store.
+        dtype (str): The dtype of the stored embeddings, "float32" or "float16".
+        compact_ratio (float): The ratio of deleted rows above which the arrays are compacted.
+        ann_index_type (str): The type of the ANN index, one of ANN_INDEX_TYPES.
+        ann_params (dict): The parameters of the ANN index.
+        refine_factor (int): Number of ANN candidates per requested result.
+    """
+    def __init__(self, persist_directory, embedding_function, dtype="float32", compact_ratio=0.3,
+                 ann_index_type="none", ann_params=None, refine_factor=4, save_every=50_000):
+        if dtype not in FLAT_DTYPES:
+            raise ValueError(f"Unknown dtype: {dtype}. Expected one of {FLAT_DTYPES}")
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.compact_ratio = compact_ratio
+        self.ann_index_type = ann_index_type
+        self.ann_params = ann_params or {}
+        self.refine_factor = refine_factor
+        self.save_every = save_every
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(fr"{persist_directory}\{FLAT_INDEX_FILE}", check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);"
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, page_content TEXT NOT NULL, metadata TEXT);"
+            )
+        info = dict(self._conn.execute("SELECT key, value FROM info").fetchall())
+        self._generation = int(info.get("generation", 0))
+        self._vectors_path, self._deleted_path = self._array_paths(self._generation)
+        self.dtype = info.get("dtype", dtype)
+        self.dim = int(info["dim"]) if "dim" in info else None
+        self._rows = 0
+        self._vectors = None
+        self._deleted = None
+        self._ann = None
+        self._ann_unsaved = 0
+        # Searches read the ANN index concurrently; training and adding rows lock it exclusively
+        self._ann_lock = _ReadWriteLock()
+        # One ANN update at a time, see update_ann_index
+        self._ann_build_lock = threading.Lock()
+        self._ann_thread = None
+        self._ann_generation = 0
+        self._ann_checked_rows = 0
+        self._recover(info)
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding_function
+
+    def _num_rows(self):
+        return self._rows
+
+    def _array_paths(self, generation):
+        """
+        :return: tuple of (vectors path, tombstones path) of a generation of the arrays
+        """
+        suffix = f".{generation}" if generation else ""
+        return fr"{self.persist_directory}\vectors{suffix}.bin", fr"{self.persist_directory}\deleted{suffix}.bin"
+
+    def _remove_stale_arrays(self):
+        """
+        Remove the arrays of other generations: the previous arrays of a compaction, and the new arrays of a
+        compaction that was interrupted before it was committed. Arrays still mapped by a search (on Windows) are
+        removed later.
+        """
+        for generation in range(self._generation + 2):
+            if generation == self._generation:
+                continue
+            for path in self._array_paths(generation):
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def _file_rows(self, path, row_bytes):
+        return os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+
+    def _truncate_arrays(self, num_rows):
+        """
+        Cut the array files to num_rows rows, dropping rows written by an uncommitted add.
+        """
+        self._invalidate_arrays()
+        for path, row_bytes in ((self._vectors_path, self.dim * np.dtype(self.dtype).itemsize),
+                                (self._deleted_path, 1)):
+            if os.path.exists(path) and os.path.getsize(path) != num_rows * row_bytes:
+                os.truncate(path, num_rows * row_bytes)
+
+    def _recover(self, info):
+        """
+        Bring the arrays back in line with the committed chunks after an interrupted write.
+
+        The arrays of a compaction are used once its generation is committed with the new row numbers, so the
+        arrays of other generations are removed. Rows appended by an uncommitted add are truncated. If the arrays lost committed rows (e.g. a power loss
+        before they reached the disk), the chunks of the lost rows are dropped and the tombstones are rebuilt from
+        the chunks table. The ANN index is removed when the rows change, and rebuilt when it is next used.
+        """
+        self._remove_stale_arrays()
+        if self.dim is None:
+            return
+
+        vector_rows = self._file_rows(self._vectors_path, self.dim * np.dtype(self.dtype).itemsize)
+        deleted_rows = self._file_rows(self._deleted_path, 1)
+        # Stores written before the row count was recorded: the rows both arrays hold
+        self._rows = int(info["rows"]) if "rows" in info else min(vector_rows, deleted_rows)
+        if vector_rows == deleted_rows == self._rows:
+            return
+        print(f"Recovering the flat vector store {self.persist_directory}: {self._rows} committed rows, "
+              f"{vector_rows} vectors, {deleted_rows} tombstones")
+        with self._conn:
+            if vector_rows < self._rows:
+                self._conn.execute("DELETE FROM chunks WHERE row >= ?", (vector_rows,))
+                self._rows = vector_rows
+            self._conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('rows', ?)", (str(self._rows),))
+        rebuild_tombstones = deleted_rows < self._rows
+        self._truncate_arrays(self._rows)
+        if rebuild_tombstones:
+            deleted = np.ones(self._rows, dtype=np.bool_)
+            for (row,) in self._conn.execute("SELECT row FROM chunks"):
+                deleted[row] = False
+            with open(self._deleted_path, "wb") as f:
+                f.write(deleted.tobytes())
+        remove_ann_indexes(self.persist_directory)
+
+    def _open_arrays(self):
+        """
+        Map the arrays of the store (cached until the store changes).
+
+        :return: tuple of (vectors of shape (rows, dim), boolean tombstones of shape (rows,))
+        """
+        if self._vectors is None:
+            num_rows = self._num_rows()
+            if num_rows == 0:
+                self._vectors = np.empty((0, self.dim or 0), dtype=self.dtype)
+                self._deleted = np.empty(0, dtype=bool)
+            else:
+                self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(num_rows, self.dim))
+                self._deleted = np.memmap(self._deleted_path, dtype=np.bool_, mode="r", shape=(num_rows,))
+        return self._vectors, self._deleted
+
+    def _invalidate_arrays(self):
+        self._vectors = None
+        self._deleted = None
+
+    def start_ann_update(self):
+        """
+        Train the ANN index if needed and add the rows it misses (see update_ann_index) in a background thread,
+        unless an update is running or the index is up to date. Searches meanwhile score the rows the index misses
+        exactly.
+        """
+        if self.ann_index_type == "none":
+            return
+        with self._lock:
+            if self.dim is None or self._num_rows() <= self._ann_checked_rows:
+                return
+            if self._ann_thread is not None and self._ann_thread.is_alive():
+                return
+            self._ann_thread = threading.Thread(target=self._run_ann_update, daemon=True)
+            self._ann_thread.start()
+
+    def _run_ann_update(self):
+        try:
+            self.update_ann_index()
+        except Exception as e:
+            print(f"Failed to update the ANN index of {self.persist_directory}. Error: {str(e)}")
+
+    def update_ann_index(self):
+        """
+        Load the ANN index, train it if it is not trained yet (once the store has enough rows) and add the rows it
+        misses, saving it every save_every added rows.
+        The work is done outside the store's lock, so searches and writes go on meanwhile; the index is only locked
+        from searches while it is trained and while each batch of rows is added. A compaction cancels the update.
+
+        :return: whether the store has a trained ANN index
+        """
+        if self.ann_index_type == "none":
+            return False
+        with self._ann_build_lock:
+            with self._lock:
+                if self.dim is None:
+                    return False
+                generation = self._ann_generation
+                vectors, _ = self._open_arrays()
+                ann = self._ann
+            num_rows = len(vectors)
+            if ann is None:
+                ann = create_ann_index(self.ann_index_type, self.persist_directory, self.dim, self.ann_params)
+                with self._lock:
+                    if generation != self._ann_generation:
+                        return False
+                    self._ann = ann
+            if not ann.is_ready():
+                if num_rows < ann.train_size:
+                    self._ann_checked_rows = num_rows
+                    return False
+                sample = np.random.default_rng(0).choice(num_rows, size=min(num_rows, 20 * ann.train_size),
+                                                         replace=False)
+                sample_vectors = np.asarray(vectors[np.sort(sample)], dtype=np.float32)
+                with self._ann_lock.write():
+                    ann.train(sample_vectors)
+            for start in range(ann.num_indexed, num_rows, 1024):
+                rows = np.arange(start, min(start + 1024, num_rows))
+                batch = np.asarray(vectors[rows], dtype=np.float32)
+                if generation != self._ann_generation:
+                    return False
+                with self._ann_lock.write():
+                    ann.add(batch, rows)
+                self._ann_unsaved += len(rows)
+                if self._ann_unsaved >= self.save_every:
+                    self._save_ann_index()
+            self._ann_checked_rows = num_rows
+            return True
+
+    def _save_ann_index(self):
+        """
+        Save the ANN index if it has unsaved rows. Must be called while holding the ANN build lock.
+        """
+        if self._ann is not None and self._ann_unsaved:
+            with self._ann_lock.read():
+                self._ann.save()
+            self._ann_unsaved = 0
+
+    def persist(self):
+        """
+        Bring the ANN index up to date and save it.
+        The arrays and the chunks table are always persisted as they are written.
+        """
+        if self.update_ann_index():
+            with self._ann_build_lock:
+                self._save_ann_index()
+
+    def _mark_deleted(self, ids):
+        """
+        Delete the chunks of the given chunk IDs. Must be called while holding the lock, in the transaction of the
+        change. Their rows are marked deleted by _set_tombstones once the transaction is committed: a row of a
+        deleted chunk that is not marked yet (e.g. after a crash) is only skipped when its chunk is read.
+
+        :param ids: chunk IDs
+        :return: list of the rows of the deleted chunks
+        """
+        rows = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows += [row for (row,) in self._conn.execute(
+                f"SELECT row FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)]
+        self._conn.executemany("DELETE FROM chunks WHERE row = ?", ((row,) for row in rows))
+        return rows
+
+    def _set_tombstones(self, rows):
+        """
+        Mark rows deleted in the tombstone array. Must be called while holding the lock.
+        """
+        if not rows:
+            return
+        self._invalidate_arrays()
+        deleted = np.memmap(self._deleted_path, dtype=np.bool_, mode="r+", shape=(self._num_rows(),))
+        deleted[rows] = True
+        deleted.flush()
+        del deleted
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        if ids is None:
+            raise ValueError("FlatVectorStore requires chunk IDs")
+        if not texts:
+            return []
+        vectors = normalize_rows(self.embedding_function.embed_documents(texts)).astype(self.dtype)
+
+        with self._lock:
+            first_row = self._rows
+            try:
+                with self._conn:
+                    if self.dim is None:
+                        self.dim = vectors.shape[1]
+                        self._conn.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                                               [("dim", str(self.dim)), ("dtype", self.dtype)])
+                    elif vectors.shape[1] != self.dim:
+                        raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store's "
+                                         f"{self.dim}")
+                    replaced_rows = self._mark_deleted(list(ids))
+                    self._truncate_arrays(first_row)
+                    with open(self._deleted_path, "ab") as f:
+                        f.write(bytes(len(texts)))
+                    with open(self._vectors_path, "ab") as f:
+                        f.write(vectors.tobytes())
+                    self._conn.executemany(
+                        "INSERT INTO chunks (row, id, page_content, metadata) VALUES (?, ?, ?, ?)",
+                        ((first_row + i, doc_id, text, json.dumps(metadata or {}, default=str))
+                         for i, (doc_id, text, metadata) in enumerate(zip(ids, texts, metadatas))))
+                    self._conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('rows', ?)",
+                                       (str(first_row + len(texts)),))
+            except BaseException:
+                # The rows of a rolled back add are not kept
+                if self.dim is not None:
+                    self._truncate_arrays(first_row)
+                raise
+            self._rows = first_row + len(texts)
+            self._set_tombstones(replaced_rows)
+            self._invalidate_arrays()
+        self._maybe_compact()
+        self.start_ann_update()
+        return list(ids)
+
+    def add_documents(self, documents: List[Document], **kwargs: Any) -> List[str]:
+        return self.add_texts([doc.page_content for doc in documents], [doc.metadata for doc in documents],
+                              ids=kwargs.get("ids"))
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            with self._conn:
+                rows = self._mark_deleted(list(ids))
+            self._set_tombstones(rows)
+        self._maybe_compact()
+        return len(rows) > 0
+
+    def count(self):
+        """
+        :return: the number of chunks in the store
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _maybe_compact(self):
+        num_rows = self._num_rows()
+        if num_rows and (num_rows - self.count()) / num_rows > self.compact_ratio:
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the arrays without the deleted rows, and renumber the rows of the chunks.
+        The new arrays are written as the next generation of the arrays, which is committed with the new row numbers.
+        The previous arrays are not replaced in place, so searches still reading them (and the vectors they returned,
+        e.g. to MMR) stay valid; they are removed once unmapped, or when the store is opened again.
+        """
+        with self._lock:
+            # Cancel a running ANN update, whose row numbers are about to change
+            self._ann_generation += 1
+        with self._ann_build_lock, self._lock:
+            vectors, deleted = self._open_arrays()
+            # The rows of the chunks table, which also drops the rows of deleted chunks whose tombstone was not set
+            keep = np.fromiter((row for (row,) in self._conn.execute("SELECT row FROM chunks ORDER BY row")),
+                               dtype=np.int64)
+            generation = self._generation + 1
+            new_vectors_path, new_deleted_path = self._array_paths(generation)
+            with open(new_vectors_path, "wb") as f:
+                for start in range(0, len(keep), 65536):
+                    f.write(np.ascontiguousarray(vectors[keep[start:start + 65536]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(new_deleted_path, "wb") as f:
+                f.write(bytes(len(keep)))
+                f.flush()
+                os.fsync(f.fileno())
+            with self._conn:
+                # Rows only move down, so renumbering in increasing order never collides
+                self._conn.executemany("UPDATE chunks SET row = ? WHERE row = ?",
+                                       ((new_row, int(old_row)) for new_row, old_row in enumerate(keep)
+                                        if new_row != old_row))
+                self._conn.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                                       [("rows", str(len(keep))), ("generation", str(generation))])
+            self._invalidate_arrays()
+            vectors = deleted = None
+            self._generation = generation
+            self._vectors_path, self._deleted_path = new_vectors_path, new_deleted_path
+            self._rows = len(keep)
+            self._remove_stale_arrays()
+            # The ANN index labels are row numbers, so it is rebuilt
+            self._ann = None
+            self._ann_unsaved = 0
+            self._ann_checked_rows = 0
+            remove_ann_indexes(self.persist_directory)
+
+    def _get_rows(self, rows):
+        """
+        Read the chunks of the given rows.
+
+        :param rows: row numbers
+        :return: list of documents, in the order of rows
+        """
+        rows = [int(row) for row in rows]
+        if not rows:
+            return []
+        with self._lock:
+            found = {row: (page_content, metadata) for row, page_content, metadata in self._conn.execute(
+                f"SELECT row, page_content, metadata FROM chunks WHERE row IN ({','.join('?' * len(rows))})", rows)}
+        return [Document(page_content=found[row][0], metadata=json.loads(found[row][1] or "{}"))
+                for row in rows if row in found]
+
+    def _search(self, embedding, k, exact=False):
+        """
+        Find the rows most similar to an embedding.
+
+        :param exact: whether to score all the rows, even if the store has an ANN index
+        :return: tuple of (rows, cosine similarities, mapped vectors), best first
+        """
+        query_vector = normalize_rows(embedding)
+        with self._lock:
+            vectors, deleted = self._open_arrays()
+            ann_index = None if exact else self._ann
+            if ann_index is not None and not ann_index.is_ready():
+                ann_index = None
+        if len(vectors) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), vectors
+        if not exact:
+            # The index is trained and caught up in the background, never by a query
+            self.start_ann_update()
+        if ann_index is not None:
+            with self._ann_lock.read():
+                num_indexed = ann_index.num_indexed
+                candidates = ann_index.search(query_vector, self.refine_factor * k)
+            # Exact re-scoring of the approximate candidates, and exact scoring of the rows the index misses
+            candidates = np.unique(np.concatenate([candidates, np.arange(num_indexed, len(vectors))]))
+            candidates = candidates[(candidates < len(vectors))]
+            candidates = candidates[~np.asarray(deleted[candidates], dtype=bool)]
+            scores = np.asarray(vectors[candidates], dtype=np.float32) @ query_vector
+            order = top_k(scores, k)
+            if len(order) == k or len(order) == len(vectors) - int(np.count_nonzero(deleted)):
+                return candidates[order], scores[order], vectors
+            # Too many candidates were deleted rows: fall back to exact search
+        if vectors.dtype == np.float32:
+            scores = vectors @ query_vector
+        else:
+            # NumPy has no BLAS kernel for float16, so float16 rows are scored in float32 blocks
+            scores = np.concatenate([np.asarray(vectors[start:start + 65536], dtype=np.float32) @ query_vector
+                                     for start in range(0, len(vectors), 65536)])
+        scores[np.asarray(deleted)] = -np.inf
+        rows = top_k(scores, k)
+        return rows, scores[rows], vectors
+
+    def search_rows(self, embedding, k=4, exact=False):
+        """
+        Find the rows most similar to an embedding, without reading their documents.
+
+        :param embedding: the query embedding
+        :param k: number of rows to return
+        :param exact: whether to score all the rows, even if the store has an ANN index
+        :return: tuple of (rows, cosine similarities), best first
+        """
+        rows, scores, _ = self._search(embedding, k, exact=exact)
+        return rows, scores
+
+    def sample_vectors(self, num_vectors, seed=0):
+        """
+        Return the embeddings of randomly sampled rows that are not deleted, e.g. to use them as test queries.
+
+        :param num_vectors: number of embeddings to return (fewer if the store has fewer rows)
+        :param seed: seed of the random sample
+        :return: float32 array of shape (num_vectors, dim)
+        """
+        with self._lock:
+            vectors, deleted = self._open_arrays()
+        rows = np.flatnonzero(~np.asarray(deleted, dtype=bool))
+        rows = np.sort(np.random.default_rng(seed).choice(rows, size=min(num_vectors, len(rows)), replace=False))
+        return np.asarray(vectors[rows], dtype=np.float32)
+
+    def set_ann_search_param(self, value):
+        """
+        Set the recall/latency knob of the ANN index: ef_search for HNSW, nprobe for IVF-PQ.
+
+        :param value: the new value of the knob
+        :return: whether the store has a trained ANN index
+        """
+        with self._lock:
+            ann_index = self._ann
+        if ann_index is None or not ann_index.is_ready():
+            return False
+        with self._ann_lock.write():
+            ann_index.set_search_param(value)
+        return True
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        rows, scores, _ = self._search(embedding, k)
+        return list(zip(self._get_rows(rows), scores.tolist()))
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        return lambda similarity: (1 + similarity) / 2
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        rows, _, vectors = self._search(embedding, max(k, fetch_k))
+        rows = np.sort(rows)  # sequential reads of the mapped array
+        candidate_vectors = np.asarray(vectors[rows], dtype=np.float32)
+        selected = maximal_marginal_relevance(normalize_rows(embedding), candidate_vectors, k=k,
+                                              lambda_mult=lambda_mult)
+        return self._get_rows(rows[selected])
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(self.embedding_function.embed_query(query), k=k,
+                                                            fetch_k=fetch_k, lambda_mult=lambda_mult)
+
+    def get(self, ids=None, limit=None, offset=0, include=("documents", "metadatas")):
+        """
+        Read chunks from the store, in the format of Chroma's get.
+
+        :param ids: IDs of the chunks to read. If None, the chunks are read in row order.
+        :param limit: maximal number of chunks to read
+        :param offset: number of chunks to skip
+        :param include: fields to return, among "documents", "metadatas" and "embeddings"
+        :return: dictionary with the "ids" and the included fields
+        """
+        with self._lock:
+            if ids is not None:
+                ids = list(ids)
+                rows = []
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    rows += self._conn.execute(
+                        f"SELECT row, id, page_content, metadata FROM chunks "
+                        f"WHERE id IN ({','.join('?' * len(batch))}) ORDER BY row", batch).fetchall()
+            else:
+                rows = self._conn.execute("SELECT row, id, page_content, metadata FROM chunks ORDER BY row "
+                                          "LIMIT ? OFFSET ?", (-1 if limit is None else limit, offset)).fetchall()
+            vectors, _ = self._open_arrays() if "embeddings" in include else (None, None)
+        result = {"ids": [row[1] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [row[2] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row[3] or "{}") for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(vectors[[row[0] for row in rows]], dtype=np.float32)
+        return result
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = None,
+                   **kwargs: Any) -> "FlatVectorStore":
+        vector_store = cls(persist_directory, embedding, **kwargs)
+        vector_store.add_texts(texts, metadatas, ids=ids)
+        return vector_store
+
+    def close(self):
+        """
+        Close the underlying database connection and unmap the arrays.
+        """
+        with self._lock:
+            # Cancel a running ANN update
+            self._ann_generation += 1
+            self._invalidate_arrays()
+            self._conn.close()
+            self._remove_stale_arrays()
@@ -0,0 +1,59 @@
+from langchain_core.embeddings import Embeddings
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Embeddings computed on the local CPU with a sentence-transformers model.
+
+    Requires the optional sentence-transformers dependency. Texts are embedded in batches, the number of
+    threads used by torch can be limited, and the model's linear layers can be dynamically quantized to int8
+    for faster inference.
+
+    Attributes:
+        model_name (str): The name (or path) of the sentence-transformers model.
+        batch_size (int): The number of texts embedded per forward pass.
+        quantize (bool): Whether the model is quantized to int8.
+    """
+    def __init__(self, model_name, batch_size=64, num_threads=0, quantize=False):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("The local embedding backend requires sentence-transformers. "
+                              "Install it with: pip install sentence-transformers") from e
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.quantize = quantize
+
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.model.eval()
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    def _encode(self, texts):
+        embeddings = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                       convert_to_numpy=True, show_progress_bar=False)
+        return embeddings.tolist()
+
+    def embed_documents(self, texts):
+        """
+        Embed a list of documents.
+
+        :param texts: list of texts to embed
+        :return: list of embeddings, in the order of the texts
+        """
+        if not texts:
+            return []
+        return self._encode(list(texts))
+
+    def embed_query(self, text):
+        """
+        Embed a query text.
+
+        :param text: the query text
+        :return: the embedding of the query
+        """
+        return self._encode([text])[0]
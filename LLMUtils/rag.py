@@ -1,25 +1,28 @@
 from langchain.chains.summarize import load_summarize_chain
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationBufferMemory, ConversationSummaryBufferMemory
 from langchain.memory.chat_message_histories import ChatMessageHistory
 from langchain.docstore.document import Document
-from langchain.chains import ConversationalRetrievalChain, RetrievalQA
+from langchain.chains import ConversationalRetrievalChain, RetrievalQA, LLMChain
 from langchain.prompts import PromptTemplate
 from langchain.schema import messages_to_dict, messages_from_dict
 import json
 
+from LLMUtils.clients import get_chat_model
+from LLMUtils.condense import CondensingRetrievalChain, CONDENSE_MODES, find_query_embedder
 from config import settings
 
 
-def get_llm(model_name=settings.LLM_MODEL, temp=settings.LLM_TEMP):
+def get_llm(model_name=settings.LLM_MODEL, temp=settings.LLM_TEMP, streaming=False):
     """
-    Initialize OpenAI Chat LLM model
+    Get the shared OpenAI Chat LLM model of the given settings (see clients.get_chat_model), so all the calls reuse
+    the same model and HTTP connections
 
     :param model_name: model name
     :param temp: temperature
+    :param streaming: whether the LLM streams its tokens to the callbacks as they are generated
     :return: llm
     """
-    llm = ChatOpenAI(model_name=model_name, temperature=temp)
+    llm = get_chat_model(model_name, temp, streaming=streaming)
     return llm
 
 
@@ -38,38 +41,111 @@ def summarize(text):
     return summary
 
 
-def conversation_chain(retriever, llm=None, memory_load_path=None):
+DESCRIPTION_PROMPT = PromptTemplate(
+    input_variables=["description", "new_lines"],
+    template="""Update the one-line description of a conversation with its new lines. The description is a title of
+at most 15 words naming the main topics of the conversation, not a summary of what was said.
+Answer with the description only.
+
+Current description:
+{description}
+
+New lines of the conversation:
+{new_lines}
+
+New description:""",
+)
+
+
+def summarize_incremental(previous_description, new_text, max_chars=settings.DESCRIPTION_MAX_CHARS):
+    """
+    Update the one-line description of a conversation with its new lines, without re-reading what was already
+    described. The description stays bounded: a short title, truncated to max_chars.
+
+    :param previous_description: the current description. Empty if nothing was described yet.
+    :param new_text: the new lines of the conversation
+    :param max_chars: the maximal length of the description
+    :return: the new description
+    """
+    sum_chain = LLMChain(llm=get_llm(), prompt=DESCRIPTION_PROMPT)
+    description = " ".join(sum_chain.predict(description=previous_description, new_lines=new_text).split())
+    description = description.strip("\"'")
+    if len(description) > max_chars:
+        description = description[:max_chars - 3].rstrip() + "..."
+    return description
+
+
+MEMORY_MODES = ("buffer", "summary_buffer")
+
+
+def get_memory(messages=None, summary="", mode=settings.MEMORY_MODE, max_tokens=settings.MEMORY_MAX_TOKENS):
+    """
+    Create the memory of a conversational retrieval chain.
+
+    In "buffer" mode the memory keeps the entire conversation history.
+    In "summary_buffer" mode the memory keeps the most recent messages that fit in max_tokens (counted with
+    tiktoken), and older messages are folded into a rolling summary, so the prompts stay bounded however long the
+    conversation gets.
+
+    :param messages: messages to load into the memory
+    :param summary: rolling summary of the messages older than the given messages ("summary_buffer" mode only)
+    :param mode: memory mode, one of MEMORY_MODES. Defaults to settings.MEMORY_MODE.
+    :param max_tokens: token budget of the messages kept verbatim. Defaults to settings.MEMORY_MAX_TOKENS.
+    :return: memory
+    """
+    if mode not in MEMORY_MODES:
+        raise ValueError(f"Unknown memory mode: {mode}. Expected one of {MEMORY_MODES}")
+    memory_kwargs = dict(memory_key="chat_history", input_key="question", output_key="answer", return_messages=True)
+    if messages is not None:
+        memory_kwargs["chat_memory"] = ChatMessageHistory(messages=messages)
+
+    if mode == "buffer":
+        return ConversationBufferMemory(**memory_kwargs)
+
+    memory = ConversationSummaryBufferMemory(llm=get_llm(), max_token_limit=max_tokens,
+                                             moving_summary_buffer=summary or "", **memory_kwargs)
+    # Loaded messages may exceed the budget (e.g. after the budget was lowered)
+    memory.prune()
+    return memory
+
+
+def conversation_chain(retriever, llm=None, memory_load_path=None, messages=None, summary="",
+                       streaming=settings.STREAM_ANSWERS, condense_mode=settings.CONDENSE_MODE):
     """
     Create a conversational retrieval chain using the given LLM and retriever.
-    Conversational Retrieval Chain uses memory to keep track of the conversation history.
+    Conversational Retrieval Chain uses memory to keep track of the conversation history (see get_memory).
 
-    :param llm: LLM. Defaults to get_llm()
+    The question is condensed with a separate non-streaming LLM (settings.CONDENSE_LLM_MODEL), so when streaming is
+    enabled only the tokens of the answer are streamed (see LLMUtils.streaming.stream_chain). The condensing call is
+    skipped for standalone questions, or run in parallel with the retrieval, depending on condense_mode
+    (see CondensingRetrievalChain).
+
+    :param llm: LLM answering the question. Defaults to get_llm(streaming=streaming)
     :param retriever: retriever to use
+    :param memory_load_path: path of a legacy memory.json to load the history from
+    :param messages: messages to load into the memory
+    :param summary: rolling summary of the messages older than the given messages
+    :param streaming: whether the answer LLM streams its tokens (default: settings.STREAM_ANSWERS)
+    :param condense_mode: when to condense the question, one of CONDENSE_MODES (default: settings.CONDENSE_MODE)
     :return: conversational retrieval chain
     """
     if llm is None:
-        llm = get_llm()
+        llm = get_llm(streaming=streaming)
     if memory_load_path is not None:
         messages = load_messages_from_file(memory_load_path)
-        chat_history = ChatMessageHistory(messages=messages)
-
-        memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True,
-            chat_memory=chat_history
-        )
-    else:
-        memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
-
-    conv_retrieval_chain = ConversationalRetrievalChain.from_llm(
+    memory = get_memory(messages, summary)
+    if condense_mode not in CONDENSE_MODES:
+        raise ValueError(f"Unknown condense mode: {condense_mode}. Expected one of {CONDENSE_MODES}")
+
+    conv_retrieval_chain = CondensingRetrievalChain.from_llm(
         llm,
         retriever=retriever,
         memory=memory,
-        # return_source_documents=True,
-        # return_generated_question=True,
+        condense_question_llm=get_llm(model_name=settings.CONDENSE_LLM_MODEL),
+        condense_mode=condense_mode,
+        question_embedder=find_query_embedder(retriever),
+        return_source_documents=True,
+        return_generated_question=True,
     )
     return conv_retrieval_chain
 
@@ -0,0 +1,130 @@
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from LLMUtils.vector_math import normalize_rows, maximal_marginal_relevance
+
+QUERY_SEARCH_TYPES = ("similarity", "mmr")
+MMR_SEARCH_KWARGS = ("fetch_k", "lambda_mult")
+
+
+def mmr_search_by_vector(vector_store, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+    """
+    Search a vector store by maximal marginal relevance.
+
+    For Chroma, the fetch_k candidates are queried with their stored embeddings (the documents are not re-embedded),
+    and the MMR selection is computed with one similarity matrix product (see vector_math), instead of the
+    per-step similarity computations of LangChain's implementation. Other vector stores use their own MMR search.
+
+    :param vector_store: the vector store to search
+    :param embedding: the query embedding
+    :param k: number of documents to return
+    :param fetch_k: number of candidates to select from. At least k candidates are fetched.
+    :param lambda_mult: trade-off between relevance (1) and diversity (0)
+    :param kwargs: other arguments of the search, e.g. filter
+    :return: list of documents, in selection order
+    """
+    collection = getattr(vector_store, "_collection", None)
+    if collection is None:
+        return vector_store.max_marginal_relevance_search_by_vector(embedding, k=k, fetch_k=fetch_k,
+                                                                    lambda_mult=lambda_mult, **kwargs)
+    results = collection.query(query_embeddings=[embedding], n_results=max(k, fetch_k), where=kwargs.get("filter"),
+                               include=["documents", "metadatas", "embeddings"])
+    if not results["ids"] or not results["ids"][0]:
+        return []
+    candidate_vectors = normalize_rows(np.asarray(results["embeddings"][0], dtype=np.float32))
+    selected = maximal_marginal_relevance(normalize_rows(embedding), candidate_vectors, k=k, lambda_mult=lambda_mult)
+    documents, metadatas = results["documents"][0], results["metadatas"][0]
+    return [Document(page_content=documents[i], metadata=metadatas[i] or {}) for i in selected]
+
+
+class VectorStoreQueryRetriever(BaseRetriever):
+    """
+    Retriever that embeds the query itself and searches the vector store by vector.
+
+    Embedding the query outside the vector store lets the query embedding go through the query embedding cache,
+    so repeated questions skip the embedding round-trip.
+
+    Attributes:
+        vector_store: The vector store to search. Must support similarity_search_by_vector and
+            max_marginal_relevance_search_by_vector.
+        query_embedder: The embeddings used to embed the query.
+        search_type (str): "similarity" or "mmr".
+        search_kwargs (dict): Keyword arguments of the search (e.g. k, fetch_k, lambda_mult).
+            They can be overridden per query by passing them to invoke. fetch_k and lambda_mult only apply to MMR.
+    """
+    vector_store: Any
+    query_embedder: Any
+    search_type: str = "similarity"
+    search_kwargs: Dict[str, Any] = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        search_kwargs = {**self.search_kwargs, **kwargs}
+        embedding = self.query_embedder.embed_query(query)
+        if self.search_type == "similarity":
+            search_kwargs = {key: value for key, value in search_kwargs.items() if key not in MMR_SEARCH_KWARGS}
+            return self.vector_store.similarity_search_by_vector(embedding, **search_kwargs)
+        elif self.search_type == "mmr":
+            return mmr_search_by_vector(self.vector_store, embedding, **search_kwargs)
+        raise ValueError(f"Invalid search type: {self.search_type}")
+
+
+def reciprocal_rank_fusion(ranked_lists, weights, rrf_k=60):
+    """
+    Fuse ranked lists of documents with weighted reciprocal rank fusion.
+    A document's score is the sum over the lists of weight / (rrf_k + rank). Documents are identified by their
+    source and content, so the same chunk returned by different searches is fused.
+
+    :param ranked_lists: lists of documents, best first
+    :param weights: weight of each list
+    :param rrf_k: rank offset, dampening the advantage of the top ranks
+    :return: list of documents, best first
+    """
+    scores, docs = {}, {}
+    for ranked_docs, weight in zip(ranked_lists, weights):
+        for rank, doc in enumerate(ranked_docs, 1):
+            key = (str(doc.metadata.get("source", "")), doc.page_content)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever that fuses a dense (vector) retriever with a sparse BM25 index using reciprocal rank fusion,
+    so exact identifiers, part numbers and rare terms are found even when their embeddings are not close.
+
+    Attributes:
+        dense_retriever: The vector store retriever.
+        sparse_index: The BM25 index of the same chunks (see SparseIndex).
+        dense_weight (float): Weight of the dense ranking in [0, 1]. The sparse ranking is weighted 1 - dense_weight.
+        k (int): Number of documents returned.
+        candidates (int): Number of documents retrieved by each search before fusion.
+        mmr_fetch_factor (int): If the dense retriever searches by MMR, it selects the candidates from at least
+            mmr_fetch_factor times as many documents (otherwise MMR would select all the documents it fetches).
+        rrf_k (int): Rank offset of the reciprocal rank fusion.
+    """
+    dense_retriever: Any
+    sparse_index: Any
+    dense_weight: float = 0.5
+    k: int = 4
+    candidates: int = 20
+    mmr_fetch_factor: int = 4
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Any) -> List[Document]:
+        k = kwargs.pop("k", self.k)
+        dense_k = max(k, self.candidates)
+        if getattr(self.dense_retriever, "search_type", None) == "mmr":
+            fetch_k = kwargs.get("fetch_k", self.dense_retriever.search_kwargs.get("fetch_k", 0))
+            kwargs["fetch_k"] = max(fetch_k, self.mmr_fetch_factor * dense_k)
+        dense_docs = self.dense_retriever.invoke(query, k=dense_k, **kwargs)
+        sparse_docs = [doc for _, doc, _ in self.sparse_index.search(query, k=max(k, self.candidates))]
+        fused = reciprocal_rank_fusion([dense_docs, sparse_docs], [self.dense_weight, 1 - self.dense_weight],
+                                       rrf_k=self.rrf_k)
+        return fused[:k]
@@ -0,0 +1,208 @@
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+
+from langchain_core.documents import Document
+
+# Words as the unicode61 tokenizer of the index splits them: runs of letters and digits (underscores separate)
+_TERM_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+# Function words of questions, which match most chunks and carry no signal for BM25
+STOPWORDS = frozenset({
+    "a", "about", "after", "all", "also", "am", "an", "and", "any", "are", "as", "at", "be", "been", "before",
+    "being", "between", "both", "but", "by", "can", "could", "did", "do", "does", "doing", "during", "each", "few",
+    "for", "from", "had", "has", "have", "having", "he", "her", "here", "him", "his", "how", "i", "if", "in",
+    "into", "is", "it", "its", "me", "more", "most", "my", "no", "nor", "not", "of", "off", "on", "once", "only",
+    "or", "other", "our", "out", "over", "own", "same", "she", "should", "so", "some", "such", "than", "that",
+    "the", "their", "them", "then", "there", "these", "they", "this", "those", "through", "to", "too", "under",
+    "until", "up", "very", "was", "we", "were", "what", "when", "where", "which", "while", "who", "whom", "why",
+    "will", "with", "would", "you", "your",
+})
+
+
+def fold_word(word):
+    """
+    Fold a word the way the index's tokenizer (unicode61 remove_diacritics 2) does, so it can be looked up in the
+    vocabulary of the index: lowercase, without diacritics ("Café" -> "cafe").
+
+    :param word: the word to fold
+    :return: the folded word
+    """
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def query_terms(query):
+    """
+    Split a free-text query into its terms, without stopwords.
+    A term that is split by the tokenizer (e.g. "AB-1234") is kept as one phrase of words.
+
+    :param query: the free-text query
+    :return: list of unique terms, each a tuple of folded words (see fold_word)
+    """
+    terms = []
+    for raw_term in query.split():
+        words = tuple(filter(None, (fold_word(word) for word in _TERM_PATTERN.findall(raw_term))))
+        if words and not (len(words) == 1 and words[0] in STOPWORDS):
+            terms.append(words)
+    return list(dict.fromkeys(terms))
+
+
+def fts_query(terms):
+    """
+    Build a full-text query matching any of the given terms.
+    Terms are quoted, so identifiers and part numbers are matched literally instead of being parsed as
+    query syntax, and a term of several words is matched as a phrase.
+
+    :param terms: list of terms, each a tuple of words (see query_terms)
+    :return: the full-text query, or None if there are no terms
+    """
+    return " OR ".join('"' + " ".join(words) + '"' for words in terms) if terms else None
+
+
+class SparseIndex:
+    """
+    Persistent BM25 inverted index of the chunks of a vector store, backed by SQLite FTS5.
+
+    The index is stored next to the vector store and is updated with the same chunk IDs, so it can be updated
+    incrementally and copied along with the vector store. Queries are answered from the inverted index with FTS5's
+    built-in BM25 ranking, so their cost grows with the number of chunks matching the query terms. To keep that
+    number small, stopwords and terms found in more than max_doc_ratio of the chunks (looked up in the fts5vocab
+    table of the index) are dropped from the queries, keeping at most max_terms of the rarest terms.
+    Searches run on pooled read connections, one per concurrent search, so concurrent searches are not serialized;
+    writes go through one connection.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+        max_doc_ratio (float): Terms found in more than this ratio of the chunks are not searched, unless all the
+            terms are; then only the rarest one is searched.
+        max_terms (int): Maximal number of terms searched.
+    """
+    def __init__(self, path, max_doc_ratio=0.1, max_terms=16):
+        self.path = path
+        self.max_doc_ratio = max_doc_ratio
+        self.max_terms = max_terms
+
+        self._lock = threading.Lock()
+        self._read_conns = []
+        # Default (rollback) journal, so the index file is self-contained when the vector store directory is copied
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, page_content TEXT NOT NULL, metadata TEXT);"
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5("
+                "page_content, content='chunks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2');"
+                "CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN "
+                "INSERT INTO chunks_fts (rowid, page_content) VALUES (new.rowid, new.page_content); END;"
+                "CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN "
+                "INSERT INTO chunks_fts (chunks_fts, rowid, page_content) "
+                "VALUES ('delete', old.rowid, old.page_content); END;"
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_vocab USING fts5vocab(chunks_fts, row);"
+            )
+        self._num_docs = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add_documents(self, docs, ids):
+        """
+        Add documents to the index. Documents with existing IDs are replaced.
+
+        :param docs: list of documents
+        :param ids: IDs of the documents, the same as their IDs in the vector store
+        """
+        with self._lock:
+            with self._conn:
+                removed = self._conn.executemany("DELETE FROM chunks WHERE id = ?",
+                                                 ((doc_id,) for doc_id in ids)).rowcount
+                added = self._conn.executemany(
+                    "INSERT INTO chunks (id, page_content, metadata) VALUES (?, ?, ?)",
+                    ((doc_id, doc.page_content, json.dumps(doc.metadata, default=str))
+                     for doc, doc_id in zip(docs, ids))).rowcount
+            self._num_docs += added - removed
+
+    def delete(self, ids):
+        """
+        Delete documents from the index.
+
+        :param ids: IDs of the documents to delete
+        """
+        with self._lock:
+            with self._conn:
+                removed = self._conn.executemany("DELETE FROM chunks WHERE id = ?", ((doc_id,) for doc_id in ids))
+            self._num_docs -= removed.rowcount
+
+    def count(self):
+        """
+        :return: the number of indexed documents
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _acquire_read_conn(self):
+        """
+        :return: an idle read connection, or a new one if they are all in use
+        """
+        with self._lock:
+            if self._read_conns:
+                return self._read_conns.pop()
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def _release_read_conn(self, conn):
+        with self._lock:
+            self._read_conns.append(conn)
+
+    def _select_terms(self, conn, terms):
+        """
+        Keep the rarest terms of a query, dropping the terms found in more than max_doc_ratio of the chunks.
+        The document frequency of a phrase is estimated by the frequency of its rarest word.
+
+        :param conn: the connection to read the vocabulary with
+        :param terms: list of terms, each a tuple of words
+        :return: list of the selected terms
+        """
+        words = list({word for words in terms for word in words})
+        doc_freqs = dict(conn.execute(
+            f"SELECT term, doc FROM chunks_vocab WHERE term IN ({','.join('?' * len(words))})", words).fetchall())
+        term_freqs = sorted((min(doc_freqs.get(word, 0) for word in words), words) for words in terms)
+        # Terms that no chunk contains can't match
+        term_freqs = [(doc_freq, words) for doc_freq, words in term_freqs if doc_freq > 0]
+        selected = [words for doc_freq, words in term_freqs if doc_freq <= self.max_doc_ratio * self._num_docs]
+        if not selected and term_freqs:
+            selected = [term_freqs[0][1]]
+        return selected[:self.max_terms]
+
+    def search(self, query, k=4):
+        """
+        Search the index with BM25 ranking.
+
+        :param query: the free-text query
+        :param k: number of documents to return
+        :return: list of (document ID, document, score) tuples, best first. Lower scores are better (FTS5 bm25).
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        conn = self._acquire_read_conn()
+        try:
+            match = fts_query(self._select_terms(conn, terms))
+            if match is None:
+                return []
+            rows = conn.execute(
+                "SELECT c.id, c.page_content, c.metadata, m.rank FROM "
+                "(SELECT rowid, rank FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?) AS m "
+                "JOIN chunks AS c ON c.rowid = m.rowid ORDER BY m.rank",
+                (match, k)).fetchall()
+        finally:
+            self._release_read_conn(conn)
+        return [(doc_id, Document(page_content=page_content, metadata=json.loads(metadata or "{}")), score)
+                for doc_id, page_content, metadata, score in rows]
+
+    def close(self):
+        """
+        Close the underlying database connections.
+        """
+        with self._lock:
+            for conn in self._read_conns:
+                conn.close()
+            self._read_conns.clear()
+            self._conn.close()
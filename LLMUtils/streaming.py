@@ -0,0 +1,65 @@
+import queue
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+_STREAM_END = object()
+
+
+class _TokenQueueHandler(BaseCallbackHandler):
+    """
+    Callback handler putting the tokens streamed by the LLMs of a chain into a queue.
+    Only LLMs created with streaming enabled emit tokens.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.tokens.put(token)
+
+
+def stream_chain(chain, inputs, output_key=None):
+    """
+    Run a chain in a background thread and yield the tokens of its streaming LLM as they arrive.
+
+    The chain's output is the return value of the generator, so a generator can stream the tokens and then use the
+    output with `response = yield from stream_chain(chain, inputs)`.
+    If the chain raises an exception, it is raised by the generator once the tokens streamed before it are yielded.
+    Each call starts one thread, joined when the generator ends, so callers bound the threads by bounding the
+    concurrent generators (e.g. the query server consumes them in its worker pool).
+
+    :param chain: the chain to run
+    :param inputs: the inputs of the chain
+    :param output_key: output yielded at once if the chain streamed no token (e.g. its LLM does not stream)
+    :return: generator of tokens, returning the chain's output
+    """
+    tokens = queue.Queue()
+    outcome = {}
+    streamed = False
+
+    def run():
+        try:
+            outcome["response"] = chain(inputs, callbacks=[_TokenQueueHandler(tokens)])
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            tokens.put(_STREAM_END)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            token = tokens.get()
+            if token is _STREAM_END:
+                break
+            streamed = True
+            yield token
+    finally:
+        # The chain saves the turn to its memory, so it always runs to completion
+        thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    if not streamed and output_key is not None:
+        yield outcome["response"][output_key]
+    return outcome["response"]
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+def normalize_rows(vectors):
+    """
+    Scale vectors to unit L2 norm, so dot products are cosine similarities. Zero vectors are left unchanged.
+
+    :param vectors: array of shape (n, dim) or (dim,)
+    :return: float32 array of the same shape
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def top_k(scores, k):
+    """
+    Return the indices of the k highest scores, best first, in O(n + k log k) with argpartition.
+
+    :param scores: 1-D array of scores. -inf scores are never returned.
+    :param k: number of indices to return
+    :return: array of indices
+    """
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    indices = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    indices = indices[np.isfinite(scores[indices])]
+    return indices[np.argsort(-scores[indices], kind="stable")]
+
+
+def maximal_marginal_relevance(query_vector, candidate_vectors, k=4, lambda_mult=0.5):
+    """
+    Select documents by maximal marginal relevance: each step picks the candidate maximizing
+    lambda_mult * similarity to the query - (1 - lambda_mult) * max similarity to the already selected candidates.
+
+    The candidate-candidate similarities are computed once as a single matrix product, and the running maximum
+    similarity to the selection is updated with one vector operation per step, so selecting k documents out of
+    n candidates costs O(n^2 * dim + k * n).
+
+    :param query_vector: unit-norm query vector of shape (dim,)
+    :param candidate_vectors: unit-norm candidate vectors of shape (n, dim)
+    :param k: number of candidates to select
+    :param lambda_mult: trade-off between relevance (1) and diversity (0)
+    :return: list of the indices of the selected candidates, in selection order
+    """
+    num_candidates = len(candidate_vectors)
+    if num_candidates == 0 or k <= 0:
+        return []
+    query_similarity = candidate_vectors @ query_vector
+    pairwise_similarity = candidate_vectors @ candidate_vectors.T
+
+    selected = [int(np.argmax(query_similarity))]
+    max_similarity_to_selected = pairwise_similarity[selected[0]].copy()
+    available = np.ones(num_candidates, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, num_candidates):
+        scores = lambda_mult * query_similarity - (1 - lambda_mult) * max_similarity_to_selected
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity_to_selected, pairwise_similarity[best], out=max_similarity_to_selected)
+    return selected
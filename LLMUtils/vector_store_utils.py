@@ -1,20 +1,110 @@
-from langchain_openai import OpenAIEmbeddings
+import hashlib
+import os
+import shutil
+
+from langchain_core.documents import Document
 
 from langchain_community.vectorstores import Chroma
+from LLMUtils.clients import get_openai_embeddings
 from LLMUtils.compression import get_compression_retriever
+from LLMUtils.embedding_cache import CachedEmbeddings, QueryCachedEmbeddings, get_embedding_cache, \
+    get_query_embedding_cache
+from LLMUtils.embedding_scheduler import AsyncBatchEmbeddings
+from LLMUtils.flat_vector_store import FlatVectorStore, FLAT_INDEX_FILE
+from LLMUtils.local_embeddings import LocalEmbeddings
+from LLMUtils.retrievers import VectorStoreQueryRetriever, HybridRetriever, QUERY_SEARCH_TYPES
+from LLMUtils.sparse_index import SparseIndex
 from config import settings
 
+VECTOR_BACKENDS = ("chroma", "flat")
+
+
+def get_embedding_model_name():
+    """
+    Get the name identifying the embedding model selected in the settings.
+    Vectors of different embedding models are not comparable, so the name is recorded with every vector store
+    and is part of the embedding cache key.
+
+    :return: the embedding model name
+    """
+    if settings.EMBEDDING_BACKEND == "local":
+        quantization = ":int8" if settings.LOCAL_EMBEDDING_QUANTIZE else ""
+        return f"local:{settings.LOCAL_EMBEDDING_MODEL}{quantization}"
+    return settings.EMBEDDING_MODEL
+
 
-def get_embedding_model():
+def get_embedding_model(use_cache=settings.EMBEDDING_CACHE):
     """
-    Get the embedding model for the vector store based on the settings
+    Get the embedding model for the vector store based on the settings.
+    settings.EMBEDDING_BACKEND selects between the OpenAI API ("openai") and a local CPU model ("local").
+    With the OpenAI backend, if settings.EMBEDDING_ASYNC is True, embedding requests are batched and sent
+    concurrently by the async embedding scheduler.
+    If use_cache is True, the model is wrapped with the persistent embedding cache stored under DATA_DIR,
+    so chunks that were already embedded by any version are not sent to the provider again.
 
+    :param use_cache: whether to consult the embedding cache (default: settings.EMBEDDING_CACHE)
     :return: the embedding model
     """
-    embedding_model = OpenAIEmbeddings(model=settings.EMBEDDING_MODEL)
+    if settings.EMBEDDING_BACKEND == "local":
+        embedding_model = _get_local_embedding_model()
+    elif settings.EMBEDDING_BACKEND == "openai":
+        if settings.EMBEDDING_ASYNC:
+            embedding_model = _get_async_embedding_model()
+        else:
+            embedding_model = get_openai_embeddings(settings.EMBEDDING_MODEL)
+    else:
+        raise ValueError(f"Invalid embedding backend: {settings.EMBEDDING_BACKEND}")
+    if use_cache:
+        cache = get_embedding_cache(fr"{settings.DATA_DIR}\embedding_cache.sqlite",
+                                    max_bytes=settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+        embedding_model = CachedEmbeddings(embedding_model, model_name=get_embedding_model_name(), cache=cache)
     return embedding_model
 
 
+_local_embedding_model = None
+
+
+def _get_local_embedding_model():
+    """
+    Return the process-wide local embedding model, so the model is loaded only once.
+
+    :return: LocalEmbeddings
+    """
+    global _local_embedding_model
+    if _local_embedding_model is None:
+        _local_embedding_model = LocalEmbeddings(
+            model_name=settings.LOCAL_EMBEDDING_MODEL,
+            batch_size=settings.LOCAL_EMBEDDING_BATCH_SIZE,
+            num_threads=settings.LOCAL_EMBEDDING_THREADS,
+            quantize=settings.LOCAL_EMBEDDING_QUANTIZE,
+        )
+    return _local_embedding_model
+
+
+_async_embedding_model = None
+
+
+def _get_async_embedding_model():
+    """
+    Return the process-wide async embedding scheduler, so all vector stores share its connection pool
+    and its rate-limit state.
+
+    :return: AsyncBatchEmbeddings
+    """
+    global _async_embedding_model
+    if _async_embedding_model is None:
+        _async_embedding_model = AsyncBatchEmbeddings(
+            model=settings.EMBEDDING_MODEL,
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.EMBEDDING_BASE_URL,
+            max_concurrency=settings.EMBEDDING_MAX_CONCURRENCY,
+            max_batch_tokens=settings.EMBEDDING_BATCH_MAX_TOKENS,
+            max_batch_inputs=settings.EMBEDDING_BATCH_MAX_INPUTS,
+            max_retries=settings.EMBEDDING_MAX_RETRIES,
+        )
+    return _async_embedding_model
+
+
 def load_vector_store(path):
     """
     Load vector store from disk
@@ -23,66 +113,366 @@ def load_vector_store(path):
     """
     embedding_model = get_embedding_model()
 
+    if get_vector_backend(path) == "flat":
+        vector_store = FlatVectorStore(path, embedding_function=embedding_model, **get_flat_store_kwargs())
+        # Train the ANN index or catch up with the rows it misses before the queries need it
+        vector_store.start_ann_update()
+        return vector_store
+    if not os.path.exists(fr"{path}\chroma.sqlite3"):
+        # HNSW parameters can only be set when the collection is created
+        return Chroma(persist_directory=path, embedding_function=embedding_model,
+                      collection_metadata=get_chroma_hnsw_metadata())
     vector_store = Chroma(persist_directory=path, embedding_function=embedding_model)
     return vector_store
 
 
-def update_vector_store(vector_store, new_docs):
+def get_flat_store_kwargs():
+    """
+    Return the FlatVectorStore arguments selected by the settings: the dtype and the ANN index.
+
+    :return: dictionary of keyword arguments
+    """
+    if settings.ANN_INDEX == "hnsw":
+        ann_params = dict(M=settings.HNSW_M, ef_construction=settings.HNSW_EF_CONSTRUCTION,
+                          ef_search=settings.HNSW_EF_SEARCH)
+    elif settings.ANN_INDEX == "ivfpq":
+        ann_params = dict(nlist=settings.IVF_NLIST, pq_m=settings.IVF_PQ_M, pq_nbits=settings.IVF_PQ_NBITS,
+                          nprobe=settings.IVF_NPROBE)
+    else:
+        ann_params = {}
+    return dict(dtype=settings.FLAT_INDEX_DTYPE, ann_index_type=settings.ANN_INDEX, ann_params=ann_params,
+                refine_factor=settings.ANN_REFINE_FACTOR)
+
+
+def get_chroma_hnsw_metadata():
+    """
+    Return the collection metadata setting the HNSW parameters of a new Chroma collection.
+
+    :return: dictionary of collection metadata
+    """
+    return {"hnsw:M": settings.HNSW_M, "hnsw:construction_ef": settings.HNSW_EF_CONSTRUCTION,
+            "hnsw:search_ef": settings.HNSW_EF_SEARCH}
+
+
+def close_vector_store(vector_store):
+    """
+    Release the files and the memory held by a loaded vector store. The vector store can't be used afterwards.
+
+    Chroma keeps one system (SQLite connection and HNSW segments) per persist directory in a process-wide cache,
+    so the system of the vector store is stopped and removed from the cache.
+
+    :param vector_store: Chroma or FlatVectorStore
+    """
+    if isinstance(vector_store, FlatVectorStore):
+        vector_store.close()
+        return
+    client = getattr(vector_store, "_client", None)
+    try:
+        from chromadb.api.client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(client._identifier, None)
+    except (ImportError, AttributeError):
+        return  # chromadb versions without a shared system cache release their files when garbage collected
+    if system is not None:
+        system.stop()
+
+
+def get_vector_store_size(vector_store_path):
+    """
+    Return the size of the files of a vector store, an estimate of the memory it takes once loaded and searched
+    (Chroma loads its HNSW index into memory, and the arrays of a flat vector store are mapped into memory).
+
+    :param vector_store_path: path to the vector store directory
+    :return: the size in bytes
+    """
+    size = 0
+    for dir_path, _, file_names in os.walk(vector_store_path):
+        for file_name in file_names:
+            try:
+                size += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                continue
+    return size
+
+
+def persist_vector_store(vector_store):
+    """
+    Persist the parts of a vector store that are not written synchronously (the ANN index of a flat vector store).
+
+    :param vector_store: Chroma or FlatVectorStore
+    """
+    if isinstance(vector_store, FlatVectorStore):
+        vector_store.persist()
+
+
+def get_vector_backend(path):
+    """
+    Return the backend of the vector store directory: the backend it was created with if it has data,
+    and settings.VECTOR_BACKEND for a new vector store.
+
+    :param path: path to the vector store directory
+    :return: "chroma" or "flat"
+    """
+    if os.path.exists(fr"{path}\{FLAT_INDEX_FILE}"):
+        return "flat"
+    if os.path.exists(fr"{path}\chroma.sqlite3"):
+        return "chroma"
+    if settings.VECTOR_BACKEND not in VECTOR_BACKENDS:
+        raise ValueError(f"Unknown vector backend: {settings.VECTOR_BACKEND}. Expected one of {VECTOR_BACKENDS}")
+    return settings.VECTOR_BACKEND
+
+
+def count_vectors(vector_store):
+    """
+    Return the number of chunks in a vector store.
+
+    :param vector_store: Chroma or FlatVectorStore
+    :return: number of chunks
+    """
+    if isinstance(vector_store, FlatVectorStore):
+        return vector_store.count()
+    return vector_store._collection.count()
+
+
+def get_chunk_ids(docs):
     """
-    Update vector store with new documents
+    Assign a stable ID to every chunk.
+    The ID is derived from the chunk's source file and its position within that file, so the chunks of a file
+    can be found (and deleted) again when the file changes.
+
+    :param docs: list of document chunks, in file order
+    :return: list of IDs, in the order of docs
+    """
+    ids = []
+    counters = {}
+    for doc in docs:
+        source = str(doc.metadata.get("source", ""))
+        index = counters.get(source, 0)
+        counters[source] = index + 1
+        ids.append(f"{hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]}-{index}")
+    return ids
+
+
+def group_ids_by_source(docs, ids):
+    """
+    Group chunk IDs by the source file of their chunk.
+
+    :param docs: list of document chunks
+    :param ids: list of chunk IDs, in the order of docs
+    :return: dictionary of source file path to list of chunk IDs
+    """
+    ids_by_source = {}
+    for doc, doc_id in zip(docs, ids):
+        ids_by_source.setdefault(str(doc.metadata.get("source", "")), []).append(doc_id)
+    return ids_by_source
+
+
+def copy_vector_store(src_path, dst_path):
+    """
+    Copy a persisted vector store directory, carrying its vectors forward without re-embedding.
+
+    :param src_path: path of the existing vector store
+    :param dst_path: path of the new vector store. Must not exist.
+    """
+    shutil.copytree(src_path, dst_path)
+
+
+def update_vector_store(vector_store, new_docs, ids=None):
+    """
+    Update vector store with new documents.
+    Documents whose ID already exists in the vector store are overwritten.
 
     :param vector_store: vector store to update
     :param new_docs: documents to add
+    :param ids: IDs of the documents. If None, stable chunk IDs are assigned.
     :return: updated vector store
     """
-    vector_store.add_documents(new_docs)
+    if ids is None:
+        ids = get_chunk_ids(new_docs)
+    vector_store.add_documents(new_docs, ids=ids)
     vector_store.persist()
 
 
-def load_and_update_vector_store(path, new_docs):
+def delete_from_vector_store(vector_store, ids, batch_size=5000):
+    """
+    Delete ('forget') documents from the vector store by their IDs.
+
+    :param vector_store: vector store to delete from
+    :param ids: IDs of the documents to delete
+    :param batch_size: maximal number of IDs deleted per call
     """
-    Load vector store from disk, add new documents and save back to disk.
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        vector_store.delete(ids=ids[start:start + batch_size])
+
+
+def load_and_update_vector_store(path, new_docs, stale_ids=None, new_ids=None):
+    """
+    Load vector store from disk, delete stale documents, add new documents and save back to disk.
 
     :param path: path to Chroma vector store
     :param new_docs: documents to add
+    :param stale_ids: IDs of the documents to delete before adding the new ones (e.g. old versions of changed files)
+    :param new_ids: IDs of the new documents. If None, stable chunk IDs are assigned.
     :return: updated vector store
     """
     vector_store = load_vector_store(path)
+    if stale_ids:
+        delete_from_vector_store(vector_store, stale_ids)
     if len(new_docs) > 0:
-        update_vector_store(vector_store,
-                            new_docs)  # TODO: Delete ('forget') old documents versions before update. Can be done using changed_files and iterating with vector_store.delete()
+        update_vector_store(vector_store, new_docs, ids=new_ids)
     return vector_store
 
 
-def create_vector_store(save_path, docs):
+def create_vector_store(save_path, docs, ids=None):
     """
     Creates a new vector store from a list of documents.
 
     :param docs: list of documents to create vector store from
     :param save_path: directory to save vector store to
+    :param ids: IDs of the documents. If None, stable chunk IDs are assigned.
     :return: vector store
     """
     embedding_model = get_embedding_model()
+    if ids is None:
+        ids = get_chunk_ids(docs)
 
-    vector_store = Chroma.from_documents(
-        documents=docs,
-        embedding=embedding_model,
-        persist_directory=save_path
-    )
+    if get_vector_backend(save_path) == "flat":
+        vector_store = FlatVectorStore.from_documents(documents=docs, embedding=embedding_model, ids=ids,
+                                                      persist_directory=save_path, **get_flat_store_kwargs())
+        vector_store.persist()
+    else:
+        vector_store = Chroma.from_documents(
+            documents=docs,
+            embedding=embedding_model,
+            ids=ids,
+            persist_directory=save_path,
+            collection_metadata=get_chroma_hnsw_metadata()
+        )
     # vector_store.persist()
+    if settings.DEBUG and isinstance(embedding_model, CachedEmbeddings):
+        print(f"Embedding cache: {embedding_model.cache.stats()}")
     return vector_store
 
 
-def get_retriever(vector_store, search_type=settings.SEARCH_TYPE, compress=settings.COMPRESS_QUERY):
+def get_query_embedder(vector_store, cache_size=settings.QUERY_CACHE_SIZE, persist=settings.QUERY_CACHE_PERSIST):
+    """
+    Get the embeddings used to embed queries against a vector store, wrapped with the query embedding cache.
+
+    :param vector_store: vector store whose embedding model embeds the queries
+    :param cache_size: number of query embeddings kept in memory (default: settings.QUERY_CACHE_SIZE). 0 disables the cache.
+    :param persist: whether to persist the query embeddings under DATA_DIR (default: settings.QUERY_CACHE_PERSIST)
+    :return: the query embeddings
+    """
+    embedding_model = vector_store.embeddings
+    if cache_size <= 0:
+        return embedding_model
+    persist_path = fr"{settings.DATA_DIR}\query_cache.sqlite" if persist else None
+    query_cache = get_query_embedding_cache(cache_size, persist_path=persist_path,
+                                            max_bytes=settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+    return QueryCachedEmbeddings(embedding_model, model_name=get_embedding_model_name(), query_cache=query_cache)
+
+
+def get_search_kwargs(search_type=settings.SEARCH_TYPE, **overrides):
+    """
+    Get the keyword arguments of a search from the settings.
+
+    :param search_type: type of search to perform (default: settings.SEARCH_TYPE)
+    :param overrides: arguments replacing the settings (e.g. k, fetch_k, lambda_mult)
+    :return: dictionary of search keyword arguments
+    """
+    search_kwargs = {"k": settings.SEARCH_K}
+    if search_type == "mmr":
+        search_kwargs.update(fetch_k=settings.SEARCH_FETCH_K, lambda_mult=settings.MMR_LAMBDA)
+    search_kwargs.update(overrides)
+    if search_type == "mmr" and search_kwargs["fetch_k"] <= search_kwargs["k"]:
+        print(f"Warning: MMR fetches fetch_k={search_kwargs['fetch_k']} candidates for k={search_kwargs['k']} "
+              f"results, so it selects all of them and only reorders them. Increase SEARCH_FETCH_K.")
+    return search_kwargs
+
+
+def get_query_retriever(vector_store, search_type=settings.SEARCH_TYPE, search_kwargs=None):
+    """
+    Get a retriever from a vector store that embeds queries through the query embedding cache.
+    Search types that can't search by vector fall back to the vector store's own retriever.
+
+    :param vector_store: vector store to get retriever from
+    :param search_type: type of search to perform (default: settings.SEARCH_TYPE)
+    :param search_kwargs: keyword arguments of the search (e.g. k, fetch_k, lambda_mult) replacing the settings
+    :return: retriever
+    """
+    search_kwargs = get_search_kwargs(search_type, **(search_kwargs or {}))
+    if search_type not in QUERY_SEARCH_TYPES:
+        return vector_store.as_retriever(search_type=search_type, search_kwargs=search_kwargs)
+    return VectorStoreQueryRetriever(vector_store=vector_store, query_embedder=get_query_embedder(vector_store),
+                                     search_type=search_type, search_kwargs=search_kwargs)
+
+
+def load_sparse_index(vector_store_path):
+    """
+    Load (or create) the BM25 index stored in a vector store directory.
+
+    :param vector_store_path: path to the Chroma vector store
+    :return: the sparse index
+    """
+    return SparseIndex(fr"{vector_store_path}\bm25_index.sqlite")
+
+
+def backfill_sparse_index(vector_store, sparse_index, batch_size=5000):
+    """
+    Index all the chunks of a vector store in a sparse index, e.g. for vector stores created before the sparse
+    index existed.
+
+    :param vector_store: vector store to read the chunks from
+    :param sparse_index: sparse index to add the chunks to
+    :param batch_size: number of chunks read from the vector store at a time
+    """
+    offset = 0
+    while True:
+        batch = vector_store.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+        if not batch["ids"]:
+            break
+        docs = [Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(batch["documents"], batch["metadatas"])]
+        sparse_index.add_documents(docs, batch["ids"])
+        offset += len(batch["ids"])
+    print(f"Indexed {offset} chunks in the sparse index")
+
+
+def get_hybrid_retriever(vector_store, sparse_index, search_type=settings.SEARCH_TYPE, search_kwargs=None,
+                         dense_weight=settings.HYBRID_WEIGHT, candidates=settings.HYBRID_CANDIDATES,
+                         mmr_fetch_factor=settings.HYBRID_MMR_FETCH_FACTOR):
+    """
+    Get a retriever fusing the vector store's search with the BM25 search of its sparse index.
+
+    :param vector_store: vector store to get retriever from
+    :param sparse_index: BM25 index of the vector store's chunks
+    :param search_type: type of the dense search (default: settings.SEARCH_TYPE)
+    :param search_kwargs: keyword arguments of the dense search (e.g. k, fetch_k, lambda_mult) replacing the settings
+    :param dense_weight: weight of the dense ranking in [0, 1] (default: settings.HYBRID_WEIGHT)
+    :param candidates: number of documents retrieved by each search before fusion (default: settings.HYBRID_CANDIDATES)
+    :param mmr_fetch_factor: an MMR dense search selects the candidates from at least mmr_fetch_factor times as many
+        documents (default: settings.HYBRID_MMR_FETCH_FACTOR)
+    :return: retriever
+    """
+    search_kwargs = get_search_kwargs(search_type, **(search_kwargs or {}))
+    dense_retriever = get_query_retriever(vector_store, search_type=search_type, search_kwargs=search_kwargs)
+    return HybridRetriever(dense_retriever=dense_retriever, sparse_index=sparse_index, dense_weight=dense_weight,
+                           k=search_kwargs["k"], candidates=candidates, mmr_fetch_factor=mmr_fetch_factor)
+
+
+def get_retriever(vector_store, search_type=settings.SEARCH_TYPE, compress=settings.COMPRESS_QUERY,
+                  search_kwargs=None):
     """
     Get a retriever from a vector store based on the settings.
 
     :param vector_store: vector store to get retriever from
     :param search_type: type of search to perform (default: settings.SEARCH_TYPE)
     :param compress: whether to compress retrieved documents (default: settings.COMPRESS_QUERY)
+    :param search_kwargs: keyword arguments of the search (e.g. k, fetch_k, lambda_mult) replacing the settings
     :return: retriever
     """
-    retriever = vector_store.as_retriever(search_type=search_type)  # NOTE: OR SelfQueryRetriever
+    retriever = get_query_retriever(vector_store, search_type=search_type,
+                                    search_kwargs=search_kwargs)  # NOTE: OR SelfQueryRetriever
 
     if compress:
         retriever = get_compression_retriever(retriever)
@@ -34,7 +34,11 @@ class PersonalRAGApp:
                 self._handle_list_conversations()
             elif choice == 5:  # Continue conversation
                 self._handle_continue_conversation()
-            elif choice == 6:  # Exit
+            elif choice == 6:  # Resume interrupted build
+                self._handle_resume_build()
+            elif choice == 7:  # Watch source for changes
+                self._handle_watch_source()
+            elif choice == 8:  # Exit
                 print("Goodbye!")
                 break
 
@@ -66,7 +70,7 @@ class PersonalRAGApp:
         try:
             current_conv_id = self.manager.start_conversation(version_name)
             self.menu.show_message(f"Started new conversation with ID: {current_conv_id}")
-            self.menu.chat_loop(self.manager.query, self.manager.get_messages)
+            self.menu.chat_loop(self.manager.stream_query, self.manager.get_messages)
         except Exception as e:
             self.menu.show_message(f"Error starting conversation: {str(e)}")
 
@@ -85,6 +89,37 @@ class PersonalRAGApp:
         except Exception as e:
             self.menu.show_message(f"Error updating vector store: {str(e)}")
 
+    def _handle_resume_build(self):
+        """Handle resuming an interrupted vector store build"""
+        builds = self.manager.list_interrupted_builds()
+        build_idx = self.menu.get_version_choice(builds, "Select interrupted build to resume")
+
+        if build_idx < 0:
+            return
+
+        version_name = builds[build_idx]["version"]
+        try:
+            self.manager.resume_build(version_name, builds[build_idx]["date_path"])
+            self.menu.show_message(f"Build of version '{version_name}' resumed and completed successfully")
+        except Exception as e:
+            self.menu.show_message(f"Error resuming build: {str(e)}")
+
+    def _handle_watch_source(self):
+        """Handle watching a version's source path for changes"""
+        versions = self.manager.list_versions()
+        version_idx = self.menu.get_version_choice(versions, "Select version to watch")
+
+        if version_idx < 0:
+            return
+
+        version_name = versions[version_idx]["version"]
+        try:
+            print("Watching for changes. Press Ctrl+C to stop.")
+            self.manager.watch_source(version_name)
+            self.menu.show_message("Stopped watching")
+        except Exception as e:
+            self.menu.show_message(f"Error watching source: {str(e)}")
+
     def _handle_list_conversations(self):  # TODO: add lisr conversations per version
         """Handle listing conversations"""
         # versions = self.manager.list_versions()
@@ -115,7 +150,7 @@ class PersonalRAGApp:
             return
         conv_details = convs[conv_idx]
         self.manager.continue_conversation(conv_details["version"], conv_details["conv_id"])
-        self.menu.chat_loop(self.manager.query, self.manager.get_messages)
+        self.menu.chat_loop(self.manager.stream_query, self.manager.get_messages)
 
 
 def main():
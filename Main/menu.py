@@ -39,7 +39,9 @@ class MenuSystem:
             MenuItem(3, "Update vector store"),
             MenuItem(4, "List conversations"),
             MenuItem(5, "Continue conversation"),
-            MenuItem(6, "Exit")
+            MenuItem(6, "Resume interrupted build"),
+            MenuItem(7, "Watch source for changes"),
+            MenuItem(8, "Exit")
         ]
 
         # Display menu
@@ -48,10 +50,10 @@ class MenuSystem:
 
         # Get user choice
         try:
-            choice = int(input("\nEnter your choice (1-6): "))
-            if 1 <= choice <= 6:
+            choice = int(input("\nEnter your choice (1-8): "))
+            if 1 <= choice <= 8:
                 return choice
-            print("\nPlease enter a number between 1 and 6.")
+            print("\nPlease enter a number between 1 and 8.")
             input("Press Enter to continue...")
             return 0
         except ValueError:
@@ -127,7 +129,8 @@ class MenuSystem:
     def chat_loop(self, query_callback, history_callback):
         """Handle the chat interaction loop
         
-            :param query_callback: A function that takes a user message and returns the AI's response
+            :param query_callback: A function that takes a user message and returns the AI's response,
+                or an iterator of its tokens, which are printed as they arrive
             :param history_callback:
         """
         print("\n=== Chat Mode ===")
@@ -152,7 +155,13 @@ class MenuSystem:
                     continue
 
                 response = query_callback(user_input)
-                print(f"AI: {response}")
+                if isinstance(response, str):
+                    print(f"AI: {response}")
+                else:
+                    print("AI: ", end="", flush=True)
+                    for token in response:
+                        print(token, end="", flush=True)
+                    print()
             except Exception as e:
                 print(f"Error: {e}")
 
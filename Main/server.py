@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from core.session_manager import SessionManager
+from config import settings
+
+_STATUS_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                   408: "Request Timeout", 413: "Payload Too Large", 500: "Internal Server Error",
+                   503: "Service Unavailable"}
+_STREAM_END = object()
+
+
+class HttpError(Exception):
+    """
+    An error answered with an HTTP status and a JSON error message.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class QueryServer:
+    """
+    Asynchronous HTTP/JSON server answering the questions of many concurrent conversations.
+
+    Connections are handled by an asyncio event loop, and the blocking work (loading vector stores, retrieval,
+    LLM calls) runs in a bounded thread pool, so slow LLM calls of one conversation do not delay the others.
+    Requests of the same conversation are queued with a per-conversation lock, so a conversation never occupies
+    more than one worker. When more than max_pending requests are in progress, new requests are rejected with
+    503 (and a Retry-After header) instead of queueing without bound.
+
+    Endpoints:
+        GET  /health                              - server and session statistics
+        GET  /versions                            - the versions (limit and offset query parameters)
+        GET  /conversations                       - the conversations (version, limit and offset query parameters)
+        POST /conversations                       - start a conversation: {"version": ...}
+        GET  /conversations/<conv_id>/messages    - the messages of a conversation (limit query parameter: the
+            number of last messages)
+        POST /conversations/<conv_id>/query       - ask a question: {"question": ..., "stream": false}.
+            With "stream": true, the answer is streamed as newline-delimited JSON: {"token": ...} lines and
+            a final {"done": true} line.
+
+    Attributes:
+        sessions (SessionManager): The conversations and versions served.
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        max_pending (int): The maximal number of requests in progress.
+        max_body_bytes (int): The maximal size of a request body.
+        idle_timeout (float): Seconds after which an idle connection is closed.
+    """
+
+    def __init__(self, sessions, host=settings.SERVER_HOST, port=settings.SERVER_PORT,
+                 workers=settings.SERVER_WORKERS, max_pending=settings.SERVER_MAX_PENDING,
+                 max_body_bytes=settings.SERVER_MAX_BODY_BYTES, idle_timeout=settings.SERVER_IDLE_TIMEOUT):
+        self.sessions = sessions
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self.max_body_bytes = max_body_bytes
+        self.idle_timeout = idle_timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-worker")
+        self._pending = 0
+        self._conversation_locks = {}
+        self._routes = [
+            ("GET", re.compile(r"/health"), self._health),
+            ("GET", re.compile(r"/versions"), self._list_versions),
+            ("GET", re.compile(r"/conversations"), self._list_conversations),
+            ("POST", re.compile(r"/conversations"), self._start_conversation),
+            ("GET", re.compile(r"/conversations/(?P<conv_id>[\w-]+)/messages"), self._get_messages),
+            ("POST", re.compile(r"/conversations/(?P<conv_id>[\w-]+)/query"), self._query),
+        ]
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @contextlib.asynccontextmanager
+    async def _conversation_turn(self, conv_id):
+        """
+        Hold the lock of a conversation. The lock is dropped once no request of the conversation uses it.
+        Locks are only used in the event loop thread.
+        """
+        entry = self._conversation_locks.setdefault(conv_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._conversation_locks[conv_id]
+
+    # Handlers
+
+    async def _health(self, writer, query, body):
+        stats = await self._run_blocking(self.sessions.stats)
+        stats.update(pending_requests=self._pending, max_pending=self.max_pending)
+        await self._send_json(writer, 200, stats)
+
+    async def _list_versions(self, writer, query, body):
+        versions = await self._run_blocking(self.sessions.list_versions, _int_param(query, "limit"),
+                                            _int_param(query, "offset") or 0)
+        await self._send_json(writer, 200, versions)
+
+    async def _list_conversations(self, writer, query, body):
+        conversations = await self._run_blocking(self.sessions.list_conversations, query.get("version"),
+                                                 _int_param(query, "limit"), _int_param(query, "offset") or 0)
+        await self._send_json(writer, 200, conversations)
+
+    async def _start_conversation(self, writer, query, body):
+        version_num = _required_field(body, "version")
+        conv_id = await self._run_blocking(self.sessions.start_conversation, version_num)
+        await self._send_json(writer, 201, {"conv_id": conv_id})
+
+    async def _get_messages(self, writer, query, body, conv_id):
+        async with self._conversation_turn(conv_id):
+            messages = await self._run_blocking(self.sessions.get_messages, conv_id, _int_param(query, "limit"))
+        await self._send_json(writer, 200, messages)
+
+    async def _query(self, writer, query, body, conv_id):
+        question = _required_field(body, "question")
+        async with self._conversation_turn(conv_id):
+            if body.get("stream"):
+                await self._stream_answer(writer, conv_id, question)
+            else:
+                answer = await self._run_blocking(self.sessions.query, conv_id, question)
+                await self._send_json(writer, 200, {"conv_id": conv_id, "answer": answer})
+
+    async def _stream_answer(self, writer, conv_id, question):
+        """
+        Stream the tokens of an answer as chunks of newline-delimited JSON.
+        The tokens are produced by a worker thread and handed to the event loop through a queue. The answer is
+        generated (and saved) to the end even if the client disconnects.
+        stream_chain runs the chain in a thread of its own, which the worker waits for, so a streamed answer holds a
+        worker and one extra thread: at most SERVER_WORKERS streams (and extra threads) run at once.
+        """
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+
+        def produce():
+            try:
+                for token in self.sessions.stream_query(conv_id, question):
+                    loop.call_soon_threadsafe(tokens.put_nowait, {"token": token})
+            except Exception as e:
+                loop.call_soon_threadsafe(tokens.put_nowait, _error_payload(e))
+            finally:
+                loop.call_soon_threadsafe(tokens.put_nowait, _STREAM_END)
+
+        producer = loop.run_in_executor(self._executor, produce)
+        writer.write(_response_head(200, "application/x-ndjson", chunked=True))
+        client_connected = True
+        while True:
+            item = await tokens.get()
+            if item is _STREAM_END:
+                break
+            if client_connected:
+                try:
+                    await self._send_chunk(writer, json.dumps(item) + "\n")
+                except ConnectionError:
+                    client_connected = False
+        await producer
+        if client_connected:
+            await self._send_chunk(writer, json.dumps({"done": True}) + "\n")
+            await self._send_chunk(writer, "")
+
+    # HTTP
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve the requests of a connection (HTTP/1.1 keep-alive) until it is closed or idle for idle_timeout.
+        """
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=self.idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._send_json(writer, 413, {"error": "Request head too large"}, close=True)
+                    break
+                keep_alive = await self._handle_request(reader, writer, head)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader, writer, head):
+        """
+        Parse a request, route it to its handler and answer errors as JSON.
+
+        :return: whether the connection can be kept alive
+        """
+        try:
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, target, http_version = request_line.split(" ")
+            headers = dict(line.split(":", 1) for line in header_lines if ":" in line)
+            headers = {name.strip().lower(): value.strip() for name, value in headers.items()}
+        except ValueError:
+            await self._send_json(writer, 400, {"error": "Malformed request"}, close=True)
+            return False
+        keep_alive = headers.get("connection", "").lower() != "close" and http_version == "HTTP/1.1"
+
+        try:
+            body = await self._read_body(reader, headers)
+        except HttpError as e:
+            # The unread body would be parsed as the next request
+            await self._send_json(writer, e.status, {"error": str(e)}, close=True)
+            return False
+
+        try:
+            url = urlsplit(target)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            handler, path_params = self._route(method, url.path.rstrip("/") or "/")
+            if self._pending >= self.max_pending:
+                raise HttpError(503, "Server is busy, retry later")
+            self._pending += 1
+            try:
+                await handler(writer, query, body, **path_params)
+            finally:
+                self._pending -= 1
+        except HttpError as e:
+            await self._send_json(writer, e.status, {"error": str(e)}, close=not keep_alive)
+        except Exception as e:
+            payload = _error_payload(e)
+            await self._send_json(writer, payload.pop("status"), payload, close=not keep_alive)
+        return keep_alive
+
+    async def _read_body(self, reader, headers):
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(400, "Chunked request bodies are not supported")
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length")
+        if length < 0:
+            raise HttpError(400, "Invalid Content-Length")
+        if length > self.max_body_bytes:
+            raise HttpError(413, f"Request body is larger than {self.max_body_bytes} bytes")
+        if not length:
+            return {}
+        try:
+            raw_body = await asyncio.wait_for(reader.readexactly(length), timeout=self.idle_timeout)
+        except asyncio.TimeoutError:
+            raise HttpError(408, "Timed out reading the request body")
+        try:
+            body = json.loads(raw_body)
+        except ValueError:
+            raise HttpError(400, "Request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise HttpError(400, "Request body must be a JSON object")
+        return body
+
+    def _route(self, method, path):
+        path_matched = False
+        for route_method, pattern, handler in self._routes:
+            match = pattern.fullmatch(path)
+            if match is None:
+                continue
+            path_matched = True
+            if route_method == method:
+                return handler, match.groupdict()
+        if path_matched:
+            raise HttpError(405, f"Method {method} is not allowed for {path}")
+        raise HttpError(404, f"No endpoint {path}")
+
+    async def _send_json(self, writer, status, payload, close=False):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        writer.write(_response_head(status, "application/json", content_length=len(body), close=close) + body)
+        await writer.drain()
+
+    async def _send_chunk(self, writer, text):
+        data = text.encode("utf-8")
+        writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        await writer.drain()
+
+    async def serve(self):
+        """
+        Listen for connections until the process is interrupted.
+        """
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"Serving on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(wait=True)
+            self.sessions.close()
+
+
+def _response_head(status, content_type, content_length=None, chunked=False, close=False):
+    lines = [f"HTTP/1.1 {status} {_STATUS_REASONS.get(status, '')}", f"Content-Type: {content_type}"]
+    if chunked:
+        lines.append("Transfer-Encoding: chunked")
+    else:
+        lines.append(f"Content-Length: {content_length}")
+    if status == 503:
+        lines.append("Retry-After: 1")
+    lines.append(f"Connection: {'close' if close else 'keep-alive'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _error_payload(error):
+    if isinstance(error, HttpError):
+        return {"status": error.status, "error": str(error)}
+    if isinstance(error, KeyError):
+        return {"status": 404, "error": error.args[0] if error.args else str(error)}
+    if isinstance(error, ValueError):
+        return {"status": 400, "error": str(error)}
+    print(f"Request failed. Error: {str(error)}")
+    return {"status": 500, "error": "Internal server error"}
+
+
+def _required_field(body, name):
+    value = body.get(name)
+    if not isinstance(value, str) or not value.strip():
+        raise HttpError(400, f"Missing field: {name}")
+    return value
+
+
+def _int_param(query, name):
+    if name not in query:
+        return None
+    try:
+        return int(query[name])
+    except ValueError:
+        raise HttpError(400, f"Query parameter {name} must be an integer")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Personal RAG System over HTTP/JSON.")
+    parser.add_argument("--host", default=settings.SERVER_HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT, help="port to listen on")
+    args = parser.parse_args()
+
+    server = QueryServer(SessionManager(), host=args.host, port=args.port)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print("Server stopped")
+
+
+if __name__ == "__main__":
+    main()
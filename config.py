@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv, find_dotenv
 
 import os
@@ -28,13 +29,146 @@ class Settings(BaseSettings):
     DEFAULT_VERSION: str = "1.0"
     DATA_DIR: str = str(PROJECT_ROOT / "data")
 
+    # Vector store backend of new vector stores - "chroma", or "flat" (memory-mapped NumPy array searched exactly).
+    # Existing vector stores keep the backend they were created with
+    VECTOR_BACKEND: str = "chroma"
+    FLAT_INDEX_DTYPE: str = "float32"  # or "float16" to halve the size of the flat index
+    # Approximate nearest-neighbour index of the flat backend - "none" (exact search), "hnsw" (hnswlib, for latency)
+    # or "ivfpq" (faiss, for memory). ANN candidates are re-scored exactly, ANN_REFINE_FACTOR per requested result
+    ANN_INDEX: str = "none"
+    ANN_REFINE_FACTOR: int = 4
+    # HNSW knobs - also used for new Chroma collections. HNSW_EF_SEARCH trades latency for recall
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 64
+    # IVF-PQ knobs - IVF_NPROBE trades latency for recall. IVF_PQ_M must divide the embedding dimension
+    IVF_NLIST: int = 1024
+    IVF_PQ_M: int = 16
+    IVF_PQ_NBITS: int = 8
+    IVF_NPROBE: int = 16
+
     # RAG & Models settings
     EMBEDDING_MODEL: str = "text-embedding-ada-002"
     LLM_MODEL: str = "gpt-3.5-turbo"
     LLM_TEMP: float = 0
+    # Stream the tokens of the answers to the chat as they are generated
+    STREAM_ANSWERS: bool = True
+    # Condensing follow-up questions with the chat history - "always" (one LLM call per follow-up), "auto" (skipped
+    # for questions a local heuristic deems standalone) or "speculative" ("auto", retrieving for the raw question
+    # while condensing - lower latency, but a second retrieval when the condensed question differs).
+    # CONDENSE_LLM_MODEL is a small, fast model, as it delays the retrieval
+    CONDENSE_MODE: str = "auto"
+    CONDENSE_LLM_MODEL: str = "gpt-4o-mini"
     SEARCH_TYPE: str = "mmr"
+    # Search - SEARCH_K documents are returned; MMR selects them from SEARCH_FETCH_K candidates, trading relevance (1)
+    # for diversity (0) with MMR_LAMBDA. They can be overridden per query (see VectorStoreQueryRetriever)
+    SEARCH_K: int = 4
+    SEARCH_FETCH_K: int = 20
+    MMR_LAMBDA: float = 0.5
+    # Hybrid search - fuse the dense search with a BM25 index of the chunks (reciprocal rank fusion).
+    # HYBRID_WEIGHT is the weight of the dense ranking in [0, 1]; the BM25 ranking gets the rest. Each search returns
+    # HYBRID_CANDIDATES documents; an MMR dense search selects them from HYBRID_MMR_FETCH_FACTOR times as many
+    HYBRID_SEARCH: bool = True
+    HYBRID_WEIGHT: float = 0.5
+    HYBRID_CANDIDATES: int = 20
+    HYBRID_MMR_FETCH_FACTOR: int = 4
     CHAIN_TYPE: str = "stuff"
 
+    # OpenAI clients - all the LLM and embedding clients share one HTTP connection pool, keeping up to
+    # HTTP_MAX_KEEPALIVE_CONNECTIONS idle connections alive for HTTP_KEEPALIVE_SECONDS. At most HTTP_MAX_CONNECTIONS
+    # requests are sent concurrently; the others wait for a connection. HTTP2 requires the h2 package
+    HTTP_MAX_CONNECTIONS: int = 32
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 16
+    HTTP_KEEPALIVE_SECONDS: float = 60
+    HTTP_TIMEOUT: float = 60
+    HTTP_CONNECT_TIMEOUT: float = 10
+    HTTP2: bool = True
+    LLM_MAX_RETRIES: int = 2
+
+    # Version pool - the most recently used versions are kept loaded, up to VERSION_POOL_SIZE versions and
+    # VERSION_POOL_MAX_MB of vector store files (an estimate of their memory)
+    VERSION_POOL_SIZE: int = 4
+    VERSION_POOL_MAX_MB: int = 4096
+
+    # Query server (python -m Main.server) - SERVER_WORKERS threads run the blocking work of the requests. Requests
+    # beyond SERVER_MAX_PENDING in progress are rejected with 503, and the least recently used idle conversations
+    # beyond SERVER_MAX_CONVERSATIONS are closed
+    SERVER_HOST: str = "127.0.0.1"
+    SERVER_PORT: int = 8080
+    SERVER_WORKERS: int = 16
+    SERVER_MAX_PENDING: int = 64
+    SERVER_MAX_CONVERSATIONS: int = 256
+    SERVER_MAX_BODY_BYTES: int = 64 * 1024
+    SERVER_IDLE_TIMEOUT: float = 60
+
+    # Source scan - number of directories scanned (and files hashed) concurrently when listing the source files
+    SCAN_WORKERS: int = 8
+
+    # Watch mode - source changes are applied to the live vector store in batches of WATCH_BATCH_FILES files,
+    # once no change was seen for WATCH_DEBOUNCE_SECONDS. Polling (every WATCH_POLL_SECONDS) is used when watchdog
+    # is not installed, or when forced (e.g. network shares that do not deliver change notifications).
+    # A batch that fails is retried WATCH_MAX_RETRIES times with exponential backoff, then dropped
+    WATCH_DEBOUNCE_SECONDS: float = 2
+    WATCH_POLL_SECONDS: float = 5
+    WATCH_BATCH_FILES: int = 32
+    WATCH_POLLING: bool = False
+    WATCH_MAX_RETRIES: int = 5
+
+    # Ingestion - number of processes converting documents with Docling (1 = serial)
+    DOCLING_WORKERS: int = 1
+    # Cache parsed documents under DATA_DIR, keyed by file content hash and loader configuration. The least recently
+    # used entries are evicted beyond PARSE_CACHE_MAX_MB
+    PARSE_CACHE: bool = True
+    PARSE_CACHE_MAX_MB: int = 1024
+
+    # Ingestion - chunks embedded and written per batch, and batches loaded ahead of the writer
+    INGEST_BATCH_SIZE: int = 256
+    INGEST_PREFETCH_BATCHES: int = 2
+
+    # Embedding backend - "openai" (EMBEDDING_MODEL through the API) or "local" (LOCAL_EMBEDDING_MODEL on the CPU)
+    EMBEDDING_BACKEND: str = "openai"
+    LOCAL_EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    LOCAL_EMBEDDING_BATCH_SIZE: int = 64
+    LOCAL_EMBEDDING_THREADS: int = 0  # 0 = torch default
+    LOCAL_EMBEDDING_QUANTIZE: bool = False  # dynamic int8 quantization
+
+    # Embedding requests - concurrent, token-budgeted batches with rate-limit-aware backoff
+    EMBEDDING_ASYNC: bool = True
+    EMBEDDING_BASE_URL: Optional[str] = None  # e.g. a local fake embedding server for benchmarks
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_BATCH_MAX_TOKENS: int = 100_000
+    EMBEDDING_BATCH_MAX_INPUTS: int = 1024
+    EMBEDDING_MAX_RETRIES: int = 6
+
+    # Embedding cache - shared by all versions, stored under DATA_DIR
+    EMBEDDING_CACHE: bool = True
+    EMBEDDING_CACHE_MAX_MB: int = 2048
+    # Query embedding cache - LRU of query embeddings in the retrieval path (0 disables it)
+    QUERY_CACHE_SIZE: int = 1024
+    QUERY_CACHE_PERSIST: bool = False
+
+    # Semantic answer cache per date directory - cached answers are returned for questions whose embedding
+    # is at least ANSWER_CACHE_THRESHOLD cosine-similar to a previously answered one, with the same numbers and
+    # names. Off by default: ada-002 similarities are compressed near 1, so check the threshold on your questions
+    ANSWER_CACHE: bool = False
+    ANSWER_CACHE_THRESHOLD: float = 0.98
+    ANSWER_CACHE_MAX_ENTRIES: int = 10_000
+
+    # Conversation memory - "buffer" keeps the whole history in the prompts, "summary_buffer" keeps the recent
+    # messages that fit in MEMORY_MAX_TOKENS and a rolling summary of the older ones
+    MEMORY_MODE: str = "summary_buffer"
+    MEMORY_MAX_TOKENS: int = 2000
+
+    # Conversation log - appends fsynced in batches, and the number of last turns loaded when continuing
+    CONV_LOG_FSYNC_EVERY: int = 8
+    CONV_MEMORY_TAIL_TURNS: int = 20
+
+    # Conversation descriptions are summarized in the background every N turns, or after an idle period
+    SUMMARY_EVERY_N_TURNS: int = 3
+    SUMMARY_IDLE_SECONDS: float = 30
+    # Descriptions are one-line titles, truncated to DESCRIPTION_MAX_CHARS for the listings
+    DESCRIPTION_MAX_CHARS: int = 100
+
     COMPRESS_QUERY: bool = False
     LLM_MODEL_COMPRESS: str = "gpt-3.5-turbo-instruct"
     LLM_TEMP_COMPRESS: float = 0
@@ -1,13 +1,18 @@
-import json
 import os
 import uuid
 
 # from langchain.chains.conversational_retrieval.base import ConversationalRetrievalChain
 # from langchain.memory import ConversationBufferMemory
-from langchain_core.messages import messages_to_dict
+from langchain_core.messages import AIMessage, HumanMessage, messages_to_dict, messages_from_dict
 
+from DataLayer.catalog import get_catalog
+from DataLayer.conversation_log import ConversationLog
 from DataLayer.data_module import create_dir, save_dict, load_dict
-from LLMUtils.rag import get_llm, conversation_chain, summarize
+from core.summarizer import get_description_summarizer
+from LLMUtils.rag import get_llm, conversation_chain
+from LLMUtils.streaming import stream_chain
+from LLMUtils.answer_cache import sources_fingerprint
+from config import settings
 
 
 class Conversation:
@@ -17,16 +22,22 @@ class Conversation:
     A conversation is a series of messages that are sent by a user and responded to by a chatbot.
     The conversation is stored in a directory with the conversation ID as the name.
     The conversation directory contains a metadata file with information about the conversation,
-    and a subdirectory for each date the conversation was active, containing a file with the
-    conversation history.
+    and an append-only log of the conversation history.
 
     Attributes:
         conv_id (str): The ID of the conversation.
         conv_dir (str): The path to the directory where the conversation is stored.
         conv_retrieval_chain (ConversationalRetrievalChain): The conversational retrieval chain
             used to respond to the user.
+        answer_cache (AnswerCache): The semantic answer cache of the version's vector store, or None.
+        last_sources_fingerprint (str): Fingerprint of the documents the last answer was generated from.
+        log (ConversationLog): The append-only log of the conversation history.
+        num_messages (int): The number of messages in the conversation history.
+        memory_summary (dict): The rolling summary of the memory and the number of messages it covers.
+        version_num (str): The version of the conversation, used to record it in the catalog.
+        date_path (str): The date directory of the conversation, used to record it in the catalog.
     """
-    def __init__(self, convs_dir, conv_id=None):
+    def __init__(self, convs_dir, conv_id=None, answer_cache=None, version_num=None, date_path=None):
         if conv_id is not None:
             self.conv_id = conv_id
             self.conv_dir = fr"{convs_dir}\{self.conv_id}"
@@ -37,6 +48,13 @@ class Conversation:
             create_dir(self.conv_dir)
 
         self.conv_retrieval_chain = None
+        self.answer_cache = answer_cache
+        self.last_sources_fingerprint = None
+        self.log = ConversationLog(self.conv_dir, fsync_every=settings.CONV_LOG_FSYNC_EVERY)
+        self.num_messages = 0
+        self.memory_summary = {"summary": "", "summarized_messages": 0}
+        self.version_num = version_num
+        self.date_path = date_path
 
     def start_conversation(self, retriever):
         """
@@ -55,16 +73,32 @@ class Conversation:
         }
         # conv_retrieval_chain.memory.save_to_file(self.conv_dir / memory.json")
         save_dict(conv_meta, fr"{self.conv_dir}\conv_meta")
+        if self.version_num is not None:
+            get_catalog().add_conversation(self.conv_id, self.version_num, self.date_path, conv_meta["description"])
         # return self.conv_retrieval_chain
 
     def continue_conversation(self, retriever):
         """
         Continue an existing conversation using the given retriever.
 
+        At most the last settings.CONV_MEMORY_TAIL_TURNS turns are loaded into the chain's memory, read from the end
+        of the conversation log. In "summary_buffer" memory mode, only the messages that are not covered by the
+        saved rolling summary are loaded, along with the summary.
+
         :param retriever: the retriever to use
         :return: the conversational retrieval chain
         """
-        self.conv_retrieval_chain = conversation_chain(retriever, memory_load_path=self.conv_dir)
+        self.num_messages = self.log.count()
+        num_tail_messages = 2 * settings.CONV_MEMORY_TAIL_TURNS
+        summary = ""
+        if settings.MEMORY_MODE == "summary_buffer" and os.path.exists(fr"{self.conv_dir}\memory_summary.json"):
+            self.memory_summary = load_dict(fr"{self.conv_dir}\memory_summary")
+            summary = self.memory_summary["summary"]
+            num_tail_messages = min(num_tail_messages, self.num_messages - self.memory_summary["summarized_messages"])
+        messages = messages_from_dict(self.log.read_tail(num_tail_messages))
+        if self.log.maybe_compact():
+            self.num_messages = self.log.count()
+        self.conv_retrieval_chain = conversation_chain(retriever, messages=messages, summary=summary)
 
         # return self.conv_retrieval_chain
 
@@ -72,54 +106,143 @@ class Conversation:
         """
         Query the conversation with a question.
 
+        The first question of a conversation is standalone, so it is first looked up in the answer cache.
+        Every generated answer is added to the answer cache with its standalone (condensed) question.
+
         :param question: the question to ask
         :return: the response of the conversation
         """
         if self.conv_retrieval_chain is None:
             raise ValueError("Conversation not started")
         # TODO: Add moderation for the question
-        response = self.conv_retrieval_chain({"question": question})
+        answer = self._query_answer_cache(question)
+        if answer is None:
+            response = self.conv_retrieval_chain({"question": question})
+            answer = self._cache_answer(question, response)
         # TODO: Add moderation for the response
-        messages = self._save_memory_to_file()
-        self._update_conversation_description(messages)
-        return response["answer"]
+        self._finish_turn(question, answer)
+        return answer
 
-    def get_messages(self):
+    def stream_query(self, question):
         """
-        Get the messages of the conversation.
+        Query the conversation with a question and stream the answer.
 
-        :return: the messages of the conversation
+        The tokens of the answer are yielded as the LLM generates them (a cached answer is yielded at once).
+        The turn is saved to the conversation log, and the description is updated, after the last token is yielded,
+        so the stream must be consumed to the end.
+
+        :param question: the question to ask
+        :return: generator of the tokens of the answer
         """
         if self.conv_retrieval_chain is None:
             raise ValueError("Conversation not started")
-        messages = self.conv_retrieval_chain.memory.chat_memory.messages
-        serializable = messages_to_dict(messages)
+        answer = self._query_answer_cache(question)
+        if answer is not None:
+            yield answer
+        else:
+            response = yield from stream_chain(self.conv_retrieval_chain, {"question": question}, output_key="answer")
+            answer = self._cache_answer(question, response)
+        self._finish_turn(question, answer)
+
+    def _cache_answer(self, question, response):
+        """
+        Record the sources of a generated answer and add the answer to the answer cache
+        with its standalone (condensed) question.
+
+        :param question: the question asked
+        :param response: the output of the conversational retrieval chain
+        :return: the answer
+        """
+        answer = response["answer"]
+        self.last_sources_fingerprint = sources_fingerprint(response["source_documents"])
+        if self.answer_cache is not None:
+            self.answer_cache.add(response.get("generated_question", question), answer, self.last_sources_fingerprint)
+        return answer
+
+    def _finish_turn(self, question, answer):
+        """
+        Save the last turn to the conversation log and the catalog, and schedule the description update.
+
+        :param question: the question asked
+        :param answer: the answer of the turn
+        """
+        new_messages = self._save_memory_to_file(question, answer)
+        if self.version_num is not None:
+            get_catalog().update_conversation(self.conv_id, num_messages=self.num_messages)
+        self._update_conversation_description(new_messages)
+
+    def _query_answer_cache(self, question):
+        """
+        Look up a standalone question in the answer cache.
+        On a hit, the question and the cached answer are added to the conversation memory.
+
+        :param question: the question to ask
+        :return: the cached answer, or None if the question is not standalone or not cached
+        """
+        memory = self.conv_retrieval_chain.memory
+        if self.answer_cache is None or self.num_messages:
+            return None
+        cached = self.answer_cache.lookup(question)
+        if cached is None:
+            return None
+        memory.save_context({"question": question}, {"answer": cached["answer"]})
+        self.last_sources_fingerprint = cached["sources_fingerprint"]
+        return cached["answer"]
+
+    def get_messages(self, limit=None):
+        """
+        Get the messages of the conversation.
+
+        The messages are read from the conversation log, so the conversation does not have to be started.
+        With a limit, only the last messages are read, from the end of the log.
+
+        :param limit: the number of last messages to return, or None for all the messages
+        :return: the messages of the conversation
+        """
+        messages = messages_from_dict(self.log.read_all() if limit is None else self.log.read_tail(limit))
+        self.log.maybe_compact()
         return messages
 
-    def _save_memory_to_file(self):
+    def _save_memory_to_file(self, question, answer):
         """
-        Save the memory of the conversation to a file.
+        Append the messages of the last turn (the question and the answer) to the conversation log.
 
+        The messages are built from the turn itself, not read from the memory: a summary buffer memory prunes the
+        turn it just saved when it exceeds its token budget, so the memory's last messages may not be the turn.
+
+        :param question: the question asked
+        :param answer: the answer of the turn
         :return: the messages saved
         """
-        memory = self.conv_retrieval_chain.memory
-        messages = memory.chat_memory.messages
-        serializable = messages_to_dict(messages)
-        with open(fr"{self.conv_dir}\memory.json", "w") as f:
-            json.dump(serializable, f)
+        serializable = messages_to_dict([HumanMessage(content=question), AIMessage(content=answer)])
+        self.log.append(serializable)
+        self.num_messages += len(serializable)
+        self._save_memory_summary()
         return serializable
 
-    def _update_conversation_description(self, messages):
+    def _save_memory_summary(self):
+        """
+        Save the rolling summary of the memory if it changed, with the number of messages it covers,
+        so a continued conversation does not summarize them again.
         """
-        Update the conversation description with the latest messages.
+        memory = self.conv_retrieval_chain.memory
+        summary = getattr(memory, "moving_summary_buffer", None)
+        if summary is None or summary == self.memory_summary["summary"]:
+            return
+        self.memory_summary = {
+            "summary": summary,
+            "summarized_messages": self.num_messages - len(memory.chat_memory.messages),
+        }
+        save_dict(self.memory_summary, fr"{self.conv_dir}\memory_summary")
 
-        :param messages: the messages of the conversation
-        :return: None
+    def _update_conversation_description(self, new_messages):
         """
-        text_blocks = [msg['type'] + ": " + msg['data']['content'] for msg in messages]
-        full_text = "\n".join(text_blocks)
+        Schedule an update of the conversation description with the latest messages.
+
+        The description is updated incrementally by the background description summarizer,
+        so the response is never delayed by the summarization.
 
-        description = summarize(full_text)
-        load_conv_meta = load_dict(fr"{self.conv_dir}\conv_meta")
-        load_conv_meta['description'] = description
-        save_dict(load_conv_meta, fr"{self.conv_dir}\conv_meta")
+        :param new_messages: the messages of the last turn
+        :return: None
+        """
+        get_description_summarizer().notify(self.conv_dir, new_messages, self.num_messages)
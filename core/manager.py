@@ -2,19 +2,18 @@ import os
 
 from dotenv import load_dotenv, find_dotenv
 from huggingface_hub import login
-from openai import OpenAI
 
 from core.version import Version
+from core.version_pool import VersionPool
 from config import settings
-from DataLayer.data_module import init_date_dir, save_dict, load_dict
+from DataLayer.catalog import get_catalog
+from DataLayer.data_module import init_date_dir, save_dict, load_dict, is_date_dir_complete, get_interrupted_date_dirs
 
 
 def init_env():
     try:
         _ = load_dotenv(find_dotenv())
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
         login(token=settings.HF_TOKEN)
-        return client
     except Exception as e:
         print(e)
 
@@ -28,6 +27,7 @@ class Manager:
     Attributes:
         current_version (Version): The current version being managed.
         data_dir (str): The directory where all versions are stored.
+        versions (VersionPool): The recently used versions, kept loaded so switching between them is instant.
     """
 
     def __init__(self):
@@ -36,12 +36,14 @@ class Manager:
         # self.current_conv_id = None
         # self.retriever = None
         self.data_dir = settings.DATA_DIR
+        self.versions = VersionPool(self.data_dir, is_in_use=lambda version: version is self.current_version)
         init_env()
 
     def init_version(self, version_num: str, source_path: str) -> str:
         """Initialize a new version with source documents"""
         self.current_version = Version(version_num, self.data_dir)
         self.current_version.init_vector_store(source_path)
+        self.versions.add(self.current_version)
 
         return self.current_version.date_path
 
@@ -50,7 +52,8 @@ class Manager:
         Ensure a version is selected.
 
         If version_num is None, it uses the current version if it exists.
-        If version_num is not None, it uses the specified version if it exists.
+        If version_num is not None, it uses the specified version if it exists, taken from the version pool
+        (loaded from disk only if it is not in the pool).
         If no version is selected, it raises an error.
         """
         if version_num is None and self.current_version is None:
@@ -58,9 +61,7 @@ class Manager:
         use_current_version_no_arg = version_num is None and self.current_version is not None
         use_current_version_arg = self.current_version is not None and self.current_version.version_num == version_num
         if not (use_current_version_no_arg or use_current_version_arg):
-            # try to load different conversation #version_num != self.current_version.version_num:
-            self.current_version = Version(version_num, self.data_dir)
-            self.current_version.load_vector_store()  # loads latest vector store
+            self.current_version = self.versions.get(version_num)  # latest vector store
 
     def start_conversation(self, version_num: str = None):
         """
@@ -103,6 +104,18 @@ class Manager:
 
         return self.current_version.query(question)
 
+    def stream_query(self, question: str):
+        """
+        Ask a question in the current conversation and stream the answer.
+
+        :param question: The question to ask.
+        :return: A generator of the tokens of the response.
+        """
+        if not self.current_version:
+            raise ValueError("No version selected")
+
+        return self.current_version.stream_query(question)
+
     def get_messages(self, version_num=None, conv_id=None):
         """
         Get the messages of the current conversation.
@@ -115,68 +128,48 @@ class Manager:
         :param conv_id: The conversation ID to get the messages of.
         :return: The messages of the conversation.
         """
-        self._ensure_version_selected(version_num)
+        if version_num is None or (self.current_version and self.current_version.version_num == version_num):
+            self._ensure_version_selected(version_num)
+            version = self.current_version
+        else:
+            # Reading another version's conversation does not change the current version
+            with self.versions.lease(version_num) as version:
+                return version.get_messages(conv_id)
         if conv_id is None:
-            return self.current_version.get_messages()
+            return version.get_messages()
         else:
-            return self.current_version.get_messages(conv_id)
+            return version.get_messages(conv_id)
 
-    def _list_data(self, include_convs=False):
+    def list_conversations(self, version_num=None, limit=None, offset=0):
         """
-        Return a list of dictionaries with information about the versions.
+        Return a list of dictionaries with information about the conversations, most recently updated first.
 
         The list contains dictionaries with the following keys:
             - version (str): The version of the experiment.
             - source_path (str): The path to the source files of the experiment.
-
-        If include_convs is True, the dictionaries also contain a key 'convs' with a list of conversation IDs.
-
-        :param include_convs: If True, include the conversation IDs in the returned dictionaries.
-        :return: A list of dictionaries with information about the versions.
-        """
-        data = []
-        for version_name in os.listdir(self.data_dir):
-            if not version_name.startswith("v_"):
-                continue
-            version_path = fr"{self.data_dir}\{version_name}"
-            for date in os.listdir(version_path):
-                date_path = fr"{version_path}\{date}"
-                vector_store_meta = load_dict(fr"{date_path}\vector_store_meta")
-                source_path = vector_store_meta["source_path"]
-
-                data_dict = {"version": version_name[2:], "source_path": source_path}
-                if include_convs:
-                    convs_paths = os.listdir(fr"{date_path}\convs")
-                    for conv_path in convs_paths:
-                        conv_meta = load_dict(fr"{date_path}\convs\{conv_path}\conv_meta")
-                        data_dict["conv_id"] = conv_meta["id"]
-                        data_dict["description"] = conv_meta["description"]
-                data.append(data_dict)
-        return data
-
-    def list_conversations(self):
-        """
-        Return a list of dictionaries with information about the conversations in the selected version.
-
-        The list contains dictionaries with the following keys:
             - conv_id (str): The conversation ID.
             - description (str): A short description of the conversation.
 
+        :param version_num: The version of the conversations. If None, the conversations of all versions are listed.
+        :param limit: The maximal number of conversations to return. If None, all the conversations are returned.
+        :param offset: The number of conversations to skip.
         :return: A list of dictionaries with information about the conversations.
         """
-        return self._list_data(include_convs=True)
+        return get_catalog().list_conversations(version_num, limit=limit, offset=offset)
 
-    def list_versions(self):
+    def list_versions(self, limit=None, offset=0):
         """
         Return a list of dictionaries with information about the versions.
 
         The list contains dictionaries with the following keys:
             - version (str): The version of the experiment.
-            - source_path (str): The path to the source files of the experiment.
+            - source_path (str): The path to the source files of the latest vector store of the version.
 
+        :param limit: The maximal number of versions to return. If None, all the versions are returned.
+        :param offset: The number of versions to skip.
         :return: A list of dictionaries with information about the versions.
         """
-        return self._list_data(include_convs=False)
+        return get_catalog().list_versions(limit=limit, offset=offset)
 
     def update_vector_store(self, version_num: str = None):
         """
@@ -189,3 +182,52 @@ class Manager:
         self._ensure_version_selected(version_num)
 
         self.current_version.update_vector_store()
+        self.versions.add(self.current_version)
+
+    def watch_source(self, version_num: str = None):
+        """
+        Watch the source path of the specified version and apply its changes to the live vector store.
+        Blocks until interrupted (Ctrl+C).
+
+        If version_num is None, it watches the source path of the current version.
+
+        :param version_num: The version of the experiment. If None, use the current version.
+        """
+        self._ensure_version_selected(version_num)
+
+        self.current_version.watch_source()
+
+    def list_interrupted_builds(self):
+        """
+        Return a list of dictionaries with information about the interrupted vector store builds.
+
+        The list contains dictionaries with the following keys:
+            - version (str): The version of the experiment.
+            - date_path (str): The date directory of the interrupted build.
+
+        :return: A list of dictionaries with information about the interrupted builds.
+        """
+        data = []
+        for version_name in os.listdir(self.data_dir):
+            if not version_name.startswith("v_"):
+                continue
+            version_path = fr"{self.data_dir}\{version_name}"
+            for date_path in get_interrupted_date_dirs(version_path):
+                data.append({"version": version_name[2:], "date_path": date_path})
+        return data
+
+    def resume_build(self, version_num: str, date_path: str = None):
+        """
+        Resume an interrupted vector store build of the specified version.
+
+        The build continues from the last committed batch, and the version becomes the current version.
+
+        :param version_num: The version of the experiment.
+        :param date_path: The date directory of the build to resume. If None, the latest interrupted build is resumed.
+        :return: The path of the resumed date directory.
+        """
+        version = Version(version_num, self.data_dir)
+        date_path = version.resume_vector_store(date_path)
+        self.current_version = version
+        self.versions.add(version)
+        return date_path
@@ -0,0 +1,186 @@
+import threading
+from collections import OrderedDict
+
+from langchain_core.messages import messages_to_dict
+
+from DataLayer.catalog import get_catalog
+from LLMUtils.clients import client_stats, close_clients
+from core.manager import init_env
+from core.version_pool import VersionPool
+from config import settings
+
+
+class SessionManager:
+    """
+    Serve the conversations of many users at the same time, for the query server.
+
+    Unlike Manager, which has a single active version and conversation, the session manager keeps the vector stores
+    of the recently requested versions loaded (see VersionPool) and an LRU of open conversations, so concurrent
+    requests of different conversations run in parallel. The turns of a conversation are serialized with a
+    per-conversation lock. All the methods are thread-safe.
+    Versions with a conversation in progress are not evicted from the pool, and the open conversations of an evicted
+    version are closed.
+
+    Attributes:
+        data_dir (str): The directory where all versions are stored.
+        max_conversations (int): The maximal number of open conversations. The least recently used idle
+            conversations are closed (and reopened from their logs when needed).
+        versions (VersionPool): The loaded versions.
+    """
+
+    def __init__(self, max_conversations=settings.SERVER_MAX_CONVERSATIONS):
+        self.data_dir = settings.DATA_DIR
+        self.max_conversations = max_conversations
+        init_env()
+
+        self._lock = threading.Lock()
+        self._conversations = OrderedDict()
+        self._conversation_locks = {}
+        self.versions = VersionPool(self.data_dir, is_in_use=self._is_version_busy)
+        self.versions.add_evict_hook(self._close_version_conversations)
+
+    def _is_version_busy(self, version):
+        """
+        :return: Whether a conversation of the version's vector store is in progress.
+        """
+        with self._lock:
+            return any(conv.date_path == version.date_path and self._conversation_locks[conv_id].locked()
+                       for conv_id, conv in self._conversations.items() if conv_id in self._conversation_locks)
+
+    def _close_version_conversations(self, version):
+        """
+        Close the open conversations of an evicted version's vector store.
+        """
+        with self._lock:
+            conv_ids = [conv_id for conv_id, conv in self._conversations.items() if conv.date_path == version.date_path]
+            for conv_id in conv_ids:
+                self._conversations.pop(conv_id).log.sync()
+
+    def _conversation_lock(self, conv_id):
+        with self._lock:
+            return self._conversation_locks.setdefault(conv_id, threading.Lock())
+
+    def _add_conversation(self, conv):
+        """
+        Add an opened conversation to the LRU of open conversations, closing the least recently used idle ones.
+        """
+        with self._lock:
+            self._conversations[conv.conv_id] = conv
+            self._conversations.move_to_end(conv.conv_id)
+            for conv_id in list(self._conversations):
+                if len(self._conversations) <= self.max_conversations:
+                    break
+                conv_lock = self._conversation_locks.get(conv_id)
+                if conv_id == conv.conv_id or (conv_lock is not None and conv_lock.locked()):
+                    continue
+                self._conversations.pop(conv_id).log.sync()
+
+    def _get_conversation(self, conv_id):
+        """
+        Return an open conversation, opening it from its log if needed. Must be called while holding the
+        conversation's lock.
+
+        :param conv_id: The conversation ID.
+        :return: The conversation.
+        """
+        with self._lock:
+            conv = self._conversations.get(conv_id)
+            if conv is not None:
+                self._conversations.move_to_end(conv_id)
+                return conv
+        conv_info = get_catalog().get_conversation(conv_id)
+        if conv_info is None:
+            with self._lock:
+                self._conversation_locks.pop(conv_id, None)
+            raise KeyError(f"Conversation {conv_id} not found")
+        # The lease keeps the version loaded until the conversation is added, and its lock protects it
+        with self.versions.lease(conv_info["version"]) as version:
+            if conv_info["date_path"] != version.date_path:
+                raise ValueError(f"Conversation {conv_id} belongs to an older vector store of version "
+                                 f"{conv_info['version']} and cannot be continued")
+            conv = version.open_conversation(conv_id)
+            self._add_conversation(conv)
+        return conv
+
+    def start_conversation(self, version_num):
+        """
+        Start a new conversation in a version.
+
+        :param version_num: The version of the experiment.
+        :return: The conversation ID.
+        """
+        with self.versions.lease(version_num) as version:
+            conv = version.open_conversation()
+            self._add_conversation(conv)
+        return conv.conv_id
+
+    def query(self, conv_id, question):
+        """
+        Ask a question in a conversation. Waits for the previous turn of the conversation to complete.
+
+        :param conv_id: The conversation ID.
+        :param question: The question to ask.
+        :return: The response of the conversation.
+        """
+        with self._conversation_lock(conv_id):
+            return self._get_conversation(conv_id).query(question)
+
+    def stream_query(self, conv_id, question):
+        """
+        Ask a question in a conversation and stream the answer. The conversation is locked until the stream
+        is consumed.
+
+        :param conv_id: The conversation ID.
+        :param question: The question to ask.
+        :return: A generator of the tokens of the response.
+        """
+        with self._conversation_lock(conv_id):
+            yield from self._get_conversation(conv_id).stream_query(question)
+
+    def get_messages(self, conv_id, limit=None):
+        """
+        Get the messages of a conversation.
+
+        :param conv_id: The conversation ID.
+        :param limit: The number of last messages to return, or None for all the messages.
+        :return: The messages of the conversation, as dictionaries.
+        """
+        with self._conversation_lock(conv_id):
+            return messages_to_dict(self._get_conversation(conv_id).get_messages(limit))
+
+    def list_versions(self, limit=None, offset=0):
+        """
+        :return: A list of dictionaries with information about the versions (see Manager.list_versions).
+        """
+        return get_catalog().list_versions(limit=limit, offset=offset)
+
+    def list_conversations(self, version_num=None, limit=None, offset=0):
+        """
+        :return: A list of dictionaries with information about the conversations (see Manager.list_conversations).
+        """
+        return get_catalog().list_conversations(version_num, limit=limit, offset=offset)
+
+    def stats(self):
+        """
+        :return: A dictionary with the loaded versions, the number of open and busy conversations and the statistics
+            of the shared OpenAI clients (see clients.client_stats).
+        """
+        with self._lock:
+            stats = {
+                "open_conversations": len(self._conversations),
+                "busy_conversations": sum(lock.locked() for lock in self._conversation_locks.values()),
+            }
+        stats.update(self.versions.stats())
+        stats["clients"] = client_stats()
+        return stats
+
+    def close(self):
+        """
+        Flush the logs of the open conversations, close the loaded versions and the shared OpenAI clients.
+        """
+        with self._lock:
+            for conv in self._conversations.values():
+                conv.log.sync()
+            self._conversations.clear()
+        self.versions.close()
+        close_clients()
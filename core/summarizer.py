@@ -0,0 +1,144 @@
+import atexit
+import threading
+import time
+
+from DataLayer.catalog import get_catalog
+from DataLayer.data_module import save_dict, load_dict
+from LLMUtils.rag import summarize_incremental
+
+from config import settings
+
+
+class DescriptionSummarizer:
+    """
+    Background worker that keeps the conversations' descriptions up to date, off the chat's critical path.
+
+    Conversations notify the worker after every turn. A conversation's description is updated once it has
+    every_n_turns new turns, or once it has been idle for idle_seconds. The update is incremental: the previous
+    description is updated with only the messages that were not summarized yet, and stays a bounded one-line title
+    (see summarize_incremental).
+    Pending updates are flushed when the process exits.
+
+    Attributes:
+        every_n_turns (int): Number of new turns after which a description is updated.
+        idle_seconds (float): Idle time after which a description with new turns is updated.
+    """
+    def __init__(self, every_n_turns, idle_seconds):
+        self.every_n_turns = every_n_turns
+        self.idle_seconds = idle_seconds
+
+        self._pending = {}  # conv_dir -> {"messages": [...], "total": int, "turns": int, "last_turn": float}
+        self._condition = threading.Condition()
+        self._summarize_lock = threading.Lock()  # one description update at a time
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="description-summarizer")
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def notify(self, conv_dir, new_messages, num_messages):
+        """
+        Notify the worker that a conversation has a new turn. Never blocks on the LLM.
+
+        :param conv_dir: the directory of the conversation
+        :param new_messages: the (serialized) messages of the new turn
+        :param num_messages: the number of messages of the conversation, including the new ones
+        """
+        with self._condition:
+            self._ensure_started()
+            pending = self._pending.setdefault(conv_dir, {"messages": [], "total": 0, "turns": 0, "last_turn": 0})
+            pending["messages"].extend(new_messages)
+            pending["total"] = num_messages
+            pending["turns"] += 1
+            pending["last_turn"] = time.monotonic()
+            self._condition.notify()
+
+    def flush(self, conv_dir=None):
+        """
+        Update the pending descriptions now, in the calling thread.
+
+        :param conv_dir: the directory of the conversation to flush. If None, all pending conversations are flushed.
+        """
+        with self._condition:
+            conv_dirs = [conv_dir] if conv_dir is not None else list(self._pending)
+            due = [(d, self._pending.pop(d)) for d in conv_dirs if d in self._pending]
+        self._summarize_all(due)
+
+    def _summarize_all(self, due):
+        for conv_dir, pending in due:
+            try:
+                self._summarize(conv_dir, pending["messages"], pending["total"])
+            except Exception as e:
+                print(f"Failed to update the description of {conv_dir}. Error: {str(e)}")
+
+    def _pop_due(self):
+        """
+        Pop the conversations whose description is due. Must be called while holding the condition.
+
+        :return: tuple of (list of (conv_dir, pending turns), seconds until the next conversation becomes due or None)
+        """
+        now = time.monotonic()
+        due, next_due = [], None
+        for conv_dir, pending in list(self._pending.items()):
+            idle_due = pending["last_turn"] + self.idle_seconds
+            if pending["turns"] >= self.every_n_turns or now >= idle_due:
+                due.append((conv_dir, self._pending.pop(conv_dir)))
+            else:
+                next_due = idle_due - now if next_due is None else min(next_due, idle_due - now)
+        return due, next_due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due, next_due = self._pop_due()
+                while not due:
+                    self._condition.wait(timeout=next_due)
+                    due, next_due = self._pop_due()
+            self._summarize_all(due)
+
+    def _summarize(self, conv_dir, messages, num_messages):
+        """
+        Extend the conversation's description with the messages that were not summarized yet.
+
+        :param conv_dir: the directory of the conversation
+        :param messages: the last (serialized) messages of the conversation
+        :param num_messages: the number of messages of the conversation
+        """
+        with self._summarize_lock:
+            self._summarize_new_messages(conv_dir, messages, num_messages)
+
+    @staticmethod
+    def _summarize_new_messages(conv_dir, messages, num_messages):
+        conv_meta = load_dict(fr"{conv_dir}\conv_meta")
+        summarized = conv_meta.get("summarized_messages", 0)
+        first_index = num_messages - len(messages)
+        new_messages = messages[max(0, summarized - first_index):]
+        if not new_messages:
+            return
+        new_text = "\n".join(msg['type'] + ": " + msg['data']['content'] for msg in new_messages)
+        previous_description = conv_meta["description"] if summarized > 0 else ""
+        description = summarize_incremental(previous_description, new_text)
+
+        conv_meta = load_dict(fr"{conv_dir}\conv_meta")
+        conv_meta["description"] = description
+        conv_meta["summarized_messages"] = num_messages
+        save_dict(conv_meta, fr"{conv_dir}\conv_meta")
+        get_catalog().update_conversation(conv_meta["id"], description=description)
+
+
+_summarizer = None
+
+
+def get_description_summarizer():
+    """
+    Return the process-wide description summarizer, configured from the settings.
+
+    :return: DescriptionSummarizer
+    """
+    global _summarizer
+    if _summarizer is None:
+        _summarizer = DescriptionSummarizer(every_n_turns=settings.SUMMARY_EVERY_N_TURNS,
+                                            idle_seconds=settings.SUMMARY_IDLE_SECONDS)
+    return _summarizer
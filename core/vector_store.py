@@ -1,6 +1,15 @@
-from DataLayer.data_module import list_files, create_dir, save_dict, load_dict, get_changed_files
-from DataLayer.data_process import load_docs_chunks
-from LLMUtils.vector_store_utils import create_vector_store, load_vector_store
+import os
+import threading
+
+from DataLayer.build_journal import BuildJournal
+from DataLayer.data_module import list_files, create_dir, save_dict, load_dict, delete_date_dir, is_date_dir_complete
+from DataLayer.file_scanner import diff_files, stat_file
+from DataLayer.data_process import iter_docs_chunks, iter_chunk_batches, prefetch
+from LLMUtils.vector_store_utils import load_vector_store, get_chunk_ids, group_ids_by_source, copy_vector_store, \
+    update_vector_store, delete_from_vector_store, get_embedding_model_name, get_query_retriever, get_query_embedder, \
+    load_sparse_index, backfill_sparse_index, get_hybrid_retriever, count_vectors, persist_vector_store, \
+    close_vector_store, get_vector_store_size
+from LLMUtils.answer_cache import AnswerCache
 from LLMUtils.compression import get_compression_retriever
 
 from config import settings
@@ -19,42 +28,182 @@ class VectorStore:
         self.source_path = None
         self.vector_store = None
         self.vector_store_path = None
+        self._journal = BuildJournal(date_path)
+        self._answer_cache = None
+        self._sparse_index = None
+        self._update_lock = threading.Lock()
 
-    def _create_vector_store(self, docs):
+    def _create_vector_store(self, files_paths):
         """
-        Create a vector store from a list of documents.
+        Create a vector store from a list of files.
 
-        The documents are split into chunks and processed in parallel using joblib.
-        The vector store is created from the document chunks and it is persisted to disk.
+        The build is recorded in the build journal of the date directory and then run, so it can be resumed
+        if it is interrupted.
         The vector store path is saved to a file in the data directory.
+
+        :param files_paths: The paths of the files to load.
+        """
+        self._journal.record("start", mode="full", source_path=self.source_path, files=list(files_paths))
+        self._run_build()
+
+    def _run_build(self):
+        """
+        Run the build recorded in the build journal, skipping the steps that were already committed.
+
+        For a full build, the files are streamed into a new vector store.
+        For an incremental build, the previous vector store is copied, so the vectors of unchanged files are
+        carried forward without re-embedding, the chunks of changed and deleted files are deleted from the copy,
+        and the changed files are streamed into it.
+        Files of batches that were already written are not loaded again.
         """
+        state = self._journal.get_state()
+        start = state["start"]
+        self.source_path = start["source_path"]
         self.vector_store_path = fr"{self.date_path}\vector_store"
-        create_dir(self.vector_store_path)
-        self.vector_store = create_vector_store(save_path=self.vector_store_path, docs=docs)
+
+        if start["mode"] == "incremental":
+            prev_date_path = start["prev_date_path"]
+            chunks_manifest = VectorStore(prev_date_path).get_chunks_manifest()
+            stale_ids = [chunk_id for file_path in [*start["changed_files"], *start["deleted_files"]]
+                         for chunk_id in chunks_manifest.pop(file_path, [])]
+            if "copied" not in state["events"]:
+                delete_date_dir(self.vector_store_path)  # partial copy of an interrupted build
+                copy_vector_store(fr"{prev_date_path}\vector_store", self.vector_store_path)
+                self._journal.record("copied")
+            self.vector_store = load_vector_store(self.vector_store_path)
+            if "stale_deleted" not in state["events"]:
+                self._ensure_sparse_index()
+                self._delete_chunks(stale_ids)
+                self._journal.record("stale_deleted")
+            files_paths = start["changed_files"]
+        else:
+            chunks_manifest = {}
+            if not os.path.exists(self.vector_store_path):
+                create_dir(self.vector_store_path)
+            self.vector_store = load_vector_store(self.vector_store_path)
+            files_paths = start["files"]
+
+        chunks_manifest.update(state["chunks_manifest"])
+        remaining_files = [file_path for file_path in files_paths if file_path not in state["done_files"]]
+        if len(remaining_files) < len(files_paths):
+            print(f"Resuming build: {len(files_paths) - len(remaining_files)} of {len(files_paths)} files already written")
+        chunks_manifest = self._ingest(remaining_files, chunks_manifest)
+        self._save_chunks_manifest(chunks_manifest)
+        self._save_vector_store_meta()
+        self._journal.record("complete")
+
+    def _ingest(self, files_paths, chunks_manifest, record_batches=True):
+        """
+        Stream the given files into the vector store.
+
+        Files are loaded and chunked one by one and grouped into batches of about settings.INGEST_BATCH_SIZE chunks.
+        Each batch is embedded and written to the vector store and its sparse index (and so persisted) before the
+        next one, while the
+        following batches are loaded in the background, so memory stays bounded regardless of the number of files.
+        Every written batch is committed to the build journal, unless record_batches is False.
+
+        :param files_paths: The paths of the files to load.
+        :param chunks_manifest: The chunks manifest to update with the IDs of the written chunks.
+        :param record_batches: Whether to record the written batches in the build journal.
+        :return: The updated chunks manifest.
+        """
+        num_chunks = 0
+        batches = prefetch(iter_chunk_batches(iter_docs_chunks(files_paths)))
+        for batch_files, batch_docs in batches:
+            ids = get_chunk_ids(batch_docs)
+            if batch_docs:
+                update_vector_store(self.vector_store, batch_docs, ids=ids)
+                self._get_sparse_index().add_documents(batch_docs, ids)
+            batch_chunks = group_ids_by_source(batch_docs, ids)
+            if record_batches:
+                self._journal.record("batch", files=batch_files, chunks=batch_chunks)
+            chunks_manifest.update(batch_chunks)
+            num_chunks += len(batch_docs)
+        persist_vector_store(self.vector_store)
+        print(f"Wrote {num_chunks} chunks to the vector store")
+        return chunks_manifest
+
+    def _delete_chunks(self, ids):
+        """
+        Delete chunks from the vector store and its sparse index.
+
+        :param ids: The IDs of the chunks to delete.
+        """
+        delete_from_vector_store(self.vector_store, ids)
+        self._get_sparse_index().delete(ids)
+
+    def _get_sparse_index(self):
+        """
+        Return the BM25 index of the vector store's chunks, stored in the vector store directory,
+        so it is carried forward with the vector store when it is copied by an incremental build.
+
+        :return: The sparse index.
+        """
+        if self._sparse_index is None:
+            self._sparse_index = load_sparse_index(self.vector_store_path)
+        return self._sparse_index
+
+    def _ensure_sparse_index(self):
+        """
+        Return the sparse index, indexing the chunks of the vector store first if it is empty
+        (vector stores created before the sparse index existed).
+
+        :return: The sparse index.
+        """
+        sparse_index = self._get_sparse_index()
+        if sparse_index.count() == 0 and count_vectors(self.vector_store) > 0:
+            print("Vector store has no sparse index - indexing its chunks")
+            backfill_sparse_index(self.vector_store, sparse_index)
+        return sparse_index
+
+    def _save_vector_store_meta(self):
+        """
+        Save the vector store metadata (the source path and the embedding model) to a file in the date directory.
+        """
         vector_store_meta = {
             "source_path": self.source_path,
+            "embedding_model": get_embedding_model_name(),
         }
         save_dict(vector_store_meta, fr"{self.date_path}\vector_store_meta")
 
+    def _save_chunks_manifest(self, chunks_manifest):
+        """
+        Save the chunks manifest to a file in the date directory.
+
+        :param chunks_manifest: dictionary of source file paths and the IDs of their chunks in the vector store.
+        """
+        save_dict(chunks_manifest, fr"{self.date_path}\chunks_manifest")
+
+    def get_chunks_manifest(self):
+        """
+        Return the chunks manifest of the vector store.
+
+        The chunks manifest is a dictionary of source file paths and the IDs of their chunks in the vector store.
+        Vector stores created before chunk IDs were introduced have no manifest.
+
+        :return: The chunks manifest of the vector store, or None if it does not exist.
+        """
+        chunks_manifest_path = fr"{self.date_path}\chunks_manifest"
+        if not os.path.exists(f"{chunks_manifest_path}.json"):
+            return None
+        return load_dict(chunks_manifest_path)
+
     def create_vector_store_from_path(self, source_path: str) -> str:
         """
         Create a vector store from a given source path.
 
-        The source path is scanned for files and a list of documents is created.
-        The documents are processed in parallel using joblib and the vector store is created.
+        The source path is scanned for files, and the files are streamed into a new vector store.
         The vector store path is saved to a file in the data directory.
 
         :param source_path: The path to the source files.
         :return: The path of the vector store.
         """
         self.source_path = source_path
-        # Process documents
         files_details_path = fr"{self.date_path}\files_details"
         source_files_details = list_files(source_path, save_path=files_details_path)
-        docs = load_docs_chunks(source_files_details.keys())
 
         # Create vector store
-        self._create_vector_store(docs)
+        self._create_vector_store(source_files_details.keys())
         return self.vector_store_path
 
     def create_vector_store_from_other(self, other_vector_store):
@@ -62,9 +211,12 @@ class VectorStore:
         Create a vector store from an existing vector store.
 
         The existing vector store is queried for the source path and the files details.
-        The source path is scanned for changed files and a list of documents is created.
-        The documents are processed in parallel using joblib and the vector store is created.
-        The vector store path is saved to a file in the data directory.
+        The source path is scanned, and compared to the previous files details for added, modified, deleted
+        and renamed files (see diff_files).
+        The existing vector store is copied, so the vectors of unchanged files are carried forward without
+        re-embedding. The chunks of changed and deleted files are deleted from the copy, and the chunks of the
+        changed files are loaded and added to it.
+        If the existing vector store has no chunks manifest, the vector store is rebuilt from all source files.
 
         :param other_vector_store: The vector store to create from.
         :return: The path of the vector store.
@@ -72,23 +224,113 @@ class VectorStore:
         self.source_path = other_vector_store.source_path
         prev_files_details = other_vector_store.get_files_details()
 
-        files_details_path = fr"{self.date_path}\files_details"
-        source_files_details = list_files(self.source_path, save_path=files_details_path)
+        source_files_details = list_files(self.source_path)
+        files_diff = diff_files(source_files_details, prev_files_details, num_workers=settings.SCAN_WORKERS)
+        # The content hashes computed by the diff are saved for the next update
+        save_dict(source_files_details, fr"{self.date_path}\files_details")
+        print(f"Source changes: {len(files_diff['added'])} added, {len(files_diff['modified'])} modified, "
+              f"{len(files_diff['deleted'])} deleted, {len(files_diff['renamed'])} renamed")
 
-        changed_files = get_changed_files(source_files_details, prev_files_details=prev_files_details)
-        if len(changed_files) == 0:
+        # Chunks are keyed by their source path, so renamed files are re-indexed under their new path
+        changed_files = files_diff["added"] + files_diff["modified"] + [curr for _, curr in files_diff["renamed"]]
+        deleted_files = files_diff["deleted"] + [prev for prev, _ in files_diff["renamed"]]
+        if len(changed_files) == 0 and len(deleted_files) == 0:
             raise ValueError("No changed files found in source path. No need to update vector store")
-        docs = load_docs_chunks(changed_files)
 
-        # Create vector store
-        self._create_vector_store(docs)
+        if other_vector_store.get_chunks_manifest() is None:
+            print("Previous vector store has no chunks manifest - rebuilding from all source files")
+            self._create_vector_store(source_files_details.keys())
+            return self.vector_store_path
+
+        # Carry the previous vectors forward and apply the changes
+        self._journal.record("start", mode="incremental", source_path=self.source_path,
+                             prev_date_path=other_vector_store.date_path,
+                             changed_files=changed_files, deleted_files=deleted_files)
+        self._run_build()
+        return self.vector_store_path
+
+    def resume_build(self):
+        """
+        Resume an interrupted build of the vector store from the last batch committed to the build journal.
+
+        :return: The path of the vector store.
+        """
+        if not self._journal.exists():
+            raise ValueError(f"No build journal found in {self.date_path}. Cannot resume the build.")
+        if is_date_dir_complete(self.date_path):
+            raise ValueError(f"The build of {self.date_path} is already complete.")
+        self._run_build()
         return self.vector_store_path
 
+    def apply_changes(self, changed_files, deleted_files):
+        """
+        Apply source changes to the loaded vector store in place, without creating a new date directory.
+
+        The chunks of the changed and deleted files are deleted, the changed files are loaded and added, and the
+        chunks manifest and the files details are updated. The answer cache is cleared, as its answers may rely on
+        the replaced chunks.
+        The update is recorded in the build journal before the vector store is changed and once the manifests are
+        saved, so an interrupted update is applied again when the vector store is loaded (see recover_update).
+
+        :param changed_files: The paths of the added or modified files.
+        :param deleted_files: The paths of the deleted files.
+        :return: dictionary of the changed files and their details.
+        """
+        if self.vector_store is None:
+            raise ValueError("Vector store is not initialized. Please create or load a vector store first.")
+        with self._update_lock:
+            chunks_manifest = self.get_chunks_manifest()
+            if chunks_manifest is None:
+                raise ValueError("Vector store has no chunks manifest and cannot be updated in place. "
+                                 "Update the vector store to rebuild it.")
+            self._journal.record("update", changed_files=list(changed_files), deleted_files=list(deleted_files))
+            stale_ids = [chunk_id for file_path in [*changed_files, *deleted_files]
+                         for chunk_id in chunks_manifest.pop(file_path, [])]
+            self._ensure_sparse_index()
+            self._delete_chunks(stale_ids)
+            chunks_manifest = self._ingest(changed_files, chunks_manifest, record_batches=False)
+            self._save_chunks_manifest(chunks_manifest)
+
+            files_details = self.get_files_details()
+            for file_path in deleted_files:
+                files_details.pop(file_path, None)
+            changed_details = {file_path: stat_file(file_path) for file_path in changed_files}
+            changed_details = {file_path: details for file_path, details in changed_details.items() if details}
+            files_details.update(changed_details)
+            save_dict(files_details, fr"{self.date_path}\files_details")
+            self._journal.record("updated")
+
+            if self._answer_cache is not None:
+                self._answer_cache.clear()
+        return changed_details
+
+    def recover_update(self):
+        """
+        Apply again an in-place update that was interrupted (see apply_changes), so the vector store matches its
+        chunks manifest and files details. Chunk IDs are stable, so the chunks written before the interruption are
+        replaced.
+
+        :return: tuple of (dictionary of the changed files and their details, list of the deleted files),
+            or None if no update was interrupted.
+        """
+        if not self._journal.exists():
+            return None
+        pending_update = self._journal.get_state()["pending_update"]
+        if pending_update is None:
+            return None
+        changed_files, deleted_files = pending_update["changed_files"], pending_update["deleted_files"]
+        print(f"Re-applying an interrupted update of {len(changed_files) + len(deleted_files)} files")
+        # Files deleted since the interruption are deleted from the vector store instead
+        existing_files = [file_path for file_path in changed_files if os.path.exists(file_path)]
+        deleted_files = [*deleted_files, *(file_path for file_path in changed_files if file_path not in existing_files)]
+        return self.apply_changes(existing_files, deleted_files), deleted_files
+
     def get_files_details(self):
         """
         Return the files details of the vector store.
 
-        The files details is a dictionary of file paths and their last modified time.
+        The files details is a dictionary of file paths and their details (size, modification time, inode and
+        content hash). Vector stores created by older versions store only the ISO modification time.
 
         :return: The files details of the vector store.
         """
@@ -106,30 +348,94 @@ class VectorStore:
 
         :return: The path of the vector store.
         """
-        self.source_path = load_dict(fr"{self.date_path}\vector_store_meta")["source_path"]
+        vector_store_meta = load_dict(fr"{self.date_path}\vector_store_meta")
+        self.source_path = vector_store_meta["source_path"]
+        embedding_model = vector_store_meta.get("embedding_model")
+        if embedding_model is not None and embedding_model != get_embedding_model_name():
+            raise ValueError(f"Vector store was built with the embedding model '{embedding_model}' but the settings "
+                             f"select '{get_embedding_model_name()}'. Change the settings or create a new version.")
 
         self.vector_store_path = fr"{self.date_path}\vector_store"
         self.vector_store = load_vector_store(self.vector_store_path)
         return self.vector_store_path
 
-    def get_retriever(self, search_type=settings.SEARCH_TYPE, compress=settings.COMPRESS_QUERY):
+    def get_size(self):
+        """
+        Return the size of the vector store files, an estimate of the memory the loaded vector store takes.
+
+        :return: The size in bytes, or 0 if no vector store is loaded.
+        """
+        if self.vector_store_path is None or not os.path.exists(self.vector_store_path):
+            return 0
+        return get_vector_store_size(self.vector_store_path)
+
+    def close(self):
+        """
+        Close the vector store, its BM25 index and its answer cache, releasing their files and memory.
+        The vector store has to be loaded again to be used.
+        """
+        with self._update_lock:
+            if self._answer_cache is not None:
+                self._answer_cache.close()
+                self._answer_cache = None
+            if self._sparse_index is not None:
+                self._sparse_index.close()
+                self._sparse_index = None
+            if self.vector_store is not None:
+                close_vector_store(self.vector_store)
+                self.vector_store = None
+
+    def get_retriever(self, search_type=settings.SEARCH_TYPE, compress=settings.COMPRESS_QUERY,
+                      hybrid=settings.HYBRID_SEARCH, search_kwargs=None):
         """
         Get a retriever from a vector store based on the settings.
 
         The vector store path is saved to a file in the data directory.
         The vector store is loaded from the vector store path.
-        A retriever is created from the vector store.
+        A retriever is created from the vector store. Queries are embedded through the query embedding cache.
         The type of search to perform is determined by the settings.
+        If hybrid is True, the search is fused with a BM25 search of the vector store's sparse index. Vector stores
+        created before the sparse index existed are indexed on first use.
         If compress is True, the retriever is wrapped in a CompressionRetriever.
+        MMR searches select the documents from candidates fetched with their stored embeddings, so the candidates
+        are not re-embedded. The search arguments (k, fetch_k, lambda_mult) default to the settings, and can also be
+        passed to the retriever's invoke for a single query.
 
         :param search_type: type of search to perform (default: settings.SEARCH_TYPE)
         :param compress: whether to compress retrieved documents (default: settings.COMPRESS_QUERY)
+        :param hybrid: whether to fuse the search with a BM25 search (default: settings.HYBRID_SEARCH)
+        :param search_kwargs: keyword arguments of the search (e.g. k, fetch_k, lambda_mult) replacing the settings
         :return: retriever
         """
         if self.vector_store is None:
             raise ValueError("Vector store is not initialized. Please create or loada vector store first.")
-        retriever = self.vector_store.as_retriever(search_type=search_type)  # NOTE: OR SelfQueryRetriever
+        if hybrid:
+            retriever = get_hybrid_retriever(self.vector_store, self._ensure_sparse_index(), search_type=search_type,
+                                             search_kwargs=search_kwargs)
+        else:
+            retriever = get_query_retriever(self.vector_store, search_type=search_type,
+                                            search_kwargs=search_kwargs)  # NOTE: OR SelfQueryRetriever
 
         if compress:
             retriever = get_compression_retriever(retriever)
         return retriever
+
+    def get_answer_cache(self, threshold=settings.ANSWER_CACHE_THRESHOLD,
+                         max_entries=settings.ANSWER_CACHE_MAX_ENTRIES):
+        """
+        Get the semantic answer cache of the vector store.
+
+        The answer cache is stored in the date directory, so it only holds answers generated from this
+        vector store, and an update (which creates a new date directory) starts with an empty cache.
+
+        :param threshold: minimal cosine similarity for a cached answer to be returned (default: settings.ANSWER_CACHE_THRESHOLD)
+        :param max_entries: maximal number of cached answers (default: settings.ANSWER_CACHE_MAX_ENTRIES)
+        :return: the answer cache
+        """
+        if self.vector_store is None:
+            raise ValueError("Vector store is not initialized. Please create or load a vector store first.")
+        if self._answer_cache is None:
+            self._answer_cache = AnswerCache(fr"{self.date_path}\answer_cache.sqlite",
+                                             embedder=get_query_embedder(self.vector_store), threshold=threshold,
+                                             max_entries=max_entries)
+        return self._answer_cache
@@ -1,7 +1,14 @@
-from DataLayer.data_module import init_date_dir, get_prev_date_dir, delete_date_dir, get_convs_path, init_convs
+import os
+
+from DataLayer.catalog import get_catalog
+from DataLayer.source_watcher import SourceWatcher
+from DataLayer.data_module import init_date_dir, get_prev_date_dir, delete_date_dir, get_convs_path, init_convs, \
+    get_interrupted_date_dirs
+from LLMUtils.vector_store_utils import get_embedding_model_name
 
 from core.vector_store import VectorStore
 from core.conversation import Conversation
+from config import settings
 
 
 class Version:
@@ -23,6 +30,7 @@ class Version:
         self.date_path = None
         self.conv = None
         self.convs_path = None
+        self._retriever = None
 
     def init_vector_store(self, source_path):
         """
@@ -39,21 +47,89 @@ class Version:
         self.vectorstore = VectorStore(self.date_path)
         self.vectorstore.create_vector_store_from_path(source_path)
         self.convs_path = init_convs(self.date_path)
+        self._register_snapshot()
 
-    def load_vector_store(self):
+    def load_vector_store(self, date_path=None):
         """
         Load the vector store from the date path.
 
         The vector store path is saved to a file in the data directory.
         The vector store is loaded from the vector store path.
+        An in-place update (watch mode) that was interrupted is applied again.
 
+        :param date_path: The date directory to load. If None, the latest complete date directory is loaded.
         :return: The path of the vector store.
         """
-        self.date_path = get_prev_date_dir(self.ver_path)
+        self.date_path = date_path or get_prev_date_dir(self.ver_path)
+        if self.date_path is None:
+            raise ValueError(f"Version {self.version_num} has no vector store.")
         self.vectorstore = VectorStore(self.date_path)
         self.vectorstore.load_vector_store()
+        recovered = self.vectorstore.recover_update()
+        if recovered is not None:
+            get_catalog().update_files(self.date_path, *recovered)
         self.convs_path = get_convs_path(self.date_path)
 
+    def resume_vector_store(self, date_path=None):
+        """
+        Resume an interrupted build of the version's vector store.
+
+        The build continues from the last batch committed to the build journal of the date directory.
+        Once the build completes, the resumed date directory becomes the version's current vector store.
+
+        :param date_path: The date directory of the build to resume. If None, the latest interrupted build is resumed.
+        :return: The path of the resumed date directory.
+        """
+        if date_path is None:
+            interrupted_date_dirs = get_interrupted_date_dirs(self.ver_path)
+            if not interrupted_date_dirs:
+                raise ValueError(f"No interrupted build found for version {self.version_num}.")
+            date_path = interrupted_date_dirs[-1]
+        vectorstore = VectorStore(date_path)
+        vectorstore.resume_build()
+        convs_path = get_convs_path(date_path)
+        if not os.path.exists(convs_path):
+            convs_path = init_convs(date_path)
+
+        self.date_path = date_path
+        self.vectorstore = vectorstore
+        self.convs_path = convs_path
+        self.conv = None
+        self._register_snapshot()
+        return self.date_path
+
+    def watch_source(self):
+        """
+        Watch the source path of the current vector store and apply its changes to the vector store in place,
+        so new and modified files become queryable within seconds. Blocks until interrupted (Ctrl+C).
+        The changes made while the source was not watched are applied first. The chunks manifest, the files
+        details, the build journal and the catalog are updated with every applied batch.
+
+        :return: None
+        """
+        if not self.vectorstore:
+            raise ValueError("No vector store is initialized. Initialize a vector store first.")
+
+        def on_changes(changed_files, deleted_files):
+            changed_details = self.vectorstore.apply_changes(changed_files, deleted_files)
+            get_catalog().update_files(self.date_path, changed_details, deleted_files)
+
+        watcher = SourceWatcher(self.vectorstore.source_path, on_changes, self.vectorstore.get_files_details(),
+                                debounce_seconds=settings.WATCH_DEBOUNCE_SECONDS,
+                                poll_seconds=settings.WATCH_POLL_SECONDS, batch_files=settings.WATCH_BATCH_FILES,
+                                polling=settings.WATCH_POLLING, max_retries=settings.WATCH_MAX_RETRIES)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.stop()
+
+    def _register_snapshot(self):
+        """
+        Record the current date directory, its source path and its file manifest in the catalog.
+        """
+        get_catalog().add_snapshot(self.version_num, self.date_path, self.vectorstore.source_path,
+                                   get_embedding_model_name(), self.vectorstore.get_files_details())
+
     def start_conversation(self):
         """
         Start a new conversation using the vector store.
@@ -64,9 +140,7 @@ class Version:
 
         :return: The ID of the conversation.
         """
-        self.conv = Conversation(convs_dir=self.convs_path)
-        conv_retrieval_chain = self.conv.start_conversation(self.vectorstore.get_retriever())
-        # return conv_retrieval_chain
+        self.conv = self.open_conversation()
         return self.conv.conv_id
 
     def continue_conversation(self, conv_id):
@@ -81,10 +155,49 @@ class Version:
         :param conv_id: The ID of the conversation to continue.
         :return: The ID of the conversation.
         """
-        self.conv = Conversation(convs_dir=self.convs_path, conv_id=conv_id)
-        _ = self.conv.continue_conversation(self.vectorstore.get_retriever())
+        self.conv = self.open_conversation(conv_id)
         return self.conv.conv_id
 
+    def open_conversation(self, conv_id=None):
+        """
+        Open a conversation of the current vector store without making it the active conversation,
+        so several conversations of the version can be served at the same time (see SessionManager).
+
+        The conversations of the version share the retriever of the vector store.
+
+        :param conv_id: The ID of the conversation to continue. If None, a new conversation is started.
+        :return: The conversation.
+        """
+        if not self.vectorstore:
+            raise ValueError("No vector store is initialized. Initialize a vector store first.")
+        conv = Conversation(convs_dir=self.convs_path, conv_id=conv_id, answer_cache=self._get_answer_cache(),
+                            version_num=self.version_num, date_path=self.date_path)
+        if conv_id is None:
+            conv.start_conversation(self._get_retriever())
+        else:
+            conv.continue_conversation(self._get_retriever())
+        return conv
+
+    def _get_retriever(self):
+        """
+        Get the retriever of the current vector store, created once per vector store.
+
+        :return: The retriever.
+        """
+        if self._retriever is None or self._retriever[0] is not self.vectorstore:
+            self._retriever = (self.vectorstore, self.vectorstore.get_retriever())
+        return self._retriever[1]
+
+    def _get_answer_cache(self):
+        """
+        Get the answer cache of the current vector store, or None if the answer cache is disabled in the settings.
+
+        :return: The answer cache or None.
+        """
+        if not settings.ANSWER_CACHE:
+            return None
+        return self.vectorstore.get_answer_cache()
+
     def query(self, question):
         """
         Query the active conversation with a question.
@@ -99,6 +212,19 @@ class Version:
             raise ValueError("No conversation is active. Start or continue a conversation first.")
         return self.conv.query(question)
 
+    def stream_query(self, question):
+        """
+        Query the active conversation with a question and stream the answer.
+
+        If no conversation is active, a ValueError is raised.
+
+        :param question: The question to ask the conversation.
+        :return: A generator of the tokens of the response.
+        """
+        if not self.conv:
+            raise ValueError("No conversation is active. Start or continue a conversation first.")
+        return self.conv.stream_query(question)
+
     def get_messages(self, conv_id=None):
         """
         Get the messages of the current conversation.
@@ -111,10 +237,31 @@ class Version:
         """
         if not self.conv and not conv_id:
             raise ValueError("No conversation is active. Start or continue a conversation first.")
-        if conv_id:
-            self.continue_conversation(conv_id)
+        if conv_id and (not self.conv or self.conv.conv_id != conv_id):
+            # Read the other conversation's log without replacing the active conversation
+            return Conversation(convs_dir=self.convs_path, conv_id=conv_id).get_messages()
         return self.conv.get_messages()
 
+    def get_size(self):
+        """
+        Return an estimate of the memory taken by the loaded vector store (see VectorStore.get_size).
+
+        :return: The size in bytes.
+        """
+        return self.vectorstore.get_size() if self.vectorstore else 0
+
+    def close(self):
+        """
+        Close the vector store and flush the log of the active conversation. The version has to be loaded again
+        to be used.
+        """
+        if self.conv is not None:
+            self.conv.log.sync()
+            self.conv = None
+        if self.vectorstore is not None:
+            self.vectorstore.close()
+        self._retriever = None
+
     def update_vector_store(self):
         """
         Update the vector store with new files.
@@ -140,6 +287,7 @@ class Version:
             self.vectorstore = new_vectorstore
             self.convs_path = convs_path
             self.conv = None
+            self._register_snapshot()
         except ValueError as e:
             delete_date_dir(new_date_path)
             e = f"{str(e)} Failed to update vector store. Rolling back to previous vector store."
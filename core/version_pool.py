@@ -0,0 +1,217 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from DataLayer.data_module import get_prev_date_dir
+from core.version import Version
+from config import settings
+
+
+class VersionPool:
+    """
+    Bounded LRU pool of loaded versions, so switching between recently used versions does not load their vector
+    stores (and create their clients) again.
+
+    Versions are keyed by their version number and the date directory of their loaded vector store. A version whose
+    vector store was superseded by a newer date directory (e.g. updated by another process) is loaded again.
+    When the pool holds more than max_versions versions, or their vector stores take more than max_memory_mb
+    (estimated from the size of their files), the least recently used versions are evicted: the evict hooks are
+    called and the version is closed, which releases its vector store files and memory.
+    Versions that are in use (see is_in_use) or leased (see lease) are not evicted.
+
+    Attributes:
+        data_dir (str): The directory where all versions are stored.
+        max_versions (int): The maximal number of loaded versions.
+        max_memory_mb (float): The maximal estimated memory of the loaded vector stores, in MB.
+        is_in_use: Callable taking a version and returning whether it must not be evicted, or None.
+    """
+
+    def __init__(self, data_dir=settings.DATA_DIR, max_versions=settings.VERSION_POOL_SIZE,
+                 max_memory_mb=settings.VERSION_POOL_MAX_MB, is_in_use=None):
+        self.data_dir = data_dir
+        self.max_versions = max(1, max_versions)
+        self.max_memory_mb = max_memory_mb
+        self.is_in_use = is_in_use
+
+        self._lock = threading.Lock()
+        self._versions = OrderedDict()
+        self._sizes = {}
+        self._load_locks = {}
+        self._leases = {}
+        self._evict_hooks = []
+
+    def add_evict_hook(self, hook):
+        """
+        Register a function called with every evicted version, before the version is closed.
+
+        :param hook: Callable taking the evicted version.
+        """
+        self._evict_hooks.append(hook)
+
+    def get(self, version_num, leased=False):
+        """
+        Return a version with its latest vector store loaded, loading it if it is not in the pool.
+        Concurrent requests of a version that is being loaded wait for it, while the other versions remain available.
+        Unless it is leased, the version may be evicted (and closed) by a concurrent request of another version as
+        soon as it is returned; use lease to use it from concurrent threads.
+
+        :param version_num: The version of the experiment.
+        :param leased: Whether to take a lease on the version, which must be released with release.
+        :return: The version.
+        """
+        date_path = get_prev_date_dir(rf"{self.data_dir}\v_{version_num}")
+        key = (version_num, date_path)
+        with self._lock:
+            version = self._lookup(key)
+            if version is not None:
+                if leased:
+                    self._acquire(version)
+                return version
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                version = self._lookup(key)
+                if version is not None and leased:
+                    self._acquire(version)
+            if version is None:
+                version = Version(version_num, self.data_dir)
+                version.load_vector_store(date_path)
+                self.add(version, leased=leased)
+        with self._lock:
+            self._load_locks.pop(key, None)
+        return version
+
+    @contextmanager
+    def lease(self, version_num):
+        """
+        Context manager leasing a version of the pool (see get), so it is not evicted while it is used.
+
+        :param version_num: The version of the experiment.
+        :return: The version.
+        """
+        version = self.get(version_num, leased=True)
+        try:
+            yield version
+        finally:
+            self.release(version)
+
+    def _acquire(self, version):
+        self._leases[id(version)] = self._leases.get(id(version), 0) + 1
+
+    def release(self, version):
+        """
+        Release a lease taken by get, and evict the least recently used versions the lease kept beyond the limits.
+
+        :param version: The leased version.
+        """
+        with self._lock:
+            count = self._leases.pop(id(version), 0) - 1
+            if count > 0:
+                self._leases[id(version)] = count
+            evicted = self._trim()
+        for evicted_version in evicted:
+            self._close(evicted_version)
+
+    def _is_pinned(self, version):
+        """
+        :return: Whether a version is leased or in use. Must be called while holding the lock.
+        """
+        return id(version) in self._leases or (self.is_in_use is not None and self.is_in_use(version))
+
+    def _lookup(self, key):
+        """
+        Return the version of a key and mark it as recently used. Must be called while holding the lock.
+        Versions whose date directory changed since they were added (e.g. updated in place) are found under their
+        new date directory.
+        """
+        for entry_key, version in list(self._versions.items()):
+            if entry_key != (version.version_num, version.date_path):
+                del self._versions[entry_key]
+                self._versions[(version.version_num, version.date_path)] = version
+                self._sizes[(version.version_num, version.date_path)] = self._sizes.pop(entry_key)
+        version = self._versions.get(key)
+        if version is not None:
+            self._versions.move_to_end(key)
+        return version
+
+    def add(self, version, leased=False):
+        """
+        Add a loaded version to the pool (e.g. a version that was just initialized), as the most recently used.
+        Other loaded vector stores of the same version are evicted unless they are in use or leased, and the pool is
+        trimmed to its limits.
+
+        :param version: The loaded version.
+        :param leased: Whether to take a lease on the version, which must be released with release.
+        """
+        key = (version.version_num, version.date_path)
+        size = version.get_size()
+        with self._lock:
+            self._lookup(key)
+            superseded = [entry_key for entry_key, entry in self._versions.items()
+                          if entry_key[0] == version.version_num and entry is not version
+                          and not self._is_pinned(entry)]
+            if leased:
+                self._acquire(version)
+            self._versions[key] = version
+            self._sizes[key] = size
+            self._versions.move_to_end(key)
+            evicted = [self._pop(entry_key) for entry_key in superseded] + self._trim()
+        for evicted_version in evicted:
+            self._close(evicted_version)
+
+    def _trim(self):
+        """
+        Pop the least recently used versions beyond the limits. Must be called while holding the lock.
+
+        :return: list of the popped versions
+        """
+        evicted = []
+        max_bytes = self.max_memory_mb * 1024 * 1024
+        for key in list(self._versions)[:-1]:  # the most recently used version is always kept
+            if len(self._versions) <= self.max_versions and sum(self._sizes.values()) <= max_bytes:
+                break
+            if self._is_pinned(self._versions[key]):
+                continue
+            evicted.append(self._pop(key))
+        return evicted
+
+    def _pop(self, key):
+        self._sizes.pop(key, None)
+        return self._versions.pop(key)
+
+    def _close(self, version):
+        for hook in self._evict_hooks:
+            hook(version)
+        try:
+            version.close()
+        except Exception as e:
+            print(f"Failed to close version {version.version_num}. Error: {str(e)}")
+
+    def versions(self):
+        """
+        :return: The loaded versions, least recently used first.
+        """
+        with self._lock:
+            return list(self._versions.values())
+
+    def stats(self):
+        """
+        :return: A dictionary with the loaded versions and the estimated memory of their vector stores in MB.
+        """
+        with self._lock:
+            return {
+                "versions": [{"version": version_num, "date_path": date_path}
+                             for version_num, date_path in self._versions],
+                "memory_mb": round(sum(self._sizes.values()) / (1024 * 1024), 1),
+            }
+
+    def close(self):
+        """
+        Close all the versions of the pool.
+        """
+        with self._lock:
+            versions = list(self._versions.values())
+            self._versions.clear()
+            self._sizes.clear()
+        for version in versions:
+            self._close(version)